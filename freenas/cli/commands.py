@@ -38,21 +38,25 @@ import re
 import logging
 import copy
 import getpass
+import threading
 from datetime import datetime
 from freenas.cli.parser import Quote, parse, unparse, dump_ast
 from freenas.cli.complete import NullComplete, EnumComplete
+from freenas.cli.filtering import apply_filter
 from freenas.cli.namespace import (
     Command, PipeCommand, CommandException, description,
-    SingleItemNamespace, Namespace, FilteringCommand
+    SingleItemNamespace, Namespace, FilteringCommand, EntityNamespace
 )
 from freenas.cli.output import (
     Table, ValueType, output_less, format_value,
-    Sequence, read_value, format_output
+    Sequence, read_value, format_output, resolve_cell, output_msg, ProgressBar
 )
 from freenas.cli.output import Object as output_obj, get_terminal_size
 from freenas.cli.descriptions.tasks import translate as translate_task
 from freenas.cli.utils import TaskPromise, describe_task_state, parse_timedelta, add_tty_formatting, quote, to_ascii
 from freenas.dispatcher.shell import ShellClient
+from freenas.dispatcher.rpc import RpcException
+from freenas.utils import query as q
 from freenas.utils.url import wrap_address
 from urllib.parse import urlparse
 
@@ -67,6 +71,9 @@ _ = t.gettext
 
 logger = logging.getLogger('cli.commands')
 
+BULK_MAX_PENDING = 8
+TASK_FINAL_STATES = ('FINISHED', 'FAILED', 'ABORTED')
+
 
 def create_variable_completer(name, var):
     if var.type == ValueType.BOOLEAN:
@@ -269,7 +276,7 @@ class BuiltinCommand(Command):
                 {"cmd": "-", "description": "Go back to previous namespace"}
             ]
             filtering_cmd_dict_list = []
-            for key, value in context.ml.builtin_commands.items():
+            for key, value in dict(context.ml.builtin_commands, **context.ml.pipe_commands).items():
                 if hasattr(value, 'description') and value.description is not None:
                     description = value.description
                 else:
@@ -754,7 +761,7 @@ class HelpCommand(Command):
                 {"cmd": "-", "description": "Go back to previous namespace"}
             ]
             filtering_cmd_dict_list = []
-            for key, value in context.ml.builtin_commands.items():
+            for key, value in dict(context.ml.builtin_commands, **context.ml.pipe_commands).items():
                 if hasattr(value, 'description') and value.description is not None:
                     description = value.description
                 else:
@@ -1063,20 +1070,42 @@ class PendingCommand(Command):
         ])
 
 
-@description("Wait for a task to complete and show its progress")
+@description("Wait for tasks to complete and show their progress")
 class WaitCommand(Command):
     """
     Usage: wait
-           wait <task ID>
+           wait <task ID> [<task ID> ...]
+           wait all
 
     Example: wait
              wait 100
+             wait 100 101 102
+             wait all
 
-    Show task progress of either all waiting tasks or the
-    specified task. Use 'task show' to determine the task ID.
+    Show task progress of either the most recently submitted task, the
+    specified tasks or all pending tasks of this session. Several tasks
+    are shown as a live dashboard, one line per task.
+    Use 'task show' to determine the task ID.
     """
 
     def run(self, context, args, kwargs, opargs):
+        if args == ['all']:
+            tids = sorted(t['id'] for t in context.pending_tasks.values() if t['session'] == context.session_id)
+            if not tids:
+                return 'No pending tasks found'
+
+            context.wait_for_tasks(tids)
+            return
+
+        if len(args) > 1:
+            try:
+                tids = [int(i) for i in args]
+            except ValueError:
+                raise CommandException('Task id arguments must be integers')
+
+            context.wait_for_tasks(tids)
+            return
+
         if args:
             try:
                 tid = int(args[0])
@@ -1145,6 +1174,68 @@ class TimeCommand(Command):
         return Sequence(*(result + [msg]))
 
 
+def format_ms(value):
+    return '{0:.1f}'.format(value * 1000) if value is not None else '-'
+
+
+@description("Show RPC call, task and entity subscriber statistics")
+class RpcStatsCommand(Command):
+    """
+    Usage: rpcstats
+           rpcstats reset
+           rpcstats json
+           rpcstats export <file>
+
+    Example: setopt rpc_stats=yes
+             rpcstats
+             rpcstats export /tmp/rpcstats.json
+
+    Show call counts, error counts, transferred bytes and latencies of
+    RPC calls, tasks and entity subscriber syncs recorded so far.
+    Recording has to be enabled first with 'setopt rpc_stats=yes'.
+    'json' displays full statistics, including latency histograms, as
+    JSON and 'export' saves them to a file. 'reset' clears all counters.
+    """
+
+    def run(self, context, args, kwargs, opargs):
+        stats = context.rpc_stats
+        if not args:
+            if not stats.enabled:
+                output_msg(_("Recording is disabled, use 'setopt rpc_stats=yes' to enable it"))
+
+            return Table(stats.rows(), [
+                Table.Column('Kind', 'kind'),
+                Table.Column('Name', 'name'),
+                Table.Column('Count', 'count', ValueType.NUMBER),
+                Table.Column('Errors', 'errors', ValueType.NUMBER),
+                Table.Column('Sent', 'bytes_sent', ValueType.SIZE),
+                Table.Column('Received', 'bytes_received', ValueType.SIZE),
+                Table.Column('Mean (ms)', lambda r: format_ms(r['mean'])),
+                Table.Column('p95 (ms)', lambda r: format_ms(r['p95'])),
+                Table.Column('Max (ms)', lambda r: format_ms(r['max']))
+            ])
+
+        if args[0] == 'reset':
+            stats.reset()
+            return
+
+        if args[0] == 'json':
+            return stats.dump()
+
+        if args[0] == 'export':
+            if len(args) < 2:
+                raise CommandException(_("Provide name of the file to export statistics to"))
+
+            try:
+                stats.dump(args[1])
+            except OSError as err:
+                raise CommandException(_("Cannot write {0}: {1}").format(args[1], err.strerror))
+
+            return
+
+        raise CommandException(_("Invalid syntax {0}. For help see 'help rpcstats'").format(args[0]))
+
+
 class RemoteCommand(Command):
     """
     Usage: remote `<code>`
@@ -1201,6 +1292,60 @@ def map_opargs(opargs, context):
     return mapped_opargs
 
 
+def check_filter_args(args, kwargs):
+    if len(kwargs) > 0:
+        raise CommandException(_(
+            "Invalid syntax {0}. For help see 'help <command>'".format(kwargs)
+        ))
+
+    if len(args) > 0:
+        raise CommandException(_(
+            "Invalid syntax {0}. For help see 'help <command>'".format(args)
+        ))
+
+
+def filter_input(context, input, filtering):
+    """
+    Evaluates filter produced by a pipe stage over its input. Used whenever
+    the pipeline source did not take care of the filter by itself.
+    """
+    if context.pipe_filtered or input is None:
+        return input
+
+    rules = filtering.get('filter', [])
+    params = filtering.get('params', {})
+
+    if isinstance(input, Table):
+        columns = {c.name: c for c in input.columns}
+
+        def getter(row, name):
+            column = columns.get(name)
+            if column:
+                return resolve_cell(row, column.accessor)
+
+            return q.get(row, name) if isinstance(row, dict) else None
+
+        def convert(expr):
+            for i in expr:
+                if len(i) == 2:
+                    yield i[0], list(convert(i[1]))
+
+                if len(i) == 3:
+                    k, op, v = i
+                    column = columns.get(k)
+                    if column and column.vt != ValueType.STRING:
+                        v = read_value(v, column.vt)
+
+                    yield k, op, v
+
+        return Table(apply_filter(input.data, list(convert(rules)), params, getter), input.columns)
+
+    if isinstance(input, (list, tuple)):
+        return Sequence(*apply_filter(input, rules, params))
+
+    return input
+
+
 @description("Filter results based on specified conditions")
 class SearchPipeCommand(PipeCommand):
     """
@@ -1212,7 +1357,8 @@ class SearchPipeCommand(PipeCommand):
     """
 
     def run(self, context, args, kwargs, opargs, input=None):
-        return input
+        check_filter_args(args, kwargs)
+        return filter_input(context, input, {"filter": list(opargs)})
 
     def serialize_filter(self, context, args, kwargs, opargs):
         mapped_opargs = map_opargs(opargs, context)
@@ -1240,6 +1386,7 @@ class FindPipeCommand(SearchPipeCommand):
     Return first item in a list that matches specified conditions.
     """
     def run(self, context, args, kwargs, opargs, input=None):
+        input = super(FindPipeCommand, self).run(context, args, kwargs, opargs, input=input)
         ns = context.pipe_cwd
         prop = ns.primary_key
         if isinstance(input, Table):
@@ -1263,7 +1410,7 @@ class OlderThanPipeCommand(PipeCommand):
     """
 
     def run(self, context, args, kwargs, opargs, input=None):
-        return input
+        return filter_input(context, input, self.serialize_filter(context, args, kwargs, opargs))
 
     def serialize_filter(self, context, args, kwargs, opargs):
         return {"filter": [
@@ -1285,7 +1432,7 @@ class NewerThanPipeCommand(PipeCommand):
     """
 
     def run(self, context, args, kwargs, opargs, input=None):
-        return input
+        return filter_input(context, input, self.serialize_filter(context, args, kwargs, opargs))
 
     def serialize_filter(self, context, args, kwargs, opargs):
         return {"filter": [
@@ -1304,7 +1451,7 @@ class TailPipeCommand(PipeCommand):
     Returns last n entries of a list (entity must have the "timestamp" property).
     """
     def run(self, context, args, kwargs, opargs, input=None):
-        return input
+        return filter_input(context, input, self.serialize_filter(context, args, kwargs, opargs))
 
     def serialize_filter(self, context, args, kwargs, opargs):
         if len(args) == 0:
@@ -1334,7 +1481,8 @@ class ExcludePipeCommand(PipeCommand):
     """
 
     def run(self, context, args, kwargs, opargs, input=None):
-        return input
+        check_filter_args(args, kwargs)
+        return filter_input(context, input, {"filter": [('nor', (i,)) for i in opargs]})
 
     def serialize_filter(self, context, args, kwargs, opargs):
         mapped_opargs = map_opargs(opargs, context)
@@ -1370,7 +1518,7 @@ class SortPipeCommand(PipeCommand):
         return {"params": {"sort": args}}
 
     def run(self, context, args, kwargs, opargs, input=None):
-        return input
+        return filter_input(context, input, self.serialize_filter(context, args, kwargs, opargs))
 
 
 @description("Limit output to specified number of items")
@@ -1395,7 +1543,7 @@ class LimitPipeCommand(PipeCommand):
         return {"params": {"limit": args[0]}}
 
     def run(self, context, args, kwargs, opargs, input=None):
-        return input
+        return filter_input(context, input, self.serialize_filter(context, args, kwargs, opargs))
 
 
 @description("Display output of the specific field")
@@ -1417,3 +1565,175 @@ class SelectPipeCommand(PipeCommand):
             result = Table(None, [Table.Column('Result', 'result')])
             result.data = ({'result': x.get(args[0])} for x in input)
             return result
+
+
+class BulkPipeCommand(PipeCommand):
+    """
+    Base for pipe stages applying an operation to every entity of the input.
+
+    Each row is validated up front, then tasks are submitted with at most
+    BULK_MAX_PENDING of them running at once. Returns a summary table.
+    """
+    def __init__(self):
+        self.must_be_last = True
+
+    def check(self, ns, args, kwargs, opargs):
+        pass
+
+    def apply(self, ns, item, kwargs, opargs):
+        raise NotImplementedError()
+
+    def run(self, context, args, kwargs, opargs, input=None):
+        ns = context.pipe_cwd
+        if not isinstance(ns, EntityNamespace) or not isinstance(input, Table):
+            raise CommandException(_("This command can only follow listing of entities, eg. 'share show | search ...'"))
+
+        self.check(ns, args, kwargs, opargs)
+        subscriber = context.entity_subscribers['task']
+        cv = threading.Condition()
+        finished = {}
+        pending = {}
+        results = []
+        rows = list(input.data)
+
+        def on_task(*args):
+            task = args[-1]
+            if task['state'] in TASK_FINAL_STATES:
+                with cv:
+                    finished[task['id']] = task
+                    cv.notify_all()
+
+        def collect(block):
+            with cv:
+                if block and not any(i in finished for i in pending):
+                    cv.wait(1)
+
+                done = [i for i in pending if i in finished]
+
+            if block and not done:
+                # Tasks which went through all states before we subscribed
+                for i in list(pending):
+                    task = subscriber.get(i)
+                    if task and task['state'] in TASK_FINAL_STATES:
+                        on_task(task)
+                        done.append(i)
+
+            for i in done:
+                task = finished.pop(i)
+                result = pending.pop(i)
+                result['state'] = task['state']
+                if task['state'] != 'FINISHED':
+                    result['error'] = q.get(task, 'error.message') or task['state'].lower()
+
+        def update_progress():
+            completed = sum(1 for r in results if r['state'] != 'RUNNING')
+            failed = sum(1 for r in results if r['state'] not in ('FINISHED', 'RUNNING'))
+            progress.update(
+                percentage=completed * 100 / len(rows),
+                message=_("{0} of {1} done, {2} failed").format(completed, len(rows), failed)
+            )
+
+        progress = ProgressBar() if rows else None
+        subscriber.on_add.add(on_task)
+        subscriber.on_update.add(on_task)
+        try:
+            with context.tasks_nonblocking():
+                for row in rows:
+                    name = ns.primary_key.do_get(row) if ns.primary_key else row.get('id')
+                    result = {'name': name, 'task': None, 'state': 'FAILED', 'error': None}
+                    results.append(result)
+                    item = SingleItemNamespace(name, ns, context)
+                    item.orig_entity = copy.deepcopy(row)
+                    item.entity = copy.deepcopy(row)
+
+                    try:
+                        tid = self.apply(ns, item, kwargs, opargs)
+                    except (CommandException, RpcException, ValueError) as err:
+                        result['error'] = str(err)
+                        update_progress()
+                        continue
+
+                    if tid is None:
+                        result['state'] = 'FINISHED'
+                        update_progress()
+                        continue
+
+                    result.update(task=tid, state='RUNNING')
+                    pending[tid] = result
+                    while len(pending) >= BULK_MAX_PENDING:
+                        collect(True)
+                        update_progress()
+
+                while pending:
+                    collect(True)
+                    update_progress()
+        except KeyboardInterrupt:
+            for result in pending.values():
+                result.update(state='RUNNING', error=_('Still running in background'))
+        finally:
+            subscriber.on_add.discard(on_task)
+            subscriber.on_update.discard(on_task)
+            if progress:
+                progress.finish()
+                progress.end()
+
+        return Table(results, [
+            Table.Column(_('Name'), 'name'),
+            Table.Column(_('Task ID'), 'task', ValueType.NUMBER),
+            Table.Column(_('State'), 'state'),
+            Table.Column(_('Error'), 'error')
+        ])
+
+
+@description("Sets properties of all entities in the input")
+class BulkSetPipeCommand(BulkPipeCommand):
+    """
+    Usage: <command> | set <property>=<value> ...
+
+    Example: share show | search type==nfs | set enabled=no
+
+    Sets given properties on every entity listed by the preceding command,
+    running the resulting tasks in parallel. Every entity is validated the
+    same way 'set' validates a single one; entities which fail validation
+    are reported in the summary and not submitted.
+    """
+    def check(self, ns, args, kwargs, opargs):
+        if not ns.allow_edit:
+            raise CommandException(_("Entities in this namespace cannot be edited"))
+
+        if args or not (kwargs or opargs):
+            raise CommandException(_("Please specify properties to set, eg. '| set enabled=no'"))
+
+    def apply(self, ns, item, kwargs, opargs):
+        item.apply_properties(dict(kwargs), list(opargs))
+        item.modified = True
+        return ns.save(item)
+
+
+@description("Deletes all entities in the input")
+class BulkDeletePipeCommand(BulkPipeCommand):
+    """
+    Usage: <command> | delete [<arg>=<value> ...]
+
+    Example: volume snapshot show | search name~=^auto | delete
+
+    Deletes every entity listed by the preceding command, running the
+    resulting tasks in parallel. Arguments are the same as of the
+    per-entity 'delete' command.
+    """
+    def check(self, ns, args, kwargs, opargs):
+        if not ns.allow_create:
+            raise CommandException(_("Entities in this namespace cannot be deleted"))
+
+        if args or opargs:
+            raise CommandException(_("Invalid syntax. For help see 'help <command>'"))
+
+    def apply(self, ns, item, kwargs, opargs):
+        for k, v in kwargs.items():
+            prop = item.get_mapping(k) if item.has_property(k) else None
+            if not prop or not prop.delete_arg:
+                raise CommandException(_("Invalid argument '{0}'").format(k))
+
+            prop.do_set(item.delete_args, v, item.entity)
+
+        return ns.delete(item, kwargs)
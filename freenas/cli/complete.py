@@ -25,11 +25,129 @@
 #
 #####################################################################
 
+import json
+import time
+import logging
+import threading
+import collections
 from freenas.cli.output import format_value
 from freenas.cli.utils import quote
 from copy import deepcopy
 
 
+COMPLETION_CACHE_SIZE = 64
+
+
+class CompletionCache(object):
+    """
+    Results of RPC calls backing tab completion, keyed on method and call args.
+
+    Entries expire after 'completion_cache_ttl' seconds (0 disables caching)
+    and are dropped early when the entity they come from changes.
+    """
+    def __init__(self, context, size=COMPLETION_CACHE_SIZE):
+        self.context = context
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger('cli.complete')
+
+    @property
+    def ttl(self):
+        return self.context.variables.get('completion_cache_ttl') or 0
+
+    @staticmethod
+    def key(method, args):
+        return method, json.dumps(list(args or ()), sort_keys=True, default=str)
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return None
+
+            timestamp, result = entry
+            if time.monotonic() - timestamp > self.ttl:
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return entry
+
+    def store(self, key, result):
+        if self.ttl <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (time.monotonic(), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def fetch(self, key, method, args):
+        result = self.context.call_sync(method, *(args or ()))
+        self.store(key, result)
+        return result
+
+    def call(self, method, args=None):
+        key = self.key(method, args)
+        entry = self.lookup(key)
+        if entry:
+            return entry[1]
+
+        with self.lock:
+            thread = self.pending.get(key)
+
+        # Prefetch already in flight, wait for it rather than issuing another call
+        if thread:
+            thread.join(self.context.variables.get('timeout') or None)
+            entry = self.lookup(key)
+            if entry:
+                return entry[1]
+
+        return self.fetch(key, method, args)
+
+    def prefetch(self, method, args=None):
+        if self.ttl <= 0:
+            return
+
+        key = self.key(method, args)
+        if self.lookup(key):
+            return
+
+        def worker():
+            try:
+                self.fetch(key, method, args)
+            except BaseException as err:
+                self.logger.debug('Prefetch of {0} failed: {1}'.format(method, err))
+            finally:
+                with self.lock:
+                    self.pending.pop(key, None)
+
+        with self.lock:
+            if key in self.pending:
+                return
+
+            thread = threading.Thread(target=worker, daemon=True)
+            self.pending[key] = thread
+
+        thread.start()
+
+    def invalidate(self, name):
+        """
+        Drops results of methods belonging to entity 'name' or its children.
+        """
+        with self.lock:
+            for key in list(self.entries):
+                if key[0] == name or key[0].startswith(name + '.'):
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
 class NullComplete(object):
     def __init__(self, name, **kwargs):
         self.name = name
@@ -57,6 +175,11 @@ class EntitySubscriberComplete(NullComplete):
         self.filter = filter or []
 
     def choices(self, context, token):
+        if len(self.filter) == 1 and len(self.filter[0]) == 3 and self.filter[0][1] == '=':
+            key, op, value = self.filter[0]
+            entities = context.entity_subscribers.lookup_all(self.datasource, key, value)
+            return [self.mapper(i) for i in entities] + self.extra
+
         return context.entity_subscribers[self.datasource].query(*self.filter, callback=self.mapper) + self.extra
 
 
@@ -67,7 +190,7 @@ class RpcComplete(EntitySubscriberComplete):
 
     def choices(self, context, token):
         result = deepcopy(self.extra)
-        datasource = context.call_sync(self.datasource, *(self.call_args or ()))
+        datasource = context.completion_cache.call(self.datasource, self.call_args)
 
         if isinstance(datasource, dict):
             if self.mapper:
@@ -95,6 +218,9 @@ class RpcComplete(EntitySubscriberComplete):
 
         return result
 
+    def prefetch(self, context):
+        context.completion_cache.prefetch(self.datasource, self.call_args)
+
 
 class MultipleSourceComplete(NullComplete):
     def __init__(self, name, components, extra=None, **kwargs):
@@ -108,3 +234,11 @@ class MultipleSourceComplete(NullComplete):
             result.extend(c.choices(context, token))
 
         return result
+
+
+def rpc_completions(completions):
+    for c in completions:
+        if isinstance(c, RpcComplete):
+            yield c
+        elif isinstance(c, MultipleSourceComplete):
+            yield from rpc_completions(c.components)
@@ -28,14 +28,37 @@
 import os
 import sys
 import tty
+import codecs
 import curses
 import termios
 import select
-from threading import Thread
+from threading import Thread, Lock, Event
 from urllib.parse import urlparse
 from freenas.dispatcher.shell import VMConsoleClient
 
 
+# Largest chunk read from stdin at once and largest single outbound write
+READ_SIZE = 4096
+MAX_WRITE_SIZE = 64 * 1024
+
+# Chunks at least this long are treated as pasted input: before sending
+# them, wait up to COALESCE_DELAY seconds for more to arrive. Typed keys are
+# shorter and go out immediately.
+PASTE_THRESHOLD = 16
+COALESCE_DELAY = 0.005
+
+
+def partial_match(data, seq):
+    """
+    Returns length of the longest suffix of data which is a proper prefix of seq.
+    """
+    for n in range(min(len(data), len(seq) - 1), 0, -1):
+        if data.endswith(seq[:n]):
+            return n
+
+    return 0
+
+
 class Console(object):
     def __init__(self, context, id):
         self.context = context
@@ -45,10 +68,39 @@ class Console(object):
         eseq = bytes(self.context.variables.get('vm.console_interrupt'), 'utf-8').decode('unicode_escape')
         self.esbytes = bytes(eseq, 'utf-8')
         self.eof_r, self.eof_w = os.pipe()
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.output = []
+        self.output_lock = Lock()
+        self.output_ready = Event()
+        self.closed = False
 
     def on_data(self, data):
-        sys.stdout.buffer.write(data)
-        sys.stdout.buffer.flush()
+        # Frames arriving while the writer is busy get written out together
+        with self.output_lock:
+            self.output.append(data)
+
+        self.output_ready.set()
+
+    def output_thread(self):
+        fd = sys.stdout.fileno()
+        sys.stdout.flush()
+        while True:
+            self.output_ready.wait()
+            with self.output_lock:
+                self.output_ready.clear()
+                data = b''.join(self.output)
+                self.output = []
+
+            while data:
+                try:
+                    data = data[os.write(fd, data):]
+                except BlockingIOError:
+                    select.select([], [fd], [])
+                except OSError:
+                    return
+
+            if self.closed:
+                return
 
     def on_close(self):
         try:
@@ -69,16 +121,45 @@ class Console(object):
         self.conn.on_close(self.on_close)
         self.conn.open()
 
+    def send(self, data, final=False):
+        text = self.decoder.decode(data, final)
+        if text:
+            self.conn.write(text)
+
+    def read_input(self, fd):
+        chunk = os.read(fd, READ_SIZE)
+        if len(chunk) < PASTE_THRESHOLD:
+            return chunk
+
+        buf = [chunk]
+        size = len(chunk)
+        while size < MAX_WRITE_SIZE:
+            r, w, x = select.select([fd], [], [], COALESCE_DELAY)
+            if fd not in r:
+                break
+
+            chunk = os.read(fd, READ_SIZE)
+            if not chunk:
+                break
+
+            buf.append(chunk)
+            size += len(chunk)
+
+        return b''.join(buf)
+
     def start(self):
-        # process escape characters using runtime
-        eslen = len(self.esbytes)
-        esidx = 0   # stack pointer for sequence match...
+        # Tail of the input matching the start of the escape sequence,
+        # held back until the following input tells whether it completes it
+        pending = b''
 
         stdin_fd = sys.stdin.fileno()
         r_list = [stdin_fd, self.eof_r]
         old_stdin_settings = termios.tcgetattr(stdin_fd)
+        output_t = Thread(target=self.output_thread)
+        output_t.daemon = True
         try:
             tty.setraw(stdin_fd)
+            output_t.start()
             connect_t = Thread(target=self.connect)
             connect_t.daemon = True
             connect_t.start()
@@ -86,26 +167,29 @@ class Console(object):
                 r, w, x = select.select(r_list, [], [])
 
                 if stdin_fd in r:
-                    ch = sys.stdin.read(1)
-                    bch = bytes(ch, 'utf-8')[0]
-
-                    if self.esbytes[esidx] == bch:
-                        esidx += 1
-                        if esidx == eslen:
-                            self.conn.close()
-                            break
-                    elif esidx > 0:
-                        # reset stack pointer...no match
-                        # BW: possibly write out characters up to this point if sequence not matched?
-                        #     or maybe we write the chars all along?
-                        esidx = 0
-                    else:
-                        self.conn.write(ch)
+                    chunk = self.read_input(stdin_fd)
+                    if not chunk:
+                        self.conn.close()
+                        break
+
+                    data = pending + chunk
+                    idx = data.find(self.esbytes) if self.esbytes else -1
+                    if idx != -1:
+                        self.send(data[:idx], True)
+                        self.conn.close()
+                        break
+
+                    held = partial_match(data, self.esbytes)
+                    pending = data[len(data) - held:] if held else b''
+                    self.send(data[:len(data) - held])
 
                 if self.eof_r in r:
                     self.conn.close()
                     break
         finally:
+            self.closed = True
+            self.output_ready.set()
+            output_t.join(1)
             termios.tcsetattr(stdin_fd, termios.TCSADRAIN, old_stdin_settings)
             curses.wrapper(lambda x: x)
             os.close(self.eof_r)
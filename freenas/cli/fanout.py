@@ -0,0 +1,195 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+"""
+Runs the same commands against many hosts at once.
+
+A CLI context is bound to a single connection (and is registered as the
+process wide config.instance), so every host gets its own worker process.
+Workers evaluate the commands with the regular namespaces and return
+resulting tables as plain rows, everything else they print is captured
+as text. The parent merges tables from all hosts into one, with a host
+column in front, or streams one JSON document per host as it finishes.
+"""
+
+import os
+import sys
+import json
+import time
+import gettext
+import tempfile
+import operator
+import multiprocessing
+from freenas.cli.output import Table, ValueType, output_table, output_msg, resolve_table, format_output
+
+
+t = gettext.translation('freenas-cli', fallback=True)
+_ = t.gettext
+
+DEFAULT_JOBS = 8
+
+# Set by run_fanout() before workers are forked
+_session_factory = None
+
+
+def read_hosts(hosts=None, hosts_file=None):
+    result = []
+    if hosts:
+        result.extend(i.strip() for i in hosts.split(','))
+
+    if hosts_file:
+        with open(hosts_file, 'r') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    result.append(line)
+
+    return [i for i in result if i]
+
+
+def dump_table(table):
+    columns = [(c.name, c.label, c.vt.name, c.width) for c in table.columns]
+    rows = [[] for c in columns]
+    for batch in resolve_table(table):
+        for col, values in zip(rows, batch):
+            col.extend(values)
+
+    return {'columns': columns, 'rows': [list(r) for r in zip(*rows)]}
+
+
+def run_host(host):
+    """
+    Worker entry point. Never raises - failures are reported in the result.
+    """
+    result = {'host': host, 'status': 0, 'error': None, 'tables': [], 'output': ''}
+    started = time.time()
+    sys.stdout.flush()
+
+    with tempfile.TemporaryFile(mode='w+') as capture:
+        saved = os.dup(1)
+        os.dup2(capture.fileno(), 1)
+        try:
+            for ret in _session_factory(host):
+                if isinstance(ret, Table):
+                    result['tables'].append(dump_table(ret))
+                elif ret is not None:
+                    format_output(ret)
+        except SystemExit as err:
+            result['status'] = err.code if isinstance(err.code, int) else 1
+        except BaseException as err:
+            result['status'] = 1
+            result['error'] = str(err)
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved, 1)
+            os.close(saved)
+
+        capture.seek(0)
+        result['output'] = capture.read()
+
+    if result['status'] and not result['error']:
+        lines = result['output'].strip().splitlines()
+        result['error'] = lines[-1] if lines else _('Failed')
+
+    result['elapsed'] = time.time() - started
+    return result
+
+
+def merge_tables(results):
+    """
+    Merges the n-th table of every host into a single table with a host column.
+    """
+    merged = []
+    for r in results:
+        for idx, tab in enumerate(r['tables']):
+            if idx == len(merged):
+                merged.append((tab['columns'], []))
+
+            columns, rows = merged[idx]
+            if [c[0] for c in columns] != [c[0] for c in tab['columns']]:
+                continue
+
+            rows.extend([r['host']] + row for row in tab['rows'])
+
+    for columns, rows in merged:
+        yield Table(rows, [Table.Column(_('Host'), operator.itemgetter(0), name='host')] + [
+            Table.Column(label, operator.itemgetter(idx + 1), ValueType[vt], width, name)
+            for idx, (name, label, vt, width) in enumerate(columns)
+        ])
+
+
+def summary_table(results):
+    return Table(results, [
+        Table.Column(_('Host'), 'host'),
+        Table.Column(_('Status'), 'status', ValueType.NUMBER),
+        Table.Column(_('Time'), lambda r: '{0:.2f}s'.format(r['elapsed'])),
+        Table.Column(_('Error'), 'error')
+    ])
+
+
+def run_fanout(hosts, session_factory, jobs=DEFAULT_JOBS, ndjson=False):
+    """
+    Runs commands on all hosts, at most 'jobs' at a time.
+
+    session_factory(host) is called in the worker process and has to
+    connect to the host and yield results of evaluating the commands there.
+    Returns an exit status which is non-zero if any host failed.
+    """
+    global _session_factory
+    _session_factory = session_factory
+
+    order = {h: i for i, h in enumerate(hosts)}
+    results = []
+    failed = False
+    mp = multiprocessing.get_context('fork')
+    pool = mp.Pool(min(jobs, len(hosts)) or 1, maxtasksperchild=1)
+    try:
+        for result in pool.imap_unordered(run_host, hosts):
+            failed = failed or bool(result['status'])
+            if ndjson:
+                sys.stdout.write(json.dumps(result, default=str) + '\n')
+                sys.stdout.flush()
+            else:
+                results.append(result)
+    finally:
+        pool.terminate()
+
+    if ndjson:
+        return 1 if failed else 0
+
+    results.sort(key=lambda r: order[r['host']])
+    for r in results:
+        if r['output'].strip():
+            output_msg('{0}:'.format(r['host']))
+            output_msg(r['output'].rstrip())
+            output_msg('')
+
+    for table in merge_tables(results):
+        output_table(table)
+
+    output_table(summary_table(results))
+    return 1 if failed else 0
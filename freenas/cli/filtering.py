@@ -0,0 +1,147 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+"""
+Client-side evaluation of query filters.
+
+Filters use the same format as dispatcher queries: a list of
+(field, operator, value) rules, optionally grouped with ('and', [...]),
+('or', [...]) or ('nor', [...]). Params support 'sort', 'limit' and
+'reverse', applied in that order after filtering.
+"""
+
+import re
+import fnmatch
+import operator
+import itertools
+from freenas.utils import query as q
+
+
+def regex_match(value, pattern):
+    return value is not None and re.search(pattern, str(value)) is not None
+
+
+OPERATORS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '~': regex_match,
+    '~=': regex_match,
+    'in': lambda x, y: x in y,
+    'nin': lambda x, y: x not in y,
+    'contains': lambda x, y: y in x,
+    'match': lambda x, y: x is not None and fnmatch.fnmatch(str(x), y),
+}
+
+
+CONJUNCTIONS = {
+    'and': all,
+    'or': any,
+    'nor': lambda i: not any(i),
+}
+
+
+def default_getter(row, name):
+    return q.get(row, name)
+
+
+def compile_rule(rule, getter):
+    if len(rule) == 2:
+        conj, rules = rule
+        if conj not in CONJUNCTIONS:
+            raise ValueError('Invalid conjunction {0}'.format(conj))
+
+        predicates = [compile_rule(i, getter) for i in rules]
+        reduce = CONJUNCTIONS[conj]
+        return lambda row: reduce(p(row) for p in predicates)
+
+    name, op, value = rule
+    if op not in OPERATORS:
+        raise ValueError('Invalid operator {0}'.format(op))
+
+    fn = OPERATORS[op]
+
+    def predicate(row):
+        try:
+            return bool(fn(getter(row, name), value))
+        except (TypeError, KeyError):
+            return False
+
+    return predicate
+
+
+def compile_filter(rules, getter=default_getter):
+    """
+    Turns list of filter rules into a predicate taking a single row.
+    """
+    predicates = [compile_rule(i, getter) for i in rules or []]
+    return lambda row: all(p(row) for p in predicates)
+
+
+def sort_rows(rows, keys, getter=default_getter):
+    def key(name):
+        def fn(row):
+            value = getter(row, name)
+            return value is not None, value
+
+        return fn
+
+    # Stable sorts applied from the least significant key onwards
+    rows = list(rows)
+    for name in reversed(keys):
+        desc = name.startswith('-')
+        if desc:
+            name = name[1:]
+
+        rows.sort(key=key(name), reverse=desc)
+
+    return rows
+
+
+def apply_filter(rows, rules=None, params=None, getter=default_getter):
+    """
+    Returns an iterator over rows matching given rules. Rows are consumed
+    lazily unless sorting or reversing requires all of them at once.
+    """
+    params = params or {}
+    predicate = compile_filter(rules, getter)
+    result = filter(predicate, rows)
+
+    if params.get('sort'):
+        result = sort_rows(result, params['sort'], getter)
+
+    if params.get('limit') is not None:
+        result = itertools.islice(result, int(params['limit']))
+
+    if params.get('reverse'):
+        result = reversed(list(result))
+
+    return iter(result)
@@ -37,7 +37,7 @@ from threading import Timer
 from builtins import input
 from freenas.cli.namespace import Command
 from freenas.cli.output import format_output, output_msg, Table, Sequence
-from freenas.cli.parser import Quote, parse, unparse, read_ast as parser_read_ast, FunctionDefinition
+from freenas.cli.parser import Quote, parse, parse_cache, unparse, read_ast as parser_read_ast, FunctionDefinition
 from freenas.cli.utils import pass_env
 from freenas.cli import config
 from freenas.utils import decode_escapes
@@ -89,6 +89,15 @@ def map_(data, fn):
     return list(map(fn, array))
 
 
+@pass_env
+def pmap(env, data, fn, workers=None):
+    if isinstance(data, dict):
+        array = [{"key": k, "value": v} for k, v in data.items()]
+    else:
+        array = data
+    return config.instance.run_parallel(lambda i: fn(env, i), array, workers)
+
+
 def mapf(array, fmt):
     return list(map(lambda s: fmt % s, array))
 
@@ -175,11 +184,11 @@ def register_command(namespace, name, fn):
         def run(self, context, args, kwargs, opargs):
             return fn(args, kwargs, opargs)
 
-    config.instance.user_commands.append((namespace, name, UserCommand()))
+    config.instance.register_user_command(namespace, name, UserCommand())
 
 
 def unregister_command(namespace, name):
-    pass
+    config.instance.unregister_user_command(namespace, name)
 
 
 def fopen(filename, mode):
@@ -213,6 +222,14 @@ def eval_(ast):
     return Sequence(*config.instance.eval(ast, first=True))
 
 
+def parse_cache_stats():
+    return parse_cache.stats()
+
+
+def rpc_stats():
+    return config.instance.rpc_stats.to_dict()
+
+
 # Reads a json object from a file or a str and returns a parsed dict of it
 def json_load(data):
     if hasattr(data, 'read'):
@@ -250,6 +267,26 @@ def waitfor(promise):
     return promise.wait()
 
 
+def promises_arg(promises):
+    if len(promises) == 1 and isinstance(promises[0], (list, tuple)):
+        return list(promises[0])
+
+    return list(promises)
+
+
+def waitall(*promises):
+    promises = promises_arg(promises)
+    config.instance.wait_for_tasks([p.tid for p in promises], progress=False)
+    return [p.wait() for p in promises]
+
+
+def waitany(*promises):
+    promises = promises_arg(promises)
+    done = config.instance.wait_for_tasks([p.tid for p in promises], wait_any=True, progress=False)
+    done = [t['id'] for t in done]
+    return next((p for p in promises if p.tid in done), None)
+
+
 def dump_ast(ast):
     return ast.to_json()
 
@@ -279,6 +316,7 @@ functions = {
     'sprintf': sprintf,
     'map': map_,
     'mapf': mapf,
+    'pmap': pmap,
     'apply': apply,
     'sum': sum_,
     'avg': avg_,
@@ -312,11 +350,15 @@ functions = {
     'json_load': json_load,
     'json_dump': json_dump,
     'eval': eval_,
+    'parse_cache_stats': parse_cache_stats,
+    'rpc_stats': rpc_stats,
     'join': strjoin,
     'enumerate': lambda a: list(enumerate(a)),
     're_match': re_match,
     're_search': re_search,
     'waitfor': waitfor,
+    'waitall': waitall,
+    'waitany': waitany,
     'dump_ast': dump_ast,
     'read_ast': read_ast,
     'defined': defined,
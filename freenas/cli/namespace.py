@@ -39,6 +39,7 @@ import contextlib
 from freenas.utils import first_or_default, query as q, extend
 from freenas.cli.parser import CommandCall, Literal, Symbol, BinaryParameter, Comment
 from freenas.cli.complete import NullComplete, EnumComplete
+from freenas.cli.filtering import apply_filter
 from freenas.cli.utils import post_save, edit_in_editor, PrintableNone, TaskPromise, EntityPromise
 from freenas.cli.output import (
     ValueType, Object, Table, Sequence,
@@ -57,6 +58,15 @@ def description(descr):
     return wrapped
 
 
+def pushdown(fn):
+    """
+    Marks query() implementations which evaluate filter params by themselves,
+    so that pipe stages like search or sort can be pushed down to them.
+    """
+    fn.pushdown = True
+    return fn
+
+
 def create_completer(prop, obj=None):
     if prop.complete:
         return prop.complete
@@ -75,6 +85,10 @@ def create_completer(prop, obj=None):
 
 
 class Namespace(object):
+    # Set on namespaces whose namespaces() listing depends on server
+    # state, so that it is queried again on every lookup
+    dynamic_namespaces = False
+
     def __init__(self, name):
         self.name = name
         self.extra_commands = None
@@ -83,6 +97,7 @@ class Namespace(object):
         self.localdoc = {}
         self.required_props = None
         self.extra_required_props = None
+        self.index = None
 
     def __str__(self):
         return '<namespace "{0}">'.format(self.get_name())
@@ -125,6 +140,33 @@ class Namespace(object):
 
     def register_namespace(self, ns):
         self.nslist.append(ns)
+        self.invalidate_index()
+
+    def get_index(self):
+        """
+        Returns a (namespaces, commands) pair of dicts keyed by name.
+        The index is built on first use and kept until invalidate_index(),
+        unless the namespace listing is dynamic. Only static namespaces and
+        commands belong in it; namespaces of entities are resolved through
+        namespace_by_name() on every lookup.
+        """
+        if self.dynamic_namespaces:
+            return self.build_index()
+
+        if self.index is None:
+            self.index = self.build_index()
+
+        return self.index
+
+    def build_index(self):
+        namespaces = {}
+        for ns in self.namespaces() or []:
+            namespaces.setdefault(ns.get_name(), ns)
+
+        return namespaces, self.commands()
+
+    def invalidate_index(self):
+        self.index = None
 
 
 class Command(object):
@@ -236,7 +278,117 @@ class LongIndexCommand(Command):
 
 
 class RootNamespace(Namespace):
-    pass
+    """
+    Namespaces of plugins which were not imported yet are registered here by
+    name only, together with a loader importing the plugin. The plugin gets
+    loaded on the first lookup of one of its names, or when all namespaces
+    are listed.
+    """
+    class LazyIndex(dict):
+        def __init__(self, root, namespaces):
+            super(RootNamespace.LazyIndex, self).__init__(namespaces)
+            self.root = root
+
+        def get(self, name, default=None):
+            if name not in self and name in self.root.lazy_namespaces:
+                self.root.load_namespace(name)
+                return self.root.get_index()[0].get(name, default)
+
+            return super(RootNamespace.LazyIndex, self).get(name, default)
+
+    def __init__(self, name):
+        super(RootNamespace, self).__init__(name)
+        self.lazy_namespaces = {}
+
+    def register_lazy_namespace(self, name, loader):
+        self.lazy_namespaces[name] = loader
+        self.invalidate_index()
+
+    def load_namespace(self, name):
+        loader = self.lazy_namespaces.pop(name, None)
+        if loader:
+            loader()
+
+    def register_namespace(self, ns):
+        self.lazy_namespaces.pop(ns.get_name(), None)
+        super(RootNamespace, self).register_namespace(ns)
+
+    def namespaces(self):
+        for name in list(self.lazy_namespaces):
+            self.load_namespace(name)
+
+        return self.nslist
+
+    def build_index(self):
+        namespaces = {}
+        for ns in self.nslist:
+            namespaces.setdefault(ns.get_name(), ns)
+
+        return self.LazyIndex(self, namespaces), self.commands()
+
+
+class EntityJoin(object):
+    """
+    Property getter joining 'field' of an entity against the 'key' field of
+    entities from the 'subscriber' entity subscriber, returning 'attr' (a
+    field name or a callable taking the related entity) of the match.
+    List valued fields are resolved element by element.
+
+    Besides resolving single entities, a whole batch of entities can be
+    resolved with resolve_batch(), which looks up every distinct key once.
+    """
+    def __init__(self, context, subscriber, field, attr='name', key='id', default=None):
+        self.context = context
+        self.subscriber = subscriber
+        self.field = field
+        self.attr = attr
+        self.key = key
+        self.default = default
+
+    def __call__(self, obj):
+        return self.resolve_batch([obj])[0]
+
+    def get_attr(self, entity):
+        if callable(self.attr):
+            return self.attr(entity)
+
+        return q.get(entity, self.attr)
+
+    def fetch(self, keys):
+        result = {}
+        for k in keys:
+            entity = self.context.entity_subscribers.lookup(self.subscriber, self.key, k)
+            if entity:
+                result[k] = self.get_attr(entity)
+
+        return result
+
+    def keys(self, obj):
+        value = q.get(obj, self.field)
+        if value is None:
+            return []
+
+        if isinstance(value, (list, tuple)):
+            return value
+
+        return [value]
+
+    def resolve_batch(self, objs):
+        keys = set()
+        for i in objs:
+            keys.update(self.keys(i))
+
+        related = self.fetch(keys)
+        result = []
+        for i in objs:
+            value = q.get(i, self.field)
+            if isinstance(value, (list, tuple)):
+                result.append([related[k] for k in value if k in related])
+                continue
+
+            result.append(related.get(value, self.default) if value is not None else self.default)
+
+        return result
 
 
 class PropertyMapping(object):
@@ -292,6 +444,15 @@ class PropertyMapping(object):
 
         return q.get(obj, self.get)
 
+    def do_get_batch(self, objs):
+        if not isinstance(self.get, EntityJoin):
+            return [self.do_get(i) for i in objs]
+
+        return [
+            None if self.create_arg or self.condition and not self.condition(o) else v
+            for o, v in zip(objs, self.get.resolve_batch(objs))
+        ]
+
     def do_set(self, obj, value, check_entity=None):
         if not self.can_set(check_entity if check_entity else obj):
             raise ValueError(_("Property '{0}' is not settable for this entity".format(self.name)))
@@ -475,38 +636,7 @@ class ItemNamespace(Namespace):
                         raise CommandException(
                             'Invalid argument or use of argument {0}'.format(arg)
                         )
-            for k, v in list(kwargs.items()):
-                if not self.parent.has_property(k):
-                    raise CommandException('Property {0} not found'.format(k))
-
-            entity = self.parent.entity
-
-            for k, v in list(kwargs.items()):
-                prop = self.parent.get_mapping(k)
-                if prop.set is None or not prop.is_usersetable(entity):
-                    raise CommandException('Property {0} is not writable'.format(k))
-                if prop.regex is not None and not re.match(prop.regex, str(v)):
-                    raise CommandException('Invalid input {0} for property {1}.'.format(v, k))
-                if prop.update_arg:
-                    prop.do_set(self.parent.update_args, v, entity)
-                elif not prop.create_arg:
-                    prop.do_set(entity, v)
-                else:
-                    raise CommandException('Property {0} is a create time argument only. It cannot be set'.format(k))
-
-            for k, op, v in opargs:
-                if op not in ('=+', '=-'):
-                    raise CommandException(
-                        "Syntax error, invalid operator used")
-
-                prop = self.parent.get_mapping(k)
-
-                if op == '=+':
-                    prop.do_append(entity, v)
-
-                if op == '=-':
-                    prop.do_remove(entity, v)
-
+            self.parent.apply_properties(kwargs, opargs)
             self.parent.modified = True
             tid = self.parent.save()
             return EntityPromise(context, tid, self.parent)
@@ -628,6 +758,11 @@ class ItemNamespace(Namespace):
     def on_enter(self):
         self.load()
 
+    def get_index(self):
+        # Available commands and child namespaces depend on the entity, which
+        # may be changed by 'set', by events or by other sessions at any time
+        return self.build_index()
+
     def literalize_value(self, value):
         if isinstance(value, list):
             value = [Literal(v, type(v)) for v in value]
@@ -650,6 +785,45 @@ class ItemNamespace(Namespace):
     def get_diff(self):
         return {k: self.entity[k] for k in self.get_changed_keys()}
 
+    def apply_properties(self, kwargs, opargs):
+        """
+        Validates and applies property assignments (and =+/=- operations) to the entity.
+        """
+        for k, v in list(kwargs.items()):
+            if not self.has_property(k):
+                raise CommandException('Property {0} not found'.format(k))
+
+        entity = self.entity
+
+        for k, v in list(kwargs.items()):
+            prop = self.get_mapping(k)
+            if prop.set is None or not prop.is_usersetable(entity):
+                raise CommandException('Property {0} is not writable'.format(k))
+            if prop.regex is not None and not re.match(prop.regex, str(v)):
+                raise CommandException('Invalid input {0} for property {1}.'.format(v, k))
+            if prop.update_arg:
+                prop.do_set(self.update_args, v, entity)
+            elif not prop.create_arg:
+                prop.do_set(entity, v)
+            else:
+                raise CommandException('Property {0} is a create time argument only. It cannot be set'.format(k))
+
+        for k, op, v in opargs:
+            if op not in ('=+', '=-'):
+                raise CommandException(
+                    "Syntax error, invalid operator used")
+
+            prop = self.get_mapping(k)
+
+            if op == '=+':
+                prop.do_append(entity, v)
+
+            if op == '=-':
+                prop.do_remove(entity, v)
+
+        # Editability and nested namespaces may depend on the new values
+        self.invalidate_index()
+
     def load(self):
         raise NotImplementedError()
 
@@ -857,12 +1031,9 @@ class SingleItemNamespace(ItemNamespace):
             createable = self.parent.createable(self.entity)
 
         if createable:
-            ret = CommandCall([Symbol('create')])
+            command = [Symbol('create')]
         else:
-            ret = CommandCall([
-                Symbol(self.primary_key),
-                Symbol('set')
-            ])
+            command = [Symbol(self.primary_key), Symbol('set')]
 
         return_args = []
         postcreation_mappings = []
@@ -895,15 +1066,10 @@ class SingleItemNamespace(ItemNamespace):
             return_args.append(BinaryParameter(mapping.name, '=', self.literalize_value(value)))
 
         if len(return_args) > 0:
-            ret.args += return_args
-            yield ret
+            yield CommandCall(command + return_args)
 
         if len(postcreation_mappings) > 0:
-            ret = CommandCall([
-                Symbol(self.primary_key),
-                Symbol('set')
-            ])
-
+            return_args = []
             for mapping in postcreation_mappings:
                 value = mapping.do_get(self.entity)
 
@@ -913,9 +1079,9 @@ class SingleItemNamespace(ItemNamespace):
                 if mapping.type == ValueType.ARRAY and value is not None:
                     value = list(value)
 
-                ret.args.append(BinaryParameter(mapping.name, '=', self.literalize_value(value)))
+                return_args.append(BinaryParameter(mapping.name, '=', self.literalize_value(value)))
 
-            yield ret
+            yield CommandCall([Symbol(self.primary_key), Symbol('set')] + return_args)
 
     def load(self):
         if self.saved:
@@ -984,11 +1150,63 @@ class BaseListCommand(FilteringCommand):
                     v = dummy_entity[prop.get_name]
                 yield prop.get_name, op, v
 
+    def can_push_down(self, filtering):
+        def fields(expr):
+            for i in expr:
+                if len(i) == 2:
+                    yield from fields(i[1])
+
+                if len(i) == 3:
+                    yield i[0]
+
+        if not getattr(self.parent.query, 'pushdown', False):
+            return False
+
+        names = list(fields(filtering['filter']))
+        names += [i.lstrip('-') for i in filtering['params'].get('sort', [])]
+        for name in names:
+            prop = self.parent.get_mapping(name)
+            if prop and not isinstance(prop.get, six.string_types):
+                return False
+
+        return True
+
+    def get_value(self, row, name):
+        prop = self.parent.get_mapping(name)
+        if not prop:
+            raise CommandException('Unknown field {0}'.format(name))
+
+        return prop.do_get(row)
+
     def run(self, context, args, kwargs, opargs, filtering=None):
         cols = []
         params = []
         options = {}
 
+        for col in self.parent.property_mappings:
+            if not col.list:
+                continue
+
+            cols.append(Table.Column(
+                col.descr, col.do_get, col.type, col.width, col.name,
+                col.do_get_batch if isinstance(col.get, EntityJoin) else None
+            ))
+
+        if filtering:
+            # Either way the pipe stages which produced the filter are taken care of here
+            context.pipe_filtered = True
+
+        if filtering and not self.can_push_down(filtering):
+            # Source cannot evaluate this filter, so run it over the complete result instead
+            for sortkey in filtering['params'].get('sort', []):
+                if not self.parent.get_mapping(sortkey.lstrip('-')):
+                    raise CommandException('Unknown field {0}'.format(sortkey))
+
+            return Table(
+                apply_filter(self.parent.query([], {}), filtering['filter'], filtering['params'], self.get_value),
+                cols
+            )
+
         if filtering:
             for k, v in filtering['params'].items():
                 if k == 'limit':
@@ -1020,12 +1238,6 @@ class BaseListCommand(FilteringCommand):
 
             params = list(self.__map_filter_properties(filtering['filter']))
 
-        for col in self.parent.property_mappings:
-            if not col.list:
-                continue
-
-            cols.append(Table.Column(col.descr, col.do_get, col.type, col.width, col.name))
-
         return Table(self.parent.query(params, options), cols)
 
 
@@ -1208,6 +1420,18 @@ class EntityNamespace(Namespace):
 
         return base
 
+    def build_index(self):
+        # Entities are looked up through namespace_by_name(), so only
+        # namespaces attached next to them end up in the index
+        namespaces = {}
+        for ns in self.namespaces() or []:
+            if isinstance(ns, SingleItemNamespace) and ns.parent is self:
+                continue
+
+            namespaces.setdefault(ns.get_name(), ns)
+
+        return namespaces, self.commands()
+
     def namespace_by_name(self, name):
         if self.primary_key is None:
             return
@@ -1232,8 +1456,14 @@ class RpcBasedLoadMixin(object):
         self.extra_query_params = []
         self.extra_query_options = {}
         self.call_timeout = 30
+        self.page_size = None
+        self.cursor_key = None
 
+    @pushdown
     def query(self, params, options):
+        if self.page_size and options.get('limit') is None and not options.get('single'):
+            return self.query_pages(params, options)
+
         return self.context.call_sync(
             self.query_call,
             self.extra_query_params + params,
@@ -1241,6 +1471,46 @@ class RpcBasedLoadMixin(object):
             timeout=self.call_timeout
         )
 
+    def query_pages(self, params, options):
+        """
+        Yields all entities matching params, page_size of them per call.
+
+        Results ordered only by cursor_key are paged with a cursor on that
+        field, which stays correct while new entities are being added.
+        Any other ordering falls back to offsets.
+        """
+        options = dict(options)
+        sort = options.pop('sort', None) or [self.cursor_key or self.primary_key_name]
+        if options.pop('reverse', False):
+            sort = [i[1:] if i.startswith('-') else '-' + i for i in sort]
+
+        cursor = self.cursor_key and len(sort) == 1 and sort[0].lstrip('-') == self.cursor_key
+        descending = sort[0].startswith('-')
+        last = None
+        offset = 0
+
+        while True:
+            page_params = list(params)
+            page_options = dict(options, sort=sort, limit=self.page_size)
+            if cursor and last is not None:
+                page_params.append((self.cursor_key, '<' if descending else '>', last))
+            elif not cursor:
+                page_options['offset'] = offset
+
+            page = self.context.call_sync(
+                self.query_call,
+                self.extra_query_params + page_params,
+                extend(self.extra_query_options, page_options),
+                timeout=self.call_timeout
+            )
+            yield from page
+
+            if len(page) < self.page_size:
+                return
+
+            last = q.get(page[-1], self.cursor_key) if cursor else None
+            offset += len(page)
+
     def get_one(self, name):
         return self.context.call_sync(
             self.query_call,
@@ -1255,12 +1525,21 @@ class EntitySubscriberBasedLoadMixin(object):
         super(EntitySubscriberBasedLoadMixin, self).__init__(*args, **kwargs)
         self.primary_key_name = 'id'
         self.entity_subscriber_name = None
+        self.entity_subscriber_scope = None
         self.extra_query_params = []
 
+    @property
+    def entity_subscriber(self):
+        # Scoped namespaces (eg. snapshots of one volume) only sync entities they can show
+        if self.entity_subscriber_scope:
+            return self.context.entity_subscribers.scoped(self.entity_subscriber_name, self.entity_subscriber_scope)
+
+        return self.context.entity_subscribers[self.entity_subscriber_name]
+
     def on_enter(self, *args, **kwargs):
         super(EntitySubscriberBasedLoadMixin, self).on_enter(*args, **kwargs)
-        self.context.entity_subscribers[self.entity_subscriber_name].on_delete.add(self.on_delete)
-        self.context.entity_subscribers[self.entity_subscriber_name].on_update.add(self.on_update)
+        self.entity_subscriber.on_delete.add(self.on_delete)
+        self.entity_subscriber.on_update.add(self.on_update)
 
     def on_delete(self, entity):
         cwd = self.context.ml.cwd
@@ -1277,13 +1556,15 @@ class EntitySubscriberBasedLoadMixin(object):
                 if not cwd.entity:
                     self.context.ml.cd_up()
 
+    @pushdown
     def query(self, params, options):
         if hasattr(self, 'default_sort'):
-            options['sort'] = [self.default_sort]
+            options.setdefault('sort', [self.default_sort])
 
         if not self.context.docgen_run:
-            self.context.entity_subscribers[self.entity_subscriber_name].wait_ready()
-            return self.context.entity_subscribers[self.entity_subscriber_name].query(
+            subscriber = self.entity_subscriber
+            subscriber.wait_ready()
+            return subscriber.query(
                 *(self.extra_query_params + params),
                 **options
             )
@@ -1291,14 +1572,15 @@ class EntitySubscriberBasedLoadMixin(object):
             return {}
 
     def get_one(self, name):
-        self.context.entity_subscribers[self.entity_subscriber_name].wait_ready()
-        return copy.deepcopy(self.context.entity_subscribers[self.entity_subscriber_name].query(
+        subscriber = self.entity_subscriber
+        subscriber.wait_ready()
+        return copy.deepcopy(subscriber.query(
             (self.primary_key_name, '=', name), *self.extra_query_params,
             single=True
         ))
 
     def wait_one(self, name):
-        self.context.entity_subscribers[self.entity_subscriber_name].enforce_update(
+        self.entity_subscriber.enforce_update(
             (self.primary_key_name, '=', name), *self.extra_query_params
         )
 
@@ -1334,6 +1616,7 @@ class NestedObjectLoadMixin(object):
         self.primary_key_name = 'id'
         self.extra_query_params = []
 
+    @pushdown
     def query(self, params, options):
         return q.query(
             q.get(self.parent.entity, self.parent_path, []),
@@ -33,8 +33,10 @@ import enum
 import time
 import contextlib
 import io
-import six
-import pydoc
+import shlex
+import shutil
+import subprocess
+import itertools
 import collections
 
 from freenas.utils.permissions import get_unix_permissions, string_to_int
@@ -45,6 +47,7 @@ from threading import Lock, Thread
 
 
 output_lock = Lock()
+TABLE_BATCH_SIZE = 100
 t = gettext.translation('freenas-cli', fallback=True)
 _ = t.gettext
 
@@ -116,10 +119,11 @@ class Object(list):
 
 class Table(object):
     class Column(object):
-        def __init__(self, label, accessor, vt=ValueType.STRING, width=None, name=None):
+        def __init__(self, label, accessor, vt=ValueType.STRING, width=None, name=None, batch_accessor=None):
             self.name = name
             self.label = label
             self.accessor = accessor
+            self.batch_accessor = batch_accessor
             self.vt = vt
             self.width = width
 
@@ -144,8 +148,10 @@ class Table(object):
         return len(self.data)
 
     def __iter__(self):
-        for i in self.data:
-            yield {c.name: resolve_cell(i, c.accessor) for c in self.columns}
+        names = [c.name for c in self.columns]
+        for batch in resolve_table(self):
+            for row in zip(*batch):
+                yield dict(zip(names, row))
 
     def __getitem__(self, item):
         return {c.name: resolve_cell(self.data[item], c.accessor) for c in self.columns}
@@ -154,9 +160,7 @@ class Table(object):
         return {
             'type': self.__class__.__name__,
             'columns': [i.__getstate__() for i in self.columns],
-            'data': [
-                [resolve_cell(i, c.accessor) for c in self.columns] for i in self.data
-            ]
+            'data': [list(row) for batch in resolve_table(self) for row in zip(*batch)]
         }
 
     def pop(self, pop_index):
@@ -268,6 +272,68 @@ class ProgressBar(object):
         sys.stdout.write('\n')
 
 
+class TaskDashboard(object):
+    """
+    Live progress of several tasks, one line per task.
+
+    Unlike ProgressBar it has no drawing thread, callers redraw it when
+    something changes. On a terminal lines are rewritten in place,
+    otherwise a line is printed whenever state or message of a task
+    changes, or its progress moves by 10%.
+    """
+    def __init__(self):
+        self.tty = sys.stdout.isatty()
+        self.drawn = 0
+        self.last = {}
+
+    @staticmethod
+    def format_duration(seconds):
+        if seconds is None:
+            return '-'
+
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        if hours:
+            return '{0}:{1:02}:{2:02}'.format(hours, minutes, seconds)
+
+        return '{0}:{1:02}'.format(minutes, seconds)
+
+    def format_row(self, row):
+        return '#{0:<6} {1:<9} {2:>7} {3:>8}  ETA {4:>8}  {5}'.format(
+            row['id'],
+            row['state'],
+            '-' if row['percentage'] is None else '{0:.1f}%'.format(row['percentage']),
+            self.format_duration(row['elapsed']),
+            self.format_duration(row['eta']),
+            row['message'] or ''
+        ).rstrip()
+
+    def draw(self, rows):
+        """
+        Draws rows, dicts with id, state, percentage, message, elapsed
+        and eta (both in seconds or None) keys.
+        """
+        if not self.tty:
+            for row in rows:
+                pct = row['percentage']
+                key = (row['state'], row['message'], None if pct is None else int(pct // 10))
+                if self.last.get(row['id']) != key:
+                    self.last[row['id']] = key
+                    sys.stdout.write(self.format_row(row) + '\n')
+
+            sys.stdout.flush()
+            return
+
+        width = get_terminal_size()[1]
+        out = ['\033[{0}A'.format(self.drawn)] if self.drawn else []
+        for row in rows:
+            out.append('\r\033[2K' + self.format_row(row)[:width - 1] + '\n')
+
+        self.drawn = len(rows)
+        sys.stdout.write(''.join(out))
+        sys.stdout.flush()
+
+
 def get_terminal_size(fd=1):
     """
     Returns height and width of current terminal. First tries to get
@@ -301,6 +367,40 @@ def resolve_cell(row, spec):
     return '<unknown>'
 
 
+def resolve_table(table, format_cell=None, batch_size=TABLE_BATCH_SIZE):
+    """
+    Resolves (and optionally formats) every cell of a table exactly once.
+    Rows are consumed lazily and yielded in batches, each batch being a list
+    of columns holding values of the batch rows. Batch size of None yields
+    the whole table as a single batch.
+
+    Columns having a batch_accessor get all values of a batch from a single
+    call to it, which lets joined columns look up related entities once per
+    batch instead of once per row.
+    """
+    def resolve_column(batch, column):
+        if column.batch_accessor:
+            return column.batch_accessor(batch)
+
+        return [resolve_cell(r, column.accessor) for r in batch]
+
+    rows = iter(table.data)
+
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+
+        columns = [resolve_column(batch, c) for c in table.columns]
+        if format_cell:
+            yield [[format_cell(v, c.vt) for v in col] for col, c in zip(columns, table.columns)]
+        else:
+            yield columns
+
+        if batch_size is None:
+            return
+
+
 def read_value(value, tv=ValueType.STRING):
     if value is None:
         if tv == ValueType.ARRAY:
@@ -368,48 +468,76 @@ def read_value(value, tv=ValueType.STRING):
 
 
 def format_value(value, vt=ValueType.STRING, fmt=None):
-    fmt = fmt or config.instance.variables.get('output_format')
     return get_formatter(fmt).format_value(value, vt)
 
 
 def output_value(value, fmt=None, **kwargs):
-    fmt = fmt or config.instance.variables.get('output_format')
     return get_formatter(fmt).output_value(value, **kwargs)
 
 
 def output_list(data, label=_("Items"), fmt=None, **kwargs):
-    fmt = fmt or config.instance.variables.get('output_format')
     return get_formatter(fmt).output_list(data, label, **kwargs)
 
 
 def output_dict(data, key_label=_("Key"), value_label=_("Value"), fmt=None, **kwargs):
-    fmt = fmt or config.instance.variables.get('output_format')
     return get_formatter(fmt).output_dict(data, key_label, value_label)
 
 
 def output_table(table, fmt=None, **kwargs):
-    fmt = fmt or config.instance.variables.get('output_format')
     return get_formatter(fmt).output_table(table, **kwargs)
 
 
 def output_object(item, **kwargs):
     fmt = kwargs.pop('fmt', None)
-    fmt = fmt or config.instance.variables.get('output_format')
     return get_formatter(fmt).output_object(item, **kwargs)
 
 
 def output_tree(tree, children, label, fmt=None, **kwargs):
-    fmt = fmt or config.instance.variables.get('output_format')
     return get_formatter(fmt).output_tree(tree, children, label, **kwargs)
 
 
-def get_formatter(name):
-    module = importlib.import_module('freenas.cli.output.' + name)
-    return module._formatter()
+class FormatterRegistry(object):
+    """
+    Output formatters by name.
+
+    Builtin formatters are imported from the freenas.cli.output package on
+    first use, plugins may add their own with register(). The formatter
+    selected by the 'output_format' opt variable is kept in 'active', so
+    that output calls do not have to resolve it again.
+    """
+    def __init__(self):
+        self.formatters = {}
+        self.active = None
+
+    def register(self, name, formatter):
+        self.formatters[name] = formatter
+
+    def get(self, name):
+        formatter = self.formatters.get(name)
+        if formatter is None:
+            module = importlib.import_module('freenas.cli.output.' + name)
+            formatter = self.formatters[name] = module._formatter()
+
+        return formatter
+
+    def select(self, name):
+        self.active = self.get(name)
+
+
+formatters = FormatterRegistry()
+
+
+def get_formatter(name=None):
+    if name:
+        return formatters.get(name)
+
+    if not formatters.active:
+        formatters.select(config.instance.variables.get('output_format'))
+
+    return formatters.active
 
 
 def output_msg(message, fmt=None, **kwargs):
-    fmt = fmt or config.instance.variables.get('output_format')
     return get_formatter(fmt).output_msg(message, **kwargs)
 
 
@@ -430,17 +558,6 @@ def stdout_redirect(where):
         sys.stdout = sys.__stdout__
 
 
-class StringIO(io.StringIO):
-    """
-    Decode inputs so we can make it work in py2 and py3.
-    In py2 the print function automatically encode inputs.
-    """
-    def write(self, value, *args, **kwargs):
-        if six.PY2 and isinstance(value, str):
-            value = value.decode('utf8')
-        return super(StringIO, self).write(value, *args, **kwargs)
-
-
 def output_less(output_call_list):
     # First check if its either a list or a func (if not then raise TypeError)
     if hasattr(output_call_list, '__call__'):
@@ -457,12 +574,63 @@ def output_less(output_call_list):
                         ' a list of functions. Instead the following type ' +
                         'was received: {0}'.format(type(output_call_list)))
 
-    with stdout_redirect(StringIO()) as new_stdout:
+    with pager_stream() as stream:
         for output_func_call in output_call_list:
-            output_func_call(new_stdout)
+            output_func_call(stream)
+
+
+def get_pager_command():
+    pager = os.environ.get('MANPAGER') or os.environ.get('PAGER')
+    if pager:
+        return shlex.split(pager)
 
-    new_stdout.seek(0)
-    pydoc.pager(new_stdout.read())
+    for i in ('less', 'more'):
+        if shutil.which(i):
+            return [i]
+
+    return None
+
+
+@contextlib.contextmanager
+def pager_stream():
+    """
+    Yields a text stream feeding a pager process, with sys.stdout redirected
+    to it too. Output shows up in the pager as soon as it is written.
+
+    Once the user quits the pager, writes raise BrokenPipeError, which is
+    swallowed here - so whatever was producing the output simply stops.
+    Without a terminal or a pager, output goes straight to stdout.
+    """
+    command = get_pager_command()
+    if not command or not sys.stdout.isatty():
+        yield sys.stdout
+        return
+
+    sys.stdout.flush()
+
+    try:
+        proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+    except OSError:
+        yield sys.stdout
+        return
+
+    stream = io.TextIOWrapper(proc.stdin, errors='replace', line_buffering=True)
+    try:
+        with stdout_redirect(stream):
+            yield stream
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        with contextlib.suppress(BrokenPipeError):
+            stream.close()
+
+        # The pager owns the terminal until the user quits it
+        while True:
+            try:
+                proc.wait()
+                break
+            except KeyboardInterrupt:
+                pass
 
 
 def format_output(object, **kwargs):
@@ -501,6 +669,82 @@ def output_msg_locked(msg):
     output_lock.release()
 
 
+def output_msgs_locked(msgs):
+    """
+    Like output_msg_locked(), but redraws the prompt only once for all messages.
+    """
+    output_lock.acquire()
+    try:
+        config.instance.ml.blank_readline()
+        for msg in msgs:
+            output_msg(msg)
+
+        sys.stdout.flush()
+        config.instance.ml.restore_readline()
+    finally:
+        output_lock.release()
+
+
+class MessageCoalescer(object):
+    """
+    Turns a batch of queued notifications into messages to print.
+
+    Items are plain messages or (key, message) tuples. Of messages sharing
+    a key only the last one in a batch is kept, so a task going through
+    several states at once is reported once. At most 'rate' messages per
+    second are let through (0 disables the limit), keyed ones are dropped
+    first. Dropped messages are counted in 'suppressed'.
+    """
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.suppressed = 0
+
+    def set_rate(self, rate):
+        self.rate = self.tokens = rate
+
+    def collapse(self, items):
+        result = []
+        positions = {}
+        for item in items:
+            key, msg = item if isinstance(item, tuple) else (None, item)
+            if key is not None:
+                if key in positions:
+                    result[positions[key]] = None
+
+                positions[key] = len(result)
+
+            result.append((key, msg))
+
+        return [i for i in result if i is not None]
+
+    def limit(self, items):
+        if not self.rate:
+            return items
+
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        allowed = int(self.tokens)
+        excess = len(items) - allowed
+        if excess <= 0:
+            self.tokens -= len(items)
+            return items
+
+        self.tokens -= allowed
+        self.suppressed += excess
+        order = [i for i, (key, msg) in enumerate(items) if key is not None]
+        order += [i for i, (key, msg) in enumerate(items) if key is None]
+        dropped = set(order[:excess])
+        return [item for i, item in enumerate(items) if i not in dropped] + [
+            (None, _("({0} notifications suppressed, {1} in total)").format(excess, self.suppressed))
+        ]
+
+    def process(self, items):
+        return [msg for key, msg in self.limit(self.collapse(items))]
+
+
 def get_humanized_size(value):
     value = int(value)
     suffixes = [
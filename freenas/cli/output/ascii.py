@@ -36,7 +36,7 @@ import math
 from dateutil.parser import parse
 from texttable import Texttable
 from freenas.cli import config
-from freenas.cli.output import ValueType, get_terminal_size, resolve_cell, get_humanized_size, Table
+from freenas.cli.output import ValueType, get_terminal_size, resolve_cell, resolve_table, get_humanized_size, Table
 from freenas.cli.utils import get_localtime_offset
 from freenas.utils.permissions import int_to_string
 
@@ -152,6 +152,13 @@ class AsciiOutputFormatter(object):
         if vt == ValueType.PASSWORD:
             return "*****"
 
+    @staticmethod
+    def format_cell(value, vt):
+        if isinstance(value, dict):
+            value = ", ".join([":".join([k, v]) for k, v in value.items()])
+
+        return AsciiOutputFormatter.format_value(value, vt)
+
     @staticmethod
     def columnize(data):
         columnizer = Columnizer()
@@ -174,11 +181,13 @@ class AsciiOutputFormatter(object):
         sys.stdout.flush()
 
     @staticmethod
-    def output_table(tab, file=sys.stdout, **kwargs):
+    def output_table(tab, file=None, **kwargs):
+        file = file or sys.stdout
         AsciiOutputFormatter._print_stream_table(tab, file, end=('\n' if kwargs.get('newline', True) else ' '))
 
     @staticmethod
-    def output_object(obj, file=sys.stdout, **kwargs):
+    def output_object(obj, file=None, **kwargs):
+        file = file or sys.stdout
         values = []
         editable_column = False
         for item in obj:
@@ -207,7 +216,9 @@ class AsciiOutputFormatter(object):
             six.print_(table.draw(), file=file, end=('\n' if kwargs.get('newline', True) else ' '))
 
     @staticmethod
-    def output_tree(tree, children, label, label_vt=ValueType.STRING, file=sys.stdout):
+    def output_tree(tree, children, label, label_vt=ValueType.STRING, file=None):
+        file = file or sys.stdout
+
         def branch(obj, indent):
             for idx, i in enumerate(obj):
                 subtree = resolve_cell(i, children)
@@ -228,21 +239,27 @@ class AsciiOutputFormatter(object):
 
     @staticmethod
     def _print_stream_table(tab, file, end):
-        def _print_header(columns, file, end, printer=None):
-            printer.print_header(columns, file, end) if printer else six.print_([col.label for col in columns], file=file, end=end)
+        printer = AsciiStreamTablePrinter()
+        printer.print_header(tab.columns, file, end)
 
-        def _print_rows(rows, columns, file, end, printer=None):
-            for row in rows:
-                printer.print_row(row, file, end) if printer else six.print_([row[col.accessor] for col in columns], file=file, end=end)
+        # Rows are flushed batch by batch, as soon as they got resolved
+        for batch in resolve_table(tab, AsciiOutputFormatter.format_cell):
+            for row in zip(*batch):
+                printer.print_row(row, file, end)
 
-        printer = AsciiStreamTablePrinter()
-        _print_header(tab.columns, file, end, printer=printer)
-        _print_rows(tab.data, tab.columns, file, end, printer=printer)
+            file.flush()
 
     def format_table(tab, conv2ascii=False):
         def _try_conv2ascii(s):
             return ascii(s) if not _is_ascii(s) and isinstance(s, str) else s
 
+        columns = [[] for i in tab.columns]
+        for batch in resolve_table(tab, AsciiOutputFormatter.format_value, None):
+            columns = batch
+
+        if conv2ascii:
+            columns = [[_try_conv2ascii(i) for i in col] for col in columns]
+
         max_width = get_terminal_size()[1]
         table = Texttable(max_width=max_width)
         table.set_deco(0)
@@ -256,11 +273,8 @@ class AsciiOutputFormatter(object):
         max_col_width = (remaining_space - number_columns * 3) / number_columns
         for i in range(0, number_columns):
             current_width = len(tab.columns[i].label)
-            tab_cols_acc = tab.columns[i].accessor
-            if len(tab.data) > 0:
-                max_row_width = max(
-                        [len(str(resolve_cell(row, tab_cols_acc))) for row in tab.data ]
-                        )
+            if len(columns[i]) > 0:
+                max_row_width = max(len(str(value)) for value in columns[i])
                 ideal_widths.insert(i, max_row_width)
                 current_width = max_row_width if max_row_width > current_width else current_width
             if current_width < max_col_width:
@@ -288,12 +302,7 @@ class AsciiOutputFormatter(object):
         table.set_cols_width(widths)
 
         table.set_cols_dtype(['t'] * len(tab.columns))
-        if conv2ascii:
-            table.add_rows([[AsciiOutputFormatter.format_value(
-                _try_conv2ascii(resolve_cell(row, i.accessor)), i.vt) for i in tab.columns] for row in tab.data], False)
-        else:
-            table.add_rows([[AsciiOutputFormatter.format_value(
-                resolve_cell(row, i.accessor), i.vt) for i in tab.columns] for row in tab.data], False)
+        table.add_rows([list(row) for row in zip(*columns)], False)
         return table
 
 
@@ -319,8 +328,6 @@ class AsciiStreamTablePrinter(object):
 
     def print_header(self, columns, file, end):
         self._compute_cols_widths(columns)
-        self._load_accessors(columns)
-        self._load_value_types(columns)
         self._load_header_elements(columns)
         self._trim_elements()
         self._render_lines()
@@ -369,34 +376,17 @@ class AsciiStreamTablePrinter(object):
         extend_cols_widths(space_from_fracts)
         self.usable_display_width = sum(self.cols_widths) + self.borders_space
 
-    def _load_accessors(self, columns):
-        self.accessors = [col.accessor for col in columns]
-
-    def _load_value_types(self, columns):
-        self.value_types = [col.vt for col in columns]
-
     def _load_header_elements(self, columns):
         self.ordered_line_elements = [col.label for col in columns]
         self.ordered_lines_elements = [self.ordered_line_elements]
 
     def _load_row_elements(self, row, conv2ascii=False):
-
-        def convert_nested_dict_to_string(dict):
-            return ", ".join([":".join([k, v]) for k, v in dict.items()])
-
-        for i, acc in enumerate(self.accessors):
-            if callable(acc):
-                elem = acc(row)
-            else:
-                elem = row[acc]
-
-            if isinstance(elem, dict):
-                elem = convert_nested_dict_to_string(elem)
-
+        # Row holds values already resolved and formatted by resolve_table()
+        for elem in row:
             if conv2ascii and isinstance(elem, str):
                 elem = ascii(elem) if not _is_ascii(elem) else elem
 
-            self.ordered_line_elements.append(AsciiOutputFormatter.format_value(elem, self.value_types[i]))
+            self.ordered_line_elements.append(elem)
 
         self.ordered_lines_elements = [self.ordered_line_elements]
 
@@ -487,81 +477,71 @@ class AsciiStreamTablePrinter(object):
 
 
 class Columnizer(object):
-    def __init__(self, display_width=80, col_sep="  "):
-        self.display_width = display_width
+    def __init__(self, display_width=None, col_sep="  "):
+        self.display_width = display_width or get_terminal_size()[1]
         self.col_sep = col_sep
         self.tty_esc_codes_patterns = ['\x1b[1m', '\x1b[0m', '\033[1m', '\033[0m']
         self.saved_start_tty_esc_codes = []
         self.saved_end_tty_esc_codes = []
-        self.saved_start_tty_esc_codes_helper = []
-        self.saved_end_tty_esc_codes_helper = []
 
     def columnize(self, data):
         if not data:
             return ""
         data = self._strip_and_save_tty_esc_codes(data)
+        lengths = [len(i) for i in data]
+        nlines = self._get_lines_count(lengths)
+        cols_widths = self._get_cols_widths(lengths, nlines)
+        return "\n".join(self._format_rows(data, nlines, cols_widths)) + "\n"
 
-        for ncols in range(1, len(data) + 1):
-            rows = self._split_row_data(data, ncols)
-            for i, r in enumerate(rows):
-                if not self._check_row_width(r):
-                    break
-                self.passed = True if i == len(rows) - 1 else False
-            if getattr(self, 'passed', False):
-                break
-        cols_widths = self._get_cols_widths(rows)
-        return "\n".join(self._format_rows(rows, cols_widths)) + "\n"
-
-    def _check_row_width(self, row_data):
-        line_length = sum([len(i) + len(self.col_sep) for i in row_data])
+    def _check_width(self, cols_widths):
+        line_length = sum(cols_widths) + len(self.col_sep) * len(cols_widths)
         return line_length < self.display_width
 
-    def _get_cols_widths(self, rows):
-        cols_widths = [0] * len(max(rows, key=len))
-        for r in rows:
-            for icol, col in enumerate(r):
-                cols_widths[icol] = max([cols_widths[icol], len(col)])
+    def _get_cols_widths(self, lengths, nlines):
+        # Items are laid out column by column, nlines items per column
+        cols_widths = [0] * -(-len(lengths) // nlines)
+        for i, length in enumerate(lengths):
+            icol = i // nlines
+            if length > cols_widths[icol]:
+                cols_widths[icol] = length
         return cols_widths
 
-    def _split_row_data(self, data, ncols):
-        self.saved_start_tty_esc_codes = [self.saved_start_tty_esc_codes_helper[n::ncols] for n in range(0, ncols)]
-        self.saved_end_tty_esc_codes = [self.saved_end_tty_esc_codes_helper[n::ncols] for n in range(0, ncols)]
-        return [data[n::ncols] for n in range(0, ncols)]
-
-    def _format_rows(self, rows, cols_widths=None):
-        def get_rows_elements_lengths(rows_elements):
-            return [[len(element) for element in row_elements] for row_elements in rows_elements]
+    def _get_lines_count(self, lengths):
+        # Binary search for the smallest number of lines at which all the
+        # columns fit on screen, every probe being a single pass over item
+        # widths. Summed widths give a lower bound to start from.
+        total = sum(lengths) + len(self.col_sep) * len(lengths)
+        lo = min(max(1, total // self.display_width), len(lengths))
+        hi = len(lengths)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._check_width(self._get_cols_widths(lengths, mid)):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
 
-        rows_elements_lengths = get_rows_elements_lengths(rows)
-        rows = self._load_and_add_tty_esc_codes(rows)
+    def _format_rows(self, data, nlines, cols_widths):
         ret = []
-        for irow, r in enumerate(rows):
+        for irow in range(0, nlines):
             row = []
-            for icol, col in enumerate(r):
-                row.append(col + (" " * (cols_widths[icol] - rows_elements_lengths[irow][icol])))
+            for i in range(irow, len(data), nlines):
+                padding = " " * (cols_widths[i // nlines] - len(data[i]))
+                row.append(self.saved_start_tty_esc_codes[i] + data[i] + self.saved_end_tty_esc_codes[i] + padding)
             ret.append(self.col_sep.join(row))
         return ret
 
     def _strip_and_save_tty_esc_codes(self, data):
-        self.saved_start_tty_esc_codes_helper = [""] * len(data)
-        self.saved_end_tty_esc_codes_helper = [""] * len(data)
+        self.saved_start_tty_esc_codes = [""] * len(data)
+        self.saved_end_tty_esc_codes = [""] * len(data)
         ret = [None] * len(data)
         for i, word in enumerate(data):
             for p in self.tty_esc_codes_patterns:
                 if word.startswith(p):
-                    self.saved_start_tty_esc_codes_helper[i] = p
+                    self.saved_start_tty_esc_codes[i] = p
                     word = word.split(p)[1]
                 if word.endswith(p):
-                    self.saved_end_tty_esc_codes_helper[i] = p
+                    self.saved_end_tty_esc_codes[i] = p
                     word = word.split(p)[0]
             ret[i] = word
         return ret
-
-    def _load_and_add_tty_esc_codes(self, rows):
-        ret = []
-        for ir, r in enumerate(rows):
-            row = []
-            for icol, col in enumerate(r):
-                row.append(self.saved_start_tty_esc_codes[ir][icol] + col + self.saved_end_tty_esc_codes[ir][icol])
-            ret.append(row)
-        return ret
@@ -25,9 +25,11 @@
 #
 #####################################################################
 
+import sys
 import six
+import textwrap
 from freenas.dispatcher.jsonenc import dumps
-from freenas.cli.output import ValueType, resolve_cell
+from freenas.cli.output import ValueType, resolve_table
 
 
 class JsonOutputFormatter(object):
@@ -71,15 +73,21 @@ class JsonOutputFormatter(object):
         six.print_(dumps(dict(data), indent=4))
 
     @staticmethod
-    def output_table(table):
-        output = []
-        for row in table.data:
-            rowdata = {}
-            for col in table.columns:
-                rowdata[col.label] = JsonOutputFormatter.format_value(resolve_cell(row, col.accessor), col.vt)
-            output.append(rowdata)
-
-        six.print_(dumps(output, indent=4))
+    def output_table(table, file=None, **kwargs):
+        file = file or sys.stdout
+        # Rows are written out as they get resolved, producing the same
+        # document as dumping the whole list at once would
+        labels = [col.label for col in table.columns]
+        count = 0
+        for batch in resolve_table(table, JsonOutputFormatter.format_value):
+            for row in zip(*batch):
+                file.write('[\n' if count == 0 else ',\n')
+                file.write(textwrap.indent(dumps(dict(zip(labels, row)), indent=4), '    '))
+                count += 1
+
+            file.flush()
+
+        six.print_('\n]' if count else '[]', file=file)
 
     @staticmethod
     def output_tree(data, children, label):
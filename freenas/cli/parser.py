@@ -27,6 +27,9 @@
 
 import six
 import re
+import copy
+import threading
+import collections
 import ply.lex as lex
 import ply.yacc as yacc
 from freenas.cli import config
@@ -44,9 +47,14 @@ LITERAL_TYPES = {
 
 LITERAL_TYPES_REVERSED = {v: k for k, v in LITERAL_TYPES.items()}
 logger = logging.getLogger('freenascli.parser')
+PARSE_CACHE_SIZE = 256
 
 
 def ASTObject(name, *args):
+    # AST nodes are slot-based and immutable once constructed, so they can be
+    # shared between evaluations (and cached by the compiler) without copying.
+    # List valued fields (arguments, statement bodies) are stored as tuples.
+    # Literal values are data and are kept as given.
     def string(self):
         return "<{0} {1}>".format(
             self.__class__.__name__,
@@ -54,25 +62,50 @@ def ASTObject(name, *args):
         )
 
     def init(self, *values, **kwargs):
+        for i in slots:
+            object.__setattr__(self, i, None)
+
         for idx, i in enumerate(values):
-            setattr(self, args[idx], i)
+            if isinstance(i, list) and name != 'Literal':
+                i = tuple(i)
+
+            object.__setattr__(self, args[idx], i)
 
         p = kwargs.get('p')
         if p:
-            self.file = p.parser.filename
-            self.line = p.lineno(1)
-            self.column = p.lexpos(1)
-            self.column_end = p.lexspan(len(p) - 1)[1]
+            object.__setattr__(self, 'file', p.parser.filename)
+            object.__setattr__(self, 'line', p.lineno(1))
+            object.__setattr__(self, 'column', p.lexpos(1))
+            object.__setattr__(self, 'column_end', p.lexspan(len(p) - 1)[1])
 
         if name == 'CommandCall':
             # If args[0] of a CommandCall is a token in form "/<something>",
             # eg "/account", split "/" from the rest and prepend it to the
             # args list.
-            if len(self.args) > 0 and isinstance(self.args[0], Symbol):
+            if self.args and isinstance(self.args[0], Symbol):
                 str_name = str(self.args[0].name)
                 if len(str_name) > 1 and str_name[0] == '/':
-                    self.args[0].name = str_name[1:]
-                    self.args.insert(0, Symbol('/'))
+                    symbol = Symbol(str_name[1:])
+                    for i in ('file', 'line', 'column', 'column_end'):
+                        object.__setattr__(symbol, i, getattr(self.args[0], i))
+
+                    object.__setattr__(self, 'args', (Symbol('/'), symbol) + self.args[1:])
+
+    def setattr(self, key, value):
+        raise AttributeError("{0} object is immutable".format(self.__class__.__name__))
+
+    def delattr(self, key):
+        raise AttributeError("{0} object is immutable".format(self.__class__.__name__))
+
+    def reduce(self):
+        return self.__class__, (), {i: getattr(self, i) for i in slots}
+
+    def setstate(self, state):
+        for k, v in state.items():
+            if isinstance(v, list) and name != 'Literal':
+                v = tuple(v)
+
+            object.__setattr__(self, k, v)
 
     def to_json(self):
         ret = {
@@ -94,7 +127,7 @@ def ASTObject(name, *args):
         for i in self.args_list:
             value = getattr(self, i)
 
-            if isinstance(value, list):
+            if isinstance(value, (list, tuple)):
                 value = [to_json_fragment(i) for i in value]
             else:
                 value = to_json_fragment(value)
@@ -103,8 +136,13 @@ def ASTObject(name, *args):
 
         return ret
 
-    dct = {k: None for k in args}
+    slots = args + ('file', 'line', 'column', 'column_end')
+    dct = {'__slots__': slots + ('__weakref__',)}
     dct['__init__'] = init
+    dct['__setattr__'] = setattr
+    dct['__delattr__'] = delattr
+    dct['__reduce__'] = reduce
+    dct['__setstate__'] = setstate
     dct['__str__'] = string
     dct['__repr__'] = string
     dct['args_list'] = args
@@ -132,6 +170,7 @@ AssignmentStatement = ASTObject('AssignmentStatement', 'name', 'expr')
 ConstStatement = ASTObject('ConstStatement', 'name', 'expr')
 ForStatement = ASTObject('ForStatement', 'stmt1', 'expr', 'stmt2', 'body')
 ForInStatement = ASTObject('ForInStatement', 'var', 'expr', 'body')
+ParallelForInStatement = ASTObject('ParallelForInStatement', 'var', 'expr', 'body')
 WhileStatement = ASTObject('WhileStatement', 'expr', 'body')
 UndefStatement = ASTObject('UndefStatement', 'name')
 AssertStatement = ASTObject('AssertStatement', 'expr', 'msg')
@@ -166,7 +205,7 @@ reserved = {
 
 
 tokens = list(reserved.values()) + [
-    'ATOM', 'NUMBER', 'HEXNUMBER', 'BINNUMBER', 'OCTNUMBER', 'STRING',
+    'PARALLEL', 'ATOM', 'NUMBER', 'HEXNUMBER', 'BINNUMBER', 'OCTNUMBER', 'STRING',
     'ASSIGN', 'LPAREN', 'RPAREN', 'EQ', 'NE', 'GT', 'GE', 'LT', 'LE',
     'REGEX', 'UP', 'PIPE', 'LIST', 'COMMA', 'INC', 'DEC', 'PLUS', 'MINUS',
     'MUL', 'DIV', 'EOPEN', 'EOPEN_SYNC', 'COPEN', 'LBRACE', 'RBRACE',
@@ -288,8 +327,15 @@ def t_STRING(t):
     return t
 
 
+# 'parallel' is only a keyword right in front of 'for', so that
+# it stays usable as a name everywhere else
+parallel_for_re = re.compile(r'[ \t]+for\b')
+
+
 def common_atom_routine(t):
     t.type = reserved.get(t.value, 'ATOM')
+    if t.value == 'parallel' and parallel_for_re.match(t.lexer.lexdata, t.lexpos + len(t.value)):
+        t.type = 'PARALLEL'
     if t.type == 'TRUE':
         t.value = True
     elif t.type == 'FALSE':
@@ -443,7 +489,7 @@ def t_ignore_BREAKNL(t):
 
 
 def t_ANY_error(t):
-    if parser.recover_errors:
+    if t.lexer.recover_errors:
         t.lexer.skip(1)
         return
     else:
@@ -451,9 +497,11 @@ def t_ANY_error(t):
 
 
 def t_ANY_eof(t):
+    lexer = t.lexer
     if lexer.parens > 0 or lexer.breaknl:
         more = config.instance.ml.input('... ' * (1 if lexer.breaknl else lexer.parens))
         lexer.breaknl = False
+        lexer.continued = True
         t.lexer.input(more + '\n')
         return t.lexer.token()
 
@@ -564,6 +612,20 @@ def p_for_in_stmt_2(p):
     p[0] = ForInStatement((p[3], p[5]), p[7], p[9], p=p)
 
 
+def p_parallel_for_in_stmt_1(p):
+    """
+    for_in_stmt : PARALLEL FOR LPAREN ATOM IN expr RPAREN block
+    """
+    p[0] = ParallelForInStatement(p[4], p[6], p[8], p=p)
+
+
+def p_parallel_for_in_stmt_2(p):
+    """
+    for_in_stmt : PARALLEL FOR LPAREN ATOM COMMA ATOM IN expr RPAREN block
+    """
+    p[0] = ParallelForInStatement((p[4], p[6]), p[8], p[10], p=p)
+
+
 def p_while_stmt(p):
     """
     while_stmt : WHILE LPAREN expr RPAREN block
@@ -1070,6 +1132,7 @@ def p_error(p):
         column = (lexpos - last_cr) + 1
         return column
 
+    lexer, parser = state.active[-1]
     if parser.recover_errors:
         if p is None:
             e = yacc.YaccSymbol()
@@ -1090,20 +1153,100 @@ def p_error(p):
         raise SyntaxError("Invalid token '{0}' at line {1}, column {2}".format(p.value, p.lineno, column))
 
 
+# Lexer and parser tables are built once at import time. Every parse() call
+# works on its own shallow copies of them, so parsing is safe from multiple
+# threads (completer, event thread, timers) and when re-entered from an
+# EOF continuation prompt.
 lexer = lex.lex(reflags=re.UNICODE)
 parser = yacc.yacc(debug=False, optimize=True)
+state = threading.local()
+
+
+class ParseCache(object):
+    """
+    Bounded LRU cache of parse results, keyed on source text and filename.
+    """
+    def __init__(self, maxsize=PARSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            ast = self.entries.get(key)
+            if ast is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return ast
+
+    def put(self, key, ast):
+        with self.lock:
+            self.entries[key] = ast
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.entries),
+                'maxsize': self.maxsize
+            }
+
+
+parse_cache = ParseCache()
 
 
 def parse(s, filename, recover_errors=False):
-    lexer.lineno = 1
-    lexer.parens = 0
-    lexer.breaknl = False
-    lexer.seen_quote = False
-    lexer.seen_lparen = False
-    parser.input = s
-    parser.filename = filename
-    parser.recover_errors = recover_errors
-    return parser.parse(s, lexer=lexer, tracking=True)
+    # AST nodes are immutable, so cached statements can be handed out to
+    # every caller; only the top level list is copied
+    key = (s, filename, recover_errors)
+    ast = parse_cache.get(key)
+    if ast is not None:
+        return list(ast)
+
+    call_lexer = lexer.clone()
+    call_lexer.lexstatestack = []
+    call_lexer.lineno = 1
+    call_lexer.parens = 0
+    call_lexer.breaknl = False
+    call_lexer.seen_quote = False
+    call_lexer.seen_lparen = False
+    call_lexer.recover_errors = recover_errors
+    call_lexer.continued = False
+
+    call_parser = copy.copy(parser)
+    call_parser.input = s
+    call_parser.filename = filename
+    call_parser.recover_errors = recover_errors
+
+    if not hasattr(state, 'active'):
+        state.active = []
+
+    state.active.append((call_lexer, call_parser))
+    try:
+        ast = call_parser.parse(s, lexer=call_lexer, tracking=True)
+    finally:
+        state.active.pop()
+
+    # Input read from a continuation prompt is not part of the key
+    if ast is not None and not call_lexer.continued:
+        parse_cache.put(key, tuple(ast))
+
+    return ast
 
 
 def maybe_quote(s):
@@ -1129,7 +1272,7 @@ def unparse(token, indent=0, oneliner=False):
     if isinstance(token, str):
         return token
 
-    if isinstance(token, list):
+    if isinstance(token, (list, tuple)):
         return ','.join(ind(unparse(i)) for i in token)
 
     if isinstance(token, Comment):
@@ -1233,6 +1376,13 @@ def unparse(token, indent=0, oneliner=False):
             format_block(token.body)
         ))
 
+    if isinstance(token, ParallelForInStatement):
+        return ind('parallel for ({0} in {1}) {{{2}}}'.format(
+            ', '.join(token.var) if isinstance(token.var, tuple) else token.var,
+            unparse(token.expr),
+            format_block(token.body)
+        ))
+
     if isinstance(token, WhileStatement):
         return ind('while ({0}) {{{1}}}'.format(
             unparse(token.expr),
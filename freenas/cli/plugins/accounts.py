@@ -31,7 +31,7 @@ import gettext
 from freenas.cli.namespace import (
     Command, Namespace, EntityNamespace, TaskBasedSaveMixin,
     EntitySubscriberBasedLoadMixin, description, CommandException,
-    ConfigNamespace, ItemNamespace, NestedEntityMixin
+    ConfigNamespace, ItemNamespace, NestedEntityMixin, EntityJoin
 )
 from freenas.cli.output import ValueType, Sequence
 from freenas.dispatcher import Password
@@ -182,7 +182,7 @@ class UsersNamespace(TaskBasedSaveMixin, EntitySubscriberBasedLoadMixin, EntityN
             descr='Primary group',
             name='group',
             get_name='group',
-            get=self.display_group,
+            get=EntityJoin(context, 'group', 'group', default='<unknown group>'),
             usage=_("""\
             By default when a user is created, a primary group
             with the same name as the user is also created.
@@ -194,7 +194,7 @@ class UsersNamespace(TaskBasedSaveMixin, EntitySubscriberBasedLoadMixin, EntityN
         self.add_property(
             descr='Auxiliary groups',
             name='groups',
-            get=self.display_aux_groups,
+            get=EntityJoin(context, 'group', 'groups'),
             get_name='groups',
             usage=_("""\
             List of additional groups the user is a member of. To add
@@ -334,13 +334,6 @@ class UsersNamespace(TaskBasedSaveMixin, EntitySubscriberBasedLoadMixin, EntityN
             'shells': ShellsCommand()
         }
 
-    def display_group(self, entity):
-        group = self.context.entity_subscribers['group'].query(
-            ('id', '=', entity['group']),
-            single=True
-        )
-        return group['name'] if group else '<unknown group>'
-
     def set_group(self, entity, value):
         group = self.context.call_sync('group.query', [('name', '=', value)], {'single': True})
         if group:
@@ -348,10 +341,6 @@ class UsersNamespace(TaskBasedSaveMixin, EntitySubscriberBasedLoadMixin, EntityN
         else:
             raise CommandException(_('Group {0} does not exist.'.format(value)))
 
-    def display_aux_groups(self, entity):
-        for group in self.context.entity_subscribers['group'].query(('id', 'in', entity['groups'])):
-            yield group['name'] if group else '<unknown group>'
-
     def set_aux_groups(self, entity, value):
         groups = list(self.context.entity_subscribers['group'].query(('name', 'in', list(value))))
         diff_groups = set.difference(set(value), set(x['name'] for x in groups))
@@ -29,10 +29,10 @@ import gettext
 from freenas.cli.output import Sequence, Object, ValueType, Table, format_value, read_value
 from freenas.cli.namespace import (
     EntityNamespace, Command, CommandException, EntitySubscriberBasedLoadMixin,
-    TaskBasedSaveMixin, BaseVariantMixin, description
+    TaskBasedSaveMixin, BaseVariantMixin, description, EntityJoin
 )
 from freenas.cli.complete import EnumComplete, EntitySubscriberComplete, NullComplete
-from freenas.cli.utils import TaskPromise, get_related, set_related
+from freenas.cli.utils import TaskPromise, set_related
 from freenas.utils import query as q
 
 
@@ -48,7 +48,7 @@ class BackupSSHPropertiesMixin(BaseVariantMixin):
             descr='Peer',
             name='ssh_peer',
             usage=_("Peer name. Must match a peer of type ssh"),
-            get=lambda o: get_related(self.context, 'peer', o, 'properties.peer'),
+            get=EntityJoin(self.context, 'peer', 'properties.peer'),
             set=lambda o, v: set_related(self.context, 'peer', o, 'properties.peer', v),
             list=False,
             condition=lambda o: o['provider'] == 'ssh',
@@ -74,7 +74,7 @@ class BackupS3PropertiesMixin(BaseVariantMixin):
             descr='Peer',
             name='s3_peer',
             usage=_("Peer name. Must match a peer of type s3"),
-            get=lambda o: get_related(self.context, 'peer', o, 'properties.peer'),
+            get=EntityJoin(self.context, 'peer', 'properties.peer'),
             set=lambda o, v: set_related(self.context, 'peer', o, 'properties.peer', v),
             list=False,
             condition=lambda o: o['provider'] == 's3'
@@ -797,10 +797,8 @@ class SmartNamespace(CalendarTasksNamespaceBaseClass):
 
     def get_disks(self, obj):
         try:
-            return self.context.entity_subscribers['disk'].query(
-                ('id', 'in', self.get_task_args(obj, 'disks')),
-                select='name'
-            )
+            disks = (self.context.entity_subscribers.lookup('disk', 'id', i) for i in self.get_task_args(obj, 'disks'))
+            return [i['name'] for i in disks if i]
         except:
             return []
 
@@ -29,11 +29,11 @@ import gettext
 import os
 from freenas.cli.namespace import (
     EntityNamespace, Command, EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin, description,
-    CommandException
+    CommandException, pushdown, EntityJoin
 )
 from freenas.cli.output import ValueType, Table, read_value
 from freenas.cli.utils import TaskPromise
-from freenas.utils import extend, query as q
+from freenas.utils import extend
 
 
 t = gettext.translation('freenas-cli', fallback=True)
@@ -59,17 +59,6 @@ class DisksNamespace(EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin, EntityN
             ('online', '=', True)
         ]
 
-        def get_enclosure(disk):
-            enc_id = q.get(disk, 'status.enclosure')
-            if not enc_id:
-                return
-
-            enclosure = context.entity_subscribers['disk.enclosure'].get(enc_id)
-            if not enclosure:
-                return
-
-            return '{description} ({name})'.format(**enclosure)
-
         self.add_property(
             descr='Name',
             name='name',
@@ -119,7 +108,10 @@ class DisksNamespace(EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin, EntityN
         self.add_property(
             descr='Enclosure',
             name='enclosure',
-            get=get_enclosure,
+            get=EntityJoin(
+                context, 'disk.enclosure', 'status.enclosure',
+                attr=lambda e: '{description} ({name})'.format(**e)
+            ),
             set=None,
             usage=_("""\
             Name of enclosure containing the disk (if any). This is a read-only value."""),
@@ -329,6 +321,7 @@ class DisksNamespace(EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin, EntityN
             'import_media': ImportMediaCommand()
         }
 
+    @pushdown
     def query(self, params, options):
         ret = super(DisksNamespace, self).query(params, options)
         allocations = self.context.call_sync('volume.get_disks_allocation', [d['id'] for d in ret])
@@ -28,12 +28,12 @@
 import gettext
 from freenas.cli.namespace import (
     Namespace, EntityNamespace, Command, EntitySubscriberBasedLoadMixin,
-    TaskBasedSaveMixin, CommandException, description, ConfigNamespace, RpcBasedLoadMixin
+    TaskBasedSaveMixin, CommandException, description, ConfigNamespace, RpcBasedLoadMixin, pushdown, EntityJoin
 )
 from freenas.cli.output import ValueType, Table, Sequence, read_value
 from freenas.cli.utils import (
     TaskPromise, post_save, EntityPromise, get_item_stub, objname2id, objid2name, set_name, check_name,
-    get_related, set_related
+    set_related
 )
 from freenas.utils import query as q
 from freenas.cli.complete import NullComplete, EntitySubscriberComplete, EnumComplete
@@ -99,7 +99,7 @@ class DockerHostNamespace(EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin, En
         self.add_property(
             descr='Datastore',
             name='datastore',
-            get=lambda o: get_related(self.context, 'vm.datastore', o, 'target'),
+            get=EntityJoin(self.context, 'vm.datastore', 'target'),
             set=lambda o, v: set_related(self.context, 'vm.datastore', o, 'target', v),
             createsetable=True,
             usersetable=False,
@@ -267,7 +267,7 @@ class DockerNetworkNamespace(EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin,
         self.add_property(
             descr='Containers',
             name='containers',
-            get=lambda o: [objid2name(self.context, 'docker.container', id) for id in o.get('containers')],
+            get=EntityJoin(self.context, 'docker.container', 'containers'),
             set=self.set_containers,
             usage=_("""\
             List of containers connected to the network.
@@ -525,7 +525,7 @@ class DockerContainerNamespace(EntitySubscriberBasedLoadMixin, TaskBasedSaveMixi
         self.add_property(
             descr='Host',
             name='host',
-            get=lambda o: objid2name(context, 'docker.host', o['host']),
+            get=EntityJoin(context, 'docker.host', 'host'),
             set=None,
             list=True,
             complete=EntitySubscriberComplete('host=', 'docker.host', lambda d: d['name']),
@@ -706,7 +706,7 @@ class DockerContainerNamespace(EntitySubscriberBasedLoadMixin, TaskBasedSaveMixi
         self.add_property(
             descr='Docker networks',
             name='networks',
-            get=lambda o: [objid2name(self.context, 'docker.network', id) for id in o.get('networks')],
+            get=EntityJoin(self.context, 'docker.network', 'networks'),
             set=self.set_networks,
             usersetable=False,
             usage=_("""\
@@ -1065,6 +1065,7 @@ class CollectionImagesNamespace(RpcBasedLoadMixin, EntityNamespace):
             'pull': CollectionImagePullCommand(this)
         }
 
+    @pushdown
     def query(self, params, options):
         result = super(CollectionImagesNamespace, self).query([], {})
 
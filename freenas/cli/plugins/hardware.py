@@ -160,6 +160,7 @@ class SerialPortNamespace(ConfigNamespace):
 
 @description("Configure and manage hardware")
 class HardwareNamespace(Namespace):
+    dynamic_namespaces = True
 
     def __init__(self, name, context):
         super(HardwareNamespace, self).__init__(name)
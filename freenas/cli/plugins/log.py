@@ -26,24 +26,93 @@
 #####################################################################
 
 import gettext
-from freenas.cli.namespace import EntityNamespace, EntitySubscriberBasedLoadMixin, description
-from freenas.cli.output import ValueType
+import threading
+from freenas.cli.namespace import EntityNamespace, RpcBasedLoadMixin, Command, CommandException, description
+from freenas.cli.output import ValueType, output_msg, format_value
 
 
 t = gettext.translation('freenas-cli', fallback=True)
 _ = t.gettext
 
+# Number of log entries fetched from the server at once
+PAGE_SIZE = 500
+
+
+@description("Follow new log entries as they are logged")
+class FollowCommand(Command):
+    """
+    Usage: follow [lines=<n>]
+
+    Examples: follow
+              follow lines=50
+
+    Displays the last n (10 by default) log entries and then keeps
+    displaying new ones as they arrive, until interrupted with ctrl+c.
+    """
+    def __init__(self, parent):
+        self.parent = parent
+
+    def print_entry(self, entry):
+        output_msg('{0} {1}: {2}'.format(
+            format_value(entry.get('timestamp'), ValueType.TIME),
+            entry.get('identifier'),
+            entry.get('message')
+        ))
+
+    def run(self, context, args, kwargs, opargs):
+        lines = kwargs.get('lines', 10)
+        if not isinstance(lines, int) or lines < 0:
+            raise CommandException(_('lines must be a non-negative number'))
+
+        # Change notifications only wake the loop below, which then fetches
+        # entries past the last one seen - so nothing is kept around here
+        changed = threading.Event()
+        event = 'entity-subscriber.syslog.changed'
+        handler = context.connection.register_event_handler(event, lambda args: changed.set())
+        context.connection.subscribe_events(event)
+
+        try:
+            last = None
+            tail = self.parent.query([], {'sort': ['-seqnum'], 'limit': lines, 'reverse': True}) if lines else []
+            for entry in tail:
+                self.print_entry(entry)
+                last = entry['seqnum']
+
+            if last is None:
+                newest = self.parent.query([], {'sort': ['-seqnum'], 'single': True})
+                last = newest['seqnum'] if newest else -1
+
+            while True:
+                while not changed.wait(1):
+                    pass
+
+                changed.clear()
+                for entry in self.parent.query_pages([('seqnum', '>', last)], {'sort': ['seqnum']}):
+                    self.print_entry(entry)
+                    last = entry['seqnum']
+        except KeyboardInterrupt:
+            pass
+        finally:
+            context.connection.unsubscribe_events(event)
+            context.connection.unregister_event_handler(event, handler)
+
 
 @description("Browse and query system log entries")
-class LogNamespace(EntitySubscriberBasedLoadMixin, EntityNamespace):
+class LogNamespace(RpcBasedLoadMixin, EntityNamespace):
     """
     The log namespace can be used to browse and query system log
     entries, where each entry is assigned a numeric log ID.
+
+    Entries are fetched from the server page by page, so that browsing
+    a large log does not require loading all of it. Use the 'follow'
+    command to watch new entries as they are logged.
     """
     def __init__(self, name, context):
         super(LogNamespace, self).__init__(name, context)
-        self.entity_subscriber_name = 'syslog'
+        self.query_call = 'syslog.query'
         self.primary_key_name = 'seqnum'
+        self.page_size = PAGE_SIZE
+        self.cursor_key = 'seqnum'
         self.allow_edit = False
         self.allow_create = False
 
@@ -84,6 +153,9 @@ class LogNamespace(EntitySubscriberBasedLoadMixin, EntityNamespace):
         )
 
         self.primary_key = self.get_mapping('id')
+        self.extra_commands = {
+            'follow': FollowCommand(self)
+        }
 
     def serialize(self):
         raise NotImplementedError()
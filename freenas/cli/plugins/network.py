@@ -1050,6 +1050,8 @@ class NetworkNamespace(Namespace):
     manage the entries in the system hosts file, and configure
     global network parameters.
     """
+    dynamic_namespaces = True
+
     def __init__(self, name, context):
         super(NetworkNamespace, self).__init__(name)
         self.context = context
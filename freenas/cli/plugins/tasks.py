@@ -27,7 +27,7 @@
 
 import gettext
 from freenas.cli.output import ValueType, Object
-from freenas.cli.namespace import EntityNamespace, EntitySubscriberBasedLoadMixin, Command, BaseListCommand, description
+from freenas.cli.namespace import EntityNamespace, RpcBasedLoadMixin, Command, BaseListCommand, description
 from freenas.cli.complete import NullComplete
 from freenas.cli.utils import TaskPromise, describe_task_state
 from freenas.utils.query import get
@@ -36,6 +36,9 @@ from freenas.utils.query import get
 t = gettext.translation('freenas-cli', fallback=True)
 _ = t.gettext
 
+# Number of tasks fetched from the server at once
+PAGE_SIZE = 500
+
 
 @description("Submits new task")
 class SubmitCommand(Command):
@@ -146,8 +149,8 @@ class TaskListCommand(BaseListCommand):
             states += self.RUNNING_STATES
 
         return super(TaskListCommand, self).run(context, args, kwargs, opargs, {
-            'filter': [('state', 'in', states)],
-            'params': {}
+            'filter': [('state', 'in', states)] + (filtering['filter'] if filtering else []),
+            'params': filtering['params'] if filtering else {}
         })
 
     def complete(self, context, **kwargs):
@@ -161,11 +164,14 @@ class TaskListCommand(BaseListCommand):
 
 
 @description("Browse and abort running tasks")
-class TasksNamespace(EntitySubscriberBasedLoadMixin, EntityNamespace):
+class TasksNamespace(RpcBasedLoadMixin, EntityNamespace):
     """
     The task namespace provides commands for browsing task history and for
     aborting tasks.
 
+    Task history is queried from the server page by page, only tasks
+    which are still running are kept track of locally.
+
     To see more info on a task or abort a task go to '/ task <task number>'.
     To abort a hung task do '/ task <task number> abort'.
     """
@@ -174,8 +180,9 @@ class TasksNamespace(EntitySubscriberBasedLoadMixin, EntityNamespace):
 
         self.allow_create = False
         self.allow_edit = False
-        self.entity_subscriber_name = 'task'
-        self.default_sort = 'id'
+        self.query_call = 'task.query'
+        self.page_size = PAGE_SIZE
+        self.cursor_key = 'id'
         self.large = True
 
         self.add_property(
@@ -29,10 +29,10 @@ import gettext
 from freenas.cli.output import Sequence, Table
 from freenas.cli.namespace import (
     EntityNamespace, Command, NestedObjectLoadMixin, NestedObjectSaveMixin, EntitySubscriberBasedLoadMixin,
-    TaskBasedSaveMixin, description, CommandException, ConfigNamespace, BaseVariantMixin, Namespace
+    TaskBasedSaveMixin, description, CommandException, ConfigNamespace, BaseVariantMixin, Namespace, EntityJoin
 )
 from freenas.cli.output import Object, ValueType, get_humanized_size
-from freenas.cli.utils import TaskPromise, post_save, EntityPromise, get_item_stub, get_related, set_related
+from freenas.cli.utils import TaskPromise, post_save, EntityPromise, get_item_stub, set_related
 from freenas.utils import first_or_default
 from freenas.utils.query import get, set
 from freenas.cli.complete import NullComplete, EntitySubscriberComplete, RpcComplete, MultipleSourceComplete
@@ -455,7 +455,7 @@ class VMNamespace(TaskBasedSaveMixin, EntitySubscriberBasedLoadMixin, EntityName
         self.add_property(
             descr='Datastore',
             name='datastore',
-            get=lambda o: get_related(self.context, 'vm.datastore', o, 'target'),
+            get=EntityJoin(self.context, 'vm.datastore', 'target'),
             set=lambda o, v: set_related(self.context, 'vm.datastore', o, 'target', v),
             createsetable=True,
             usersetable=False,
@@ -1191,6 +1191,7 @@ class VMSnapshotsNamespace(TaskBasedSaveMixin, EntitySubscriberBasedLoadMixin, E
         self.primary_key_name = 'name'
         if self.parent and self.parent.entity:
             self.extra_query_params = [('parent.id', '=', self.parent.entity.get('id'))]
+            self.entity_subscriber_scope = self.extra_query_params
 
         self.skeleton_entity = {
             'description': ''
@@ -1803,7 +1804,7 @@ class VMSCSILunsNamespace(NestedObjectSaveMixin, NestedObjectLoadMixin, EntityNa
         self.add_property(
             descr='Share name',
             name='name',
-            get=lambda o: get_related(self.context, 'share', o, 'lun_id'),
+            get=EntityJoin(self.context, 'share', 'lun_id'),
             set=lambda o, v: set_related(self.context, 'share', o, 'lun_id', v)
         )
 
@@ -30,13 +30,13 @@ import gettext
 import six
 from freenas.cli.namespace import (
     EntityNamespace, Command, CommandException, SingleItemNamespace,
-    EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin, description
+    EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin, description, EntityJoin
 )
 from freenas.dispatcher import Password
 from freenas.cli.complete import NullComplete, EnumComplete, EntitySubscriberComplete
 from freenas.cli.output import Table, ValueType, output_tree, format_value, read_value, Sequence
 from freenas.cli.utils import TaskPromise, EntityPromise, post_save, iterate_vdevs, vdev_by_path, mirror_by_path
-from freenas.cli.utils import to_list, correct_disk_path, get_related, set_related, get_item_stub
+from freenas.cli.utils import to_list, correct_disk_path, set_related, get_item_stub
 from freenas.utils import query as q
 
 t = gettext.translation('freenas-cli', fallback=True)
@@ -272,7 +272,8 @@ class ReplaceCommand(Command):
         old_disk = correct_disk_path(args[0])
         new_disk = correct_disk_path(args[1])
         vdev = vdev_by_path(self.parent.entity['topology'], old_disk)
-        disk_id = context.entity_subscribers['disk'].query(('path', '=', new_disk), single=True, select='id')
+        disk = context.entity_subscribers.lookup('disk', 'path', new_disk)
+        disk_id = disk['id'] if disk else None
         if not disk_id:
             raise CommandException('Cannot find disk {0}'.format(new_disk))
 
@@ -1460,6 +1461,7 @@ class SnapshotsNamespace(EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin, Ent
             self.extra_query_params = [
                 ('volume', '=', self.parent.entity.get('id'))
             ]
+            self.entity_subscriber_scope = self.extra_query_params
 
         self.add_property(
             descr='Snapshot name',
@@ -1596,7 +1598,7 @@ class VMwareDatasetsNamespace(EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin
         self.add_property(
             descr='VMware peer',
             name='peer',
-            get=lambda o: get_related(self.context, 'peer', o, 'peer'),
+            get=EntityJoin(self.context, 'peer', 'peer'),
             set=lambda o, v: set_related(self.context, 'peer', o, 'peer', v),
             list=True
         )
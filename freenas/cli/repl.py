@@ -47,13 +47,22 @@ import paramiko
 import inspect
 import re
 import contextlib
+import weakref
+import queue
+import concurrent.futures
 import rollbar
+from datetime import datetime
 from six.moves.urllib.parse import urlparse
 from socket import gaierror as socket_error
 from freenas.cli.output import Table
 from freenas.cli.descriptions import events
 from freenas.cli.utils import SIGTSTPException, SIGTSTP_setter, errors_by_path, quote, flatten_table
 from freenas.cli import functions
+from freenas.cli.session import SessionServer, run_client, default_socket_path
+from freenas.cli.fanout import DEFAULT_JOBS, read_hosts, run_fanout
+from freenas.cli.complete import CompletionCache, rpc_completions
+from freenas.cli.rpcstats import RpcStats
+from freenas.cli.subscriber import ScopedEntitySubscriber
 from freenas.cli import config
 from freenas.cli.namespace import (
     Namespace, EntityNamespace, RootNamespace, SingleItemNamespace, ConfigNamespace, Command,
@@ -61,14 +70,15 @@ from freenas.cli.namespace import (
 )
 from freenas.cli.parser import (
     parse, unparse, Symbol, Literal, BinaryParameter, UnaryExpr, BinaryExpr, PipeExpr, AssignmentStatement,
-    IfStatement, ForStatement, ForInStatement, WhileStatement, FunctionCall, CommandCall, Subscript,
+    IfStatement, ForStatement, ForInStatement, ParallelForInStatement, WhileStatement, FunctionCall, CommandCall, Subscript,
     ExpressionExpansion, CommandExpansion, SyncCommandExpansion, FunctionDefinition, ReturnStatement,
     BreakStatement, UndefStatement, AssertStatement, Redirection, AnonymousFunction, ShellEscape,
     Parentheses, ConstStatement, Quote
 )
 from freenas.cli.output import (
     ValueType, ProgressBar, output_lock, output_msg, read_value, format_value,
-    format_output, output_msg_locked
+    format_output, output_msgs_locked, formatters, TaskDashboard,
+    MessageCoalescer
 )
 from freenas.dispatcher.client import Client, ClientError
 from freenas.dispatcher.entity import EntitySubscriber
@@ -83,7 +93,8 @@ from freenas.cli.commands import (
     SelectPipeCommand, FindPipeCommand, LoginCommand, DumpCommand, WhoamiCommand, PendingCommand,
     WaitCommand, OlderThanPipeCommand, NewerThanPipeCommand, IndexCommand, AliasCommand,
     UnaliasCommand, ListVarsCommand, AttachDebuggerCommand,
-    WCommand, TimeCommand, RemoteCommand, BuiltinCommand
+    WCommand, TimeCommand, RemoteCommand, BuiltinCommand, RpcStatsCommand,
+    BulkSetPipeCommand, BulkDeletePipeCommand
 )
 from freenas.cli.docgen import CliDocGen
 
@@ -109,6 +120,7 @@ else:
     rollbar.init('9d317f74118c41059f4046afc446a01e', 'cli_remote')
 
 DEFAULT_CLI_CONFIGFILE = os.path.join(os.getcwd(), '.freenascli.conf')
+PLUGIN_MANIFEST_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'freenas-cli', 'plugins.json')
 
 
 t = gettext.translation('freenas-cli', fallback=True)
@@ -116,6 +128,7 @@ _ = t.gettext
 
 
 PROGRESS_CHARS = ['-', '\\', '|', '/']
+OUTPUT_BATCH_WINDOW = 0.05
 EVENT_MASKS = [
     'client.logged',
     'task.progress',
@@ -151,7 +164,6 @@ ENTITY_SUBSCRIBERS = [
     'vm.snapshot',
     'vm.datastore',
     'vm.scsi.port',
-    'syslog',
     'replication',
     'replication.host',
     'backup',
@@ -169,6 +181,33 @@ ENTITY_SUBSCRIBERS = [
 ]
 
 
+# Fields indexed together with 'name' on the first indexed lookup against
+# an entity subscriber. Lookups by any other field build their index on
+# first use.
+ENTITY_INDEXES = {
+    'disk': ['path'],
+    'docker.container': ['host'],
+    'docker.network': ['host'],
+}
+ENTITY_SCOPES = {
+    'task': [('state', 'nin', ['FINISHED', 'FAILED', 'ABORTED'])],
+}
+
+
+# Pipe stages named like entity commands are never resolved outside of
+# a pipe, so that they do not shadow those commands and user aliases
+PIPE_ONLY_COMMANDS = ('set', 'delete')
+
+
+def global_commands(builtins, pipe_commands):
+    """
+    Returns builtin commands merged with pipe commands usable outside of a pipe.
+    """
+    result = dict(builtins)
+    result.update((k, v) for k, v in pipe_commands.items() if k not in PIPE_ONLY_COMMANDS)
+    return result
+
+
 def sort_args(args):
     positional = []
     kwargs = {}
@@ -216,14 +255,14 @@ def expand_wildcards(context, args, kwargs, opargs, completions):
 
 def convert_to_literals(tokens):
     def conv(t):
-        if isinstance(t, list):
+        if isinstance(t, (list, tuple)):
             return [conv(i) for i in t]
 
         if isinstance(t, Symbol):
             return Literal(t.name, str)
 
         if isinstance(t, BinaryParameter):
-            t.right = conv(t.right)
+            return BinaryParameter(t.left, t.op, conv(t.right))
 
         return t
 
@@ -263,6 +302,7 @@ class VariableStore(object):
 
     def __init__(self):
         self.save_to_file = DEFAULT_CLI_CONFIGFILE
+        self.watchers = {}
         self.variables = {
             'output_format': self.Variable('ascii', ValueType.STRING, ['ascii', 'json']),
             'datetime_format': self.Variable('natural', ValueType.STRING),
@@ -277,6 +317,11 @@ class VariableStore(object):
             'verbosity': self.Variable(1, ValueType.NUMBER),
             'rollbar_enabled': self.Variable(True, ValueType.BOOLEAN),
             'vm.console_interrupt': self.Variable(r'\035', ValueType.STRING),
+            'entity_subscriber_idle_timeout': self.Variable(0, ValueType.NUMBER),
+            'completion_cache_ttl': self.Variable(30, ValueType.NUMBER),
+            'rpc_stats': self.Variable(False, ValueType.BOOLEAN),
+            'parallel_workers': self.Variable(8, ValueType.NUMBER),
+            'output_rate_limit': self.Variable(20, ValueType.NUMBER),
             'cli_src_path': self.Variable(
                 os.path.dirname(os.path.realpath(__file__)), ValueType.STRING, None, True
             )
@@ -295,6 +340,17 @@ class VariableStore(object):
             'verbosity': _('Increasing verbosity of event messages. Can be set from 1 to 5.'),
             'rollbar_enabled': _('Toggle rollbar error reporting. Can be set to yes or no.'),
             'vm.console_interrupt': _(r'Set the console interrupt key sequence for virtual machines with support for octal characters of the form \nnn. Default is ^] or octal 035.'),
+            'entity_subscriber_idle_timeout': _(
+                'Number of seconds after which unused entity subscribers are stopped. 0 disables eviction.'
+            ),
+            'completion_cache_ttl': _(
+                'Number of seconds tab completion results fetched from the server are reused. 0 disables caching.'
+            ),
+            'rpc_stats': _('Toggle recording of RPC call and task statistics. Can be set to yes or no.'),
+            'parallel_workers': _('Default number of threads used by pmap() and parallel for loops.'),
+            'output_rate_limit': _(
+                'Maximum number of event and task notifications printed per second. 0 disables the limit.'
+            ),
             'cli_src_path': _('The absolute path of the cli source code on this machine')
         }
 
@@ -359,11 +415,344 @@ class VariableStore(object):
             self.variables[name] = self.Variable(default, vtype, choices)
 
         self.variables[name].set(value)
+        for callback in self.watchers.get(name, []):
+            callback(self.variables[name].value)
+
+    def watch(self, name, callback):
+        self.watchers.setdefault(name, []).append(callback)
+
+
+class EntityIndex(object):
+    """
+    Maps values of a single entity field to entities of an entity subscriber.
+
+    Kept up to date from the subscriber on_add, on_update and on_delete
+    callbacks. Values do not have to be unique - lookup() returns every
+    matching entity in the order they were added. Entities a scoped
+    subscriber reports without holding them are not indexed.
+    """
+    def __init__(self, subscriber, key):
+        self.key = key
+        self.holds = getattr(subscriber, 'holds', None)
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        for i in list(subscriber.items.values()):
+            self.add(i)
+
+        subscriber.on_add.add(self.add)
+        subscriber.on_update.add(self.update)
+        subscriber.on_delete.add(self.remove)
+
+    def add(self, entity):
+        if self.holds and not self.holds(entity['id']):
+            return
+
+        value = get(entity, self.key)
+        with self.lock:
+            try:
+                self.entries.setdefault(value, collections.OrderedDict())[entity['id']] = entity
+            except TypeError:
+                # Unhashable values (lists, dicts) cannot be indexed
+                pass
+
+    def remove(self, entity):
+        value = get(entity, self.key)
+        with self.lock:
+            try:
+                matches = self.entries.get(value)
+            except TypeError:
+                return
+
+            if matches is not None:
+                matches.pop(entity['id'], None)
+                if not matches:
+                    del self.entries[value]
+
+    def update(self, old_entity, new_entity):
+        self.remove(old_entity)
+        self.add(new_entity)
+
+    def lookup(self, value):
+        with self.lock:
+            try:
+                return list(self.entries.get(value, {}).values())
+            except TypeError:
+                return []
+
+
+def scope_key(name, scope):
+    return name, json.dumps(scope, sort_keys=True, default=str)
+
+
+class EntitySubscriberRegistry(object):
+    """
+    Lazily started collection of entity subscribers.
+
+    A subscriber is only started (and synced) the first time it is looked
+    up by name. Subscribers which were not touched for longer than the
+    'entity_subscriber_idle_timeout' opt variable are stopped again, unless
+    something hooked into them with on_start().
+
+    Lookups of single entities by field value go through hash indexes
+    (see EntityIndex) instead of filtered queries.
+
+    Subscribers listed in 'scopes' only hold entities matching the given
+    filter (see ScopedEntitySubscriber), and scoped() gives out subscribers
+    limited to an arbitrary filter.
+    """
+    def __init__(self, context, names, indexes=None, scopes=None):
+        self.context = context
+        self.names = set(names)
+        self.index_keys = indexes or {}
+        self.scopes = scopes or {}
+        self.subscribers = {}
+        self.indexes = {}
+        self.start_hooks = {}
+        self.last_used = {}
+        self.enabled = False
+        self.lock = threading.RLock()
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __getitem__(self, name):
+        return self.__get(name, name, self.scopes.get(name))
+
+    def scoped(self, name, scope):
+        """
+        Returns subscriber holding only 'name' entities matching 'scope'.
+        It is shared by everything asking for the same scope.
+        """
+        return self.__get(scope_key(name, scope), name, scope)
+
+    def __get(self, key, name, scope):
+        with self.lock:
+            subscriber = self.subscribers.get(key)
+            if subscriber is None:
+                if not self.enabled or name not in self.names:
+                    raise KeyError(name)
+
+                subscriber = self.__start(key, name, scope)
+
+            self.last_used[key] = time.time()
+            self.evict_idle()
+
+        subscriber.wait_ready()
+        return subscriber
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def get_started(self, name):
+        """
+        Returns subscriber only if it is already running - never starts it.
+        """
+        return self.subscribers.get(name)
+
+    def keys(self):
+        return list(self.names)
+
+    def values(self):
+        return list(self.subscribers.values())
+
+    def index(self, name, key):
+        subscriber = self[name]
+        with self.lock:
+            index = self.indexes.get((name, key))
+            if index is None:
+                if not any(i[0] == name for i in self.indexes):
+                    for i in ['name'] + self.index_keys.get(name, []):
+                        self.indexes[(name, i)] = EntityIndex(subscriber, i)
+
+                index = self.indexes.get((name, key))
+
+            if index is None:
+                index = self.indexes[(name, key)] = EntityIndex(subscriber, key)
+
+            return index
+
+    def lookup_all(self, name, key, value):
+        """
+        Returns all entities of subscriber 'name' having 'key' equal to 'value'.
+        """
+        if key == 'id':
+            entity = self[name].items.get(value)
+            return [entity] if entity is not None else []
+
+        return self.index(name, key).lookup(value)
+
+    def lookup(self, name, key, value):
+        matches = self.lookup_all(name, key, value)
+        return matches[0] if matches else None
+
+    def on_start(self, name, hook):
+        with self.lock:
+            self.start_hooks.setdefault(name, []).append(hook)
+            if name in self.subscribers:
+                hook(self.subscribers[name])
+
+    def reset(self):
+        with self.lock:
+            for name in list(self.subscribers):
+                self.stop(name)
+
+            self.start_hooks.clear()
+            self.enabled = True
+
+    def release_scoped(self, keep):
+        """
+        Stops subscribers handed out by scoped() except those for the
+        (name, scope) pairs in 'keep'.
+        """
+        keep = {scope_key(name, scope) for name, scope in keep}
+        with self.lock:
+            for key in list(self.subscribers):
+                if isinstance(key, tuple) and key not in keep:
+                    self.stop(key)
+
+    def stop(self, name):
+        with self.lock:
+            subscriber = self.subscribers.pop(name, None)
+            self.last_used.pop(name, None)
+            for i in [i for i in self.indexes if i[0] == name]:
+                del self.indexes[i]
+
+            if subscriber:
+                subscriber.stop()
+
+    def evict_idle(self):
+        timeout = self.context.variables.get('entity_subscriber_idle_timeout')
+        if not timeout:
+            return
+
+        now = time.time()
+        for name, last_used in list(self.last_used.items()):
+            if name in self.start_hooks:
+                continue
+
+            if now - last_used > timeout:
+                self.context.logger.debug(_("Stopping idle entity subscriber %s"), name)
+                self.stop(name)
+
+    def wait_ready(self):
+        for i in self.values():
+            i.wait_ready()
+
+    def __start(self, key, name, scope=None):
+        self.context.logger.debug(_("Starting entity subscriber %s"), key)
+        if scope:
+            subscriber = ScopedEntitySubscriber(self.context.connection, name, scope)
+        else:
+            subscriber = EntitySubscriber(self.context.connection, name)
+
+        subscriber.start()
+        if self.context.rpc_stats.enabled:
+            self.context.rpc_stats.watch_subscriber(subscriber, key if key == name else ' '.join(key))
+
+        self.subscribers[key] = subscriber
+        for hook in self.start_hooks.get(key, []):
+            hook(subscriber)
+
+        return subscriber
+
+
+class PluginManifest(object):
+    """
+    Cached record of root namespaces and task mappings each plugin registers
+    in its _init(), keyed by plugin path. Entries are valid as long as the
+    plugin file modification time did not change.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+    def get(self, plugin_path):
+        entry = self.entries.get(plugin_path)
+        try:
+            if entry and entry['mtime'] == os.path.getmtime(plugin_path):
+                return entry
+        except OSError:
+            pass
+
+        return None
+
+    def put(self, plugin_path, entry):
+        entry['mtime'] = os.path.getmtime(plugin_path)
+        self.entries[plugin_path] = entry
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.entries, f)
+
+            os.rename(self.path + '.tmp', self.path)
+            self.dirty = False
+        except OSError as err:
+            logging.getLogger('cli').debug('Cannot save plugin manifest: %s', err)
+
+
+class ThreadLocalAttribute(object):
+    """
+    Context attribute with a separate value in every thread, so that
+    script code running in parallel does not share call stack or pipe state.
+    """
+    def __init__(self, name, default):
+        self.name = name
+        self.default = default
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+
+        try:
+            return getattr(obj.thread_state, self.name)
+        except AttributeError:
+            value = self.default()
+            setattr(obj.thread_state, self.name, value)
+            return value
+
+    def __set__(self, obj, value):
+        setattr(obj.thread_state, self.name, value)
+
+
+class ParallelExecutionError(CommandException):
+    def __init__(self, errors, total):
+        self.errors = errors
+        super(ParallelExecutionError, self).__init__('\n'.join(
+            [_("{0} of {1} parallel iterations failed:").format(len(errors), total)] +
+            ['  #{0}: {1}'.format(idx, err) for idx, err, stack in errors]
+        ))
 
 
 class Context(object):
+    call_stack = ThreadLocalAttribute('call_stack', list)
+    pipe_cwd = ThreadLocalAttribute('pipe_cwd', lambda: None)
+    pipe_filtered = ThreadLocalAttribute('pipe_filtered', lambda: False)
+    parallel_worker = ThreadLocalAttribute('parallel_worker', lambda: False)
+
     def __init__(self):
+        self.thread_state = threading.local()
         self.docgen_run = False
+        self.pipe_cwd = None
+        self.pipe_filtered = False
         self.uri = None
         self.parsed_uri = None
         self.hostname = None
@@ -373,8 +762,16 @@ class Context(object):
         self.plugin_dirs = []
         self.task_callbacks = {}
         self.plugins = {}
+        self.plugin_manifest_entry = None
         self.reverse_task_mappings = {}
+        self.lazy_task_mappings = {}
         self.variables = VariableStore()
+        self.variables.watch('output_format', formatters.select)
+        self.rpc_stats = RpcStats()
+        self.variables.watch('rpc_stats', self.rpc_stats.enable)
+        self.output_coalescer = MessageCoalescer(self.variables.get('output_rate_limit'))
+        self.variables.watch('output_rate_limit', self.output_coalescer.set_rate)
+        formatters.select(self.variables.get('output_format'))
         self.root_ns = RootNamespace('')
         self.event_masks = ['*']
         self.event_divert = False
@@ -382,15 +779,17 @@ class Context(object):
         self.output_queue = six.moves.queue.Queue()
         self.keepalive_timer = None
         self.argparse_parser = None
-        self.entity_subscribers = {}
+        self.entity_subscribers = EntitySubscriberRegistry(self, ENTITY_SUBSCRIBERS, ENTITY_INDEXES, ENTITY_SCOPES)
+        self.completion_cache = CompletionCache(self)
         self.call_stack = [CallStackEntry('<stdin>', [], '<stdin>', 1, 1)]
         self.builtin_operators = functions.operators
         self.builtin_functions = functions.functions
         self.global_env = Environment(self)
         self.user = None
         self.pending_tasks = {}
+        self.defer_task_wait = False
         self.session_id = None
-        self.user_commands = []
+        self.user_commands = {}
         self.local_connection = False
         config.instance = self
 
@@ -414,15 +813,6 @@ class Context(object):
         self.connect(password) if not self.docgen_run else None
 
     def start_entity_subscribers(self):
-        for i in ENTITY_SUBSCRIBERS:
-            if i in self.entity_subscribers:
-                self.entity_subscribers[i].stop()
-                del self.entity_subscribers[i]
-
-            e = EntitySubscriber(self.connection, i)
-            e.start()
-            self.entity_subscribers[i] = e
-
         def update_task(task, old_task=None):
             self.pending_tasks[task['id']] = task
             descr = task['name']
@@ -432,24 +822,26 @@ class Context(object):
 
             if task['state'] in ('FINISHED', 'FAILED', 'ABORTED'):
                 del self.pending_tasks[task['id']]
+                if self.rpc_stats.enabled:
+                    self.rpc_stats.task_finished(task['id'], task['state'])
 
             if self.variables.get('verbosity') > 1 and task['state'] in ('CREATED', 'FINISHED'):
-                self.output_queue.put(_(
+                self.output_queue.put((('task', task['id']), _(
                     "Task #{0}: {1}: {2}".format(
                         task['id'],
                         descr,
                         task['state'].lower(),
                     )
-                ))
+                )))
 
             if self.variables.get('verbosity') > 2 and task['state'] == 'WAITING':
-                self.output_queue.put(_(
+                self.output_queue.put((('task', task['id']), _(
                     "Task #{0}: {1}: {2}".format(
                         task['id'],
                         descr,
                         task['state'].lower(),
                     )
-                ))
+                )))
 
             if task['state'] == 'FAILED':
                 if self.variables.get('verbosity') > 0 and (not task['parent'] or self.variables.get('verbosity') > 1):
@@ -463,7 +855,7 @@ class Context(object):
                     self.print_validation_errors(task)
 
             if task['state'] == 'ABORTED':
-                self.output_queue.put(_("Task #{0} aborted".format(task['id'])))
+                self.output_queue.put((('task', task['id']), _("Task #{0} aborted".format(task['id']))))
 
             if task['id'] in self.task_callbacks:
                 self.handle_task_callback(task)
@@ -477,12 +869,15 @@ class Context(object):
                             i['message']
                         )))
 
-        self.entity_subscribers['task'].on_add.add(update_task)
-        self.entity_subscribers['task'].on_update.add(lambda o, n: update_task(n, o))
+        def attach_task_hooks(subscriber):
+            subscriber.on_add.add(update_task)
+            subscriber.on_update.add(lambda o, n: update_task(n, o))
+
+        self.entity_subscribers.reset()
+        self.entity_subscribers.on_start('task', attach_task_hooks)
 
     def wait_entity_subscribers(self):
-        for i in self.entity_subscribers.values():
-            i.wait_ready()
+        self.entity_subscribers.wait_ready()
 
     def connect(self, password=None):
         try:
@@ -549,18 +944,41 @@ class Context(object):
             self.plugin_dirs += [plug_dirs]
 
     def discover_plugins(self):
+        manifest = PluginManifest(PLUGIN_MANIFEST_FILE)
         for dir in self.plugin_dirs:
             self.logger.debug(_("Searching for plugins in %s"), dir)
-            self.__discover_plugin_dir(dir)
+            self.__discover_plugin_dir(dir, manifest)
+
+        manifest.save()
 
     def login_plugins(self):
         for i in list(self.plugins.values()):
             if hasattr(i, '_login'):
                 i._login(self)
 
-    def __discover_plugin_dir(self, dir):
+    def __discover_plugin_dir(self, dir, manifest):
         for i in glob.glob1(dir, "*.py"):
-            self.__try_load_plugin(os.path.join(dir, i))
+            path = os.path.join(dir, i)
+            entry = manifest.get(path)
+            if entry and entry['lazy']:
+                self.__defer_plugin(path, entry)
+                continue
+
+            entry = self.__try_load_plugin(path)
+            if entry:
+                manifest.put(path, entry)
+
+    def __defer_plugin(self, path, entry):
+        # Plugin is imported once one of its namespaces or task mappings is needed
+        def load():
+            self.__try_load_plugin(path)
+
+        self.logger.debug(_("Deferring plugin %s"), path)
+        for name in entry['namespaces']:
+            self.root_ns.register_lazy_namespace(name, load)
+
+        for wildcard in entry['tasks']:
+            self.lazy_task_mappings[wildcard] = load
 
     def __try_load_plugin(self, path):
         if path in self.plugins:
@@ -568,6 +986,8 @@ class Context(object):
 
         self.logger.debug(_("Loading plugin from %s"), path)
         name, ext = os.path.splitext(os.path.basename(path))
+        entry = {'namespaces': [], 'tasks': [], 'nested': False}
+        outer_entry, self.plugin_manifest_entry = self.plugin_manifest_entry, entry
         try:
             plugin = load_module_from_file(name, path)
             if hasattr(plugin, '_init'):
@@ -577,6 +997,16 @@ class Context(object):
             if self.variables.get('rollbar_enabled'):
                 rollbar.report_exc_info()
             raise
+        finally:
+            self.plugin_manifest_entry = outer_entry
+
+        # Only plugins registering nothing but root namespaces and task
+        # mappings can be imported on demand
+        nested = entry.pop('nested')
+        entry['lazy'] = not hasattr(plugin, '_init') or (
+            not hasattr(plugin, '_login') and not nested and bool(entry['namespaces'])
+        )
+        return entry
 
     def __try_reconnect(self):
         output_lock.acquire()
@@ -631,20 +1061,48 @@ class Context(object):
     def attach_namespace(self, path, ns):
         splitpath = path.split('/')
         ptr = self.root_ns
-        ptr_namespaces = ptr.namespaces()
 
         for n in splitpath[1:-1]:
-
-            if n not in list(ptr_namespaces().keys()):
+            ptr = ptr.get_index()[0].get(n)
+            if ptr is None:
                 self.logger.warn(_("Cannot attach to namespace %s"), path)
                 return
 
-            ptr = ptr_namespaces()[n]
+        if self.plugin_manifest_entry is not None:
+            if ptr is self.root_ns:
+                self.plugin_manifest_entry['namespaces'].append(ns.get_name())
+            else:
+                self.plugin_manifest_entry['nested'] = True
 
         ptr.register_namespace(ns)
 
     def map_tasks(self, task_wildcard, cls):
+        self.lazy_task_mappings.pop(task_wildcard, None)
         self.reverse_task_mappings[task_wildcard] = cls
+        if self.plugin_manifest_entry is not None:
+            self.plugin_manifest_entry['tasks'].append(task_wildcard)
+
+    def load_task_mappings(self, task_name):
+        for wildcard, load in list(self.lazy_task_mappings.items()):
+            if fnmatch.fnmatch(task_name, wildcard):
+                load()
+
+    def register_output_format(self, name, formatter):
+        formatters.register(name, formatter)
+        choices = self.variables.variables['output_format'].choices
+        if name not in choices:
+            choices.append(name)
+
+    def register_user_command(self, namespace, name, cmd):
+        matcher = re.compile(fnmatch.translate(namespace)).match
+        self.user_commands.setdefault(name, []).append((namespace, matcher, cmd))
+
+    def unregister_user_command(self, namespace, name):
+        commands = [i for i in self.user_commands.get(name, []) if i[0] != namespace]
+        if commands:
+            self.user_commands[name] = commands
+        else:
+            self.user_commands.pop(name, None)
 
     def connection_error(self, event, **kwargs):
         if event == ClientError.LOGOUT:
@@ -658,14 +1116,21 @@ class Context(object):
             return
 
     def handle_event(self, event, data):
+        if event.startswith('entity-subscriber.') and event.endswith('.changed'):
+            self.completion_cache.invalidate(event[len('entity-subscriber.'):-len('.changed')])
+
         if event == 'task.progress':
+            subscriber = self.entity_subscribers.get_started('task')
+            if not subscriber:
+                return
+
             progress = include(data, 'percentage', 'message', 'extra')
-            task = self.entity_subscribers['task'].items.get(data['id'])
+            task = subscriber.items.get(data['id'])
             if not task:
                 return
 
             task['progress'] = progress
-            self.entity_subscribers['task'].update(task)
+            subscriber.update(task)
 
             if task['id'] in self.pending_tasks:
                 self.pending_tasks[data['id']]['progress'] = progress
@@ -673,6 +1138,7 @@ class Context(object):
         self.print_event(event, data)
 
     def get_validation_errors(self, task):
+        self.load_task_mappings(task['name'])
         __, nsclass = best_match(
             self.reverse_task_mappings.items(),
             task['name'],
@@ -741,8 +1207,21 @@ class Context(object):
 
     def output_thread(self):
         while True:
-            item = self.output_queue.get()
-            output_msg_locked(item)
+            batch = [self.output_queue.get()]
+            deadline = time.monotonic() + OUTPUT_BATCH_WINDOW
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                try:
+                    batch.append(self.output_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            msgs = self.output_coalescer.process(batch)
+            if msgs:
+                output_msgs_locked(msgs)
 
     def handle_task_callback(self, data):
         if data['state'] in ('FINISHED', 'CANCELLED', 'ABORTED', 'FAILED'):
@@ -759,12 +1238,27 @@ class Context(object):
             self.output_queue.put(translation)
 
     def call_sync(self, name, *args, **kwargs):
-        return self.connection.call_sync(name, *args, **kwargs) if not self.docgen_run else {}
+        if self.docgen_run:
+            return {}
+
+        if self.rpc_stats.enabled:
+            return self.rpc_stats.call('rpc', name, args, lambda: self.connection.call_sync(name, *args, **kwargs))
+
+        return self.connection.call_sync(name, *args, **kwargs)
 
     def call_async(self, name, callback, *args, **kwargs):
-        return self.connection.call_async(name, callback, *args, **kwargs) if not self.docgen_run else None
+        if self.docgen_run:
+            return None
+
+        if self.rpc_stats.enabled:
+            callback = self.rpc_stats.wrap_callback(name, args, callback)
+
+        return self.connection.call_async(name, callback, *args, **kwargs)
 
     def call_task_sync(self, name, *args, **kwargs):
+        if self.rpc_stats.enabled:
+            return self.rpc_stats.call('task', name, args, lambda: self.connection.call_task_sync(name, *args))
+
         return self.connection.call_task_sync(name, *args)
 
     def submit_task_common_routine(self, name, callback, *args):
@@ -774,7 +1268,16 @@ class Context(object):
         below.
         It returns the id of the task.
         """
-        tid = self.connection.call_sync('task.submit', name, args)
+        # Make sure task subscriber is running before the task gets submitted
+        # so that no state transitions of it are missed
+        self.entity_subscribers['task']
+        if self.rpc_stats.enabled:
+            tid = self.rpc_stats.submit_task(
+                name, args, lambda: self.connection.call_sync('task.submit', name, args)
+            )
+        else:
+            tid = self.connection.call_sync('task.submit', name, args)
+
         if callback:
             self.task_callbacks[tid] = callback
         self.global_env['_last_task_id'] = Environment.Variable(tid)
@@ -843,17 +1346,175 @@ class Context(object):
             if generator:
                 del generator
 
+    def wait_for_tasks(self, tids, wait_any=False, progress=True):
+        """
+        Waits until all (or, with wait_any=True, the first) of given tasks end,
+        showing a TaskDashboard unless progress is False. Redraws are driven
+        by task subscriber events, plus once a second to advance times.
+
+        Returns list of ended tasks. Ctrl+C aborts tasks still running,
+        Ctrl+Z leaves them running in the background.
+        """
+        subscriber = self.entity_subscribers['task']
+        final = ('FINISHED', 'FAILED', 'ABORTED')
+        events = queue.Queue()
+        tasks = collections.OrderedDict()
+        seen = {}
+        dashboard = TaskDashboard() if progress else None
+
+        def ended():
+            return [t for t in tasks.values() if t['state'] in final]
+
+        def row(task):
+            started = task.get('started_at')
+            percentage = get(task, 'progress.percentage')
+            if isinstance(started, datetime):
+                finished = task.get('finished_at')
+                end = finished if isinstance(finished, datetime) else datetime.utcnow()
+                elapsed = max((end - started).total_seconds(), 0)
+            else:
+                elapsed = time.time() - seen[task['id']]
+
+            eta = None
+            if task['state'] not in final and percentage:
+                eta = elapsed * (100 - percentage) / percentage
+
+            return {
+                'id': task['id'],
+                'state': task['state'],
+                'percentage': percentage,
+                'message': get(task, 'progress.message') or get(task, 'error.message'),
+                'elapsed': elapsed,
+                'eta': eta
+            }
+
+        for tid in tids:
+            subscriber.add_listener(tid, events)
+
+        try:
+            SIGTSTP_setter(set_flag=True)
+            for tid in tids:
+                task = subscriber.get(tid)
+                if not task:
+                    output_msg(_("Task {0} not found".format(tid)))
+                    continue
+
+                tasks[tid] = task
+                seen[tid] = time.time()
+
+            if progress and tasks:
+                output_msg(_("Hit Ctrl+C to terminate tasks if needed"))
+                output_msg(_("To background running tasks press 'Ctrl+Z'"))
+
+            while tasks:
+                if dashboard:
+                    dashboard.draw([row(t) for t in tasks.values()])
+
+                done = ended()
+                if len(done) == len(tasks) or (wait_any and done):
+                    return done
+
+                try:
+                    op, old, new = events.get(timeout=1)
+                    if new and new['id'] in tasks:
+                        tasks[new['id']] = new
+                except queue.Empty:
+                    pass
+
+            return []
+        except KeyboardInterrupt:
+            six.print_()
+            output_msg(_("User requested task termination. Abort signal sent"))
+            for tid, task in tasks.items():
+                if task['state'] not in final:
+                    self.call_sync('task.abort', tid)
+        except SIGTSTPException:
+            six.print_()
+            running = [str(t) for t, task in tasks.items() if task['state'] not in final]
+            output_msg(_("Tasks {0} will continue to run in the background.".format(', '.join(running))))
+            output_msg(_("To bring them back to the foreground execute 'wait {0}'".format(' '.join(running))))
+        finally:
+            SIGTSTP_setter(set_flag=False)
+            for tid in tids:
+                subscriber.remove_listener(tid, events)
+
+        return ended()
+
+    @contextlib.contextmanager
+    def tasks_nonblocking(self):
+        """
+        Makes submit_task() return right away regardless of 'tasks_blocking',
+        for callers which keep track of submitted tasks by themselves.
+        """
+        saved = self.defer_task_wait
+        self.defer_task_wait = True
+        try:
+            yield
+        finally:
+            self.defer_task_wait = saved
+
     def submit_task(self, name, *args, **kwargs):
         callback = kwargs.pop('callback', None)
         tid = self.submit_task_common_routine(name, callback, *args)
 
-        if self.variables.get('tasks_blocking'):
+        if self.variables.get('tasks_blocking') and not self.defer_task_wait:
             error_msgs = self.wait_for_task_with_progress(tid)
             if error_msgs:
                 output_msg(error_msgs)
 
         return tid
 
+    def run_parallel(self, fn, items, workers=None):
+        """
+        Calls fn(item) for all items on at most 'workers' threads and returns
+        results in order of items.
+
+        Every thread starts with a copy of the caller's call stack. Errors
+        are collected and raised together once all items are done, leaving
+        the call stack of the first failed item in place for the report.
+        """
+        items = list(items)
+        workers = int(workers or self.variables.get('parallel_workers'))
+        base_stack = list(self.call_stack)
+        results = [None] * len(items)
+        errors = []
+        lock = threading.Lock()
+
+        def work(idx):
+            # Errors abort the iteration instead of being skipped, so that
+            # they end up in ParallelExecutionError
+            self.parallel_worker = True
+            self.call_stack = list(base_stack)
+            try:
+                results[idx] = fn(items[idx])
+            except FlowControlInstruction:
+                err = SyntaxError(_("Cannot break or return out of parallel code"))
+                with lock:
+                    errors.append((idx, err, self.call_stack))
+            except Exception as err:
+                with lock:
+                    errors.append((idx, err, self.call_stack))
+
+        if not items:
+            return results
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(items)))) as pool:
+            futures = [pool.submit(work, i) for i in range(len(items))]
+            try:
+                concurrent.futures.wait(futures)
+            except KeyboardInterrupt:
+                for f in futures:
+                    f.cancel()
+
+                raise
+
+        if errors:
+            errors.sort(key=lambda e: e[0])
+            self.call_stack = errors[0][2]
+            raise ParallelExecutionError(errors, len(items))
+
+        return results
+
     def eval(self, *args, **kwargs):
         return self.ml.eval(*args, **kwargs)
 
@@ -886,12 +1547,13 @@ class CallStackEntry(object):
 
 
 class Function(object):
-    def __init__(self, context, name, param_names, exp, env):
+    def __init__(self, context, name, param_names, exp, env, code=None):
         self.context = context
         self.name = name
         self.param_names = param_names
         self.exp = exp
         self.env = env
+        self.code = code
 
     @property
     def value(self):
@@ -900,7 +1562,10 @@ class Function(object):
     def __call__(self, env, *args):
         env = Environment(self.context, self.env, zip(self.param_names, args))
         try:
-            self.context.eval_block(self.exp, env, False)
+            if self.code:
+                self.code(env)
+            else:
+                self.context.eval_block(self.exp, env, False)
         except FlowControlInstruction as f:
             if f.type == FlowControlInstructionType.RETURN:
                 return f.payload
@@ -964,6 +1629,524 @@ class Environment(dict):
         raise KeyError(var)
 
 
+def iteration_env(context, env, var, value):
+    """
+    Scope of a single parallel for iteration, holding the loop variable(s).
+    """
+    local_env = Environment(context, outer=env)
+    if isinstance(var, tuple):
+        local_env[var[0]], local_env[var[1]] = value
+    else:
+        local_env[var] = value
+
+    return local_env
+
+
+class Compiler(object):
+    """
+    Compiles parsed AST into a tree of Python closures.
+
+    Every AST node type has its own handler registered in the dispatch
+    table. Compiled code takes (env, path, first) arguments, keeps the
+    semantics of the original tree-walking evaluator and is cached per AST
+    node, so loop and function bodies are compiled only once.
+    """
+    def __init__(self, ml):
+        self.ml = ml
+        self.context = ml.context
+        self.cache = weakref.WeakKeyDictionary()
+        self.handlers = {
+            Parentheses: self.compile_parentheses,
+            UnaryExpr: self.compile_unary_expr,
+            BinaryExpr: self.compile_binary_expr,
+            Literal: self.compile_literal,
+            AnonymousFunction: self.compile_anonymous_function,
+            Symbol: self.compile_symbol,
+            AssignmentStatement: self.compile_assignment_stmt,
+            ConstStatement: self.compile_const_stmt,
+            IfStatement: self.compile_if_stmt,
+            ForStatement: self.compile_for_stmt,
+            ForInStatement: self.compile_for_in_stmt,
+            ParallelForInStatement: self.compile_parallel_for_in_stmt,
+            WhileStatement: self.compile_while_stmt,
+            ReturnStatement: self.compile_return_stmt,
+            BreakStatement: self.compile_break_stmt,
+            UndefStatement: self.compile_undef_stmt,
+            AssertStatement: self.compile_assert_stmt,
+            SyncCommandExpansion: self.compile_sync_command_expansion,
+            ExpressionExpansion: self.compile_expansion,
+            CommandExpansion: self.compile_expansion,
+            CommandCall: self.compile_command_call,
+            FunctionCall: self.compile_function_call,
+            Subscript: self.compile_subscript,
+            FunctionDefinition: self.compile_function_definition,
+            BinaryParameter: self.compile_binary_parameter,
+            PipeExpr: self.compile_pipe_expr,
+            ShellEscape: self.compile_shell_escape,
+            Quote: self.compile_quote,
+            Redirection: self.compile_redirection,
+        }
+
+    def compile(self, token):
+        if not token:
+            return self.empty
+
+        if isinstance(token, (list, tuple)):
+            return self.compile_list(token)
+
+        handler = self.handlers.get(type(token))
+        if not handler:
+            return self.compile_invalid(token)
+
+        code = self.cache.get(token)
+        if code:
+            return code
+
+        try:
+            code = handler(token)
+        except Exception as err:
+            code = self.compile_error(err)
+
+        self.cache[token] = code
+        return code
+
+    def compile_block(self, block):
+        codes = [self.compile(i) for i in block]
+        reset = self.ml.reset_on_first_run
+        context = self.context
+        variables = self.context.variables
+
+        def run_block(env):
+            for code in codes:
+                try:
+                    reset()
+                    code(env, None, True)
+                except SystemExit:
+                    raise
+                except FlowControlInstruction:
+                    raise
+                except BaseException as e:
+                    if variables.get('abort_on_errors') or context.parallel_worker:
+                        raise e
+
+                    continue
+
+        return run_block
+
+    @staticmethod
+    def empty(env, path, first):
+        return []
+
+    def compile_invalid(self, token):
+        def invalid(env, path, first):
+            raise SyntaxError("Invalid syntax: {0}".format(token))
+
+        return invalid
+
+    def compile_error(self, err):
+        def error(env, path, first):
+            raise err
+
+        return error
+
+    def compile_list(self, token):
+        codes = [self.compile(i) for i in token]
+        reset = self.ml.reset_on_first_run
+
+        def list_(env, path, first):
+            result = []
+            for code in codes:
+                if first:
+                    reset()
+
+                result.append(code(env, path, first))
+
+            return result
+
+        return list_
+
+    def compile_parentheses(self, token):
+        expr = self.compile(token.expr)
+
+        def parentheses(env, path, first):
+            return expr(env, path, False)
+
+        return parentheses
+
+    def compile_unary_expr(self, token):
+        expr = self.compile(token.expr)
+        operators = self.context.builtin_operators
+        op = token.op
+
+        if op == '-':
+            def negate(env, path, first):
+                return -expr(env, None, False)
+
+            return negate
+
+        def unary_expr(env, path, first):
+            return operators[op](expr(env, None, False))
+
+        return unary_expr
+
+    def compile_binary_expr(self, token):
+        left = self.compile(token.left)
+        right = self.compile(token.right)
+        operators = self.context.builtin_operators
+        op = token.op
+
+        def binary_expr(env, path, first):
+            return operators[op](left(env, None, False), right(env, None, False))
+
+        return binary_expr
+
+    def compile_literal(self, token):
+        if token.type in six.string_types:
+            value = token.value.replace('\\\"', '"')
+        elif token.type is list:
+            items = [self.compile(i) for i in token.value]
+
+            def list_literal(env, path, first):
+                return [i(env, None, False) for i in items]
+
+            return list_literal
+        elif token.type is dict:
+            pairs = [(self.compile(k), self.compile(v)) for k, v in token.value.items()]
+
+            def dict_literal(env, path, first):
+                return {k(env, None, False): v(env, None, False) for k, v in pairs}
+
+            return dict_literal
+        else:
+            value = token.value
+
+        def literal(env, path, first):
+            return value
+
+        return literal
+
+    def compile_anonymous_function(self, token):
+        body = self.compile_block(token.body)
+
+        def anonymous_function(env, path, first):
+            return Function(self.context, '<anonymous>', token.args, token.body, env, body)
+
+        return anonymous_function
+
+    def compile_symbol(self, token):
+        name = token.name
+        ml = self.ml
+
+        def symbol(env, path, first):
+            return ml.eval_symbol(name, env, ml.get_cwd(path))
+
+        return symbol
+
+    def compile_assignment_stmt(self, token):
+        expr = self.compile(token.expr)
+        variables = self.context.variables
+        name = token.name
+
+        if isinstance(name, Subscript):
+            array = self.compile(name.expr)
+            index = self.compile(name.index)
+
+            def assign_subscript(env, path, first):
+                value = flatten_table(expr(env, None, first))
+
+                if name in variables.variables:
+                    raise SyntaxError(_(
+                        "{0} is a configuration variable. Use `setopt` command to set it".format(name)
+                    ))
+
+                array(env, None, False)[index(env, None, False)] = value
+
+            return assign_subscript
+
+        def assign(env, path, first):
+            value = flatten_table(expr(env, None, first))
+
+            if name in variables.variables:
+                raise SyntaxError(_(
+                    "{0} is a configuration variable. Use `setopt` command to set it".format(name)
+                ))
+
+            try:
+                var = env.find(name)
+                if var.const:
+                    raise SyntaxError('{0} is defined as a constant'.format(name))
+
+                var.value = value
+            except KeyError:
+                env[name] = Environment.Variable(value)
+
+        return assign
+
+    def compile_const_stmt(self, token):
+        expr = self.compile(token.expr)
+        name = token.name.name
+
+        def const(env, path, first):
+            env[name] = Environment.Variable(expr(env, None, first), True)
+
+        return const
+
+    def compile_if_stmt(self, token):
+        expr = self.compile(token.expr)
+        body = self.compile_block(token.body)
+        else_body = self.compile_block(token.else_body)
+
+        def if_stmt(env, path, first):
+            if expr(env, None, False):
+                body(env)
+            else:
+                else_body(env)
+
+        return if_stmt
+
+    def compile_for_stmt(self, token):
+        stmt1 = self.compile(token.stmt1)
+        expr = self.compile(token.expr)
+        stmt2 = self.compile(token.stmt2)
+        body = self.compile_block(token.body)
+
+        def for_stmt(env, path, first):
+            stmt1(env, None, False)
+
+            while expr(env, None, False):
+                body(env)
+                stmt2(env, None, False)
+
+        return for_stmt
+
+    def compile_for_in_stmt(self, token):
+        expr = self.compile(token.expr)
+        body = self.compile_block(token.body)
+        var = token.var
+
+        def for_in_stmt(env, path, first):
+            local_env = Environment(self.context, outer=env)
+            value = expr(env, None, False)
+            if isinstance(var, tuple):
+                if isinstance(value, dict):
+                    value_iter = value.items()
+                else:
+                    value_iter = value.copy()
+
+                for k, v in value_iter:
+                    local_env[var[0]] = k
+                    local_env[var[1]] = v
+                    try:
+                        body(local_env)
+                    except FlowControlInstruction as f:
+                        if f.type == FlowControlInstructionType.BREAK:
+                            return
+
+                        raise f
+            else:
+                for i in value:
+                    local_env[var] = i
+                    try:
+                        body(local_env)
+                    except FlowControlInstruction as f:
+                        if f.type == FlowControlInstructionType.BREAK:
+                            return
+
+                        raise f
+
+        return for_in_stmt
+
+    def compile_parallel_for_in_stmt(self, token):
+        expr = self.compile(token.expr)
+        body = self.compile_block(token.body)
+        var = token.var
+
+        def parallel_for_in_stmt(env, path, first):
+            value = expr(env, None, False)
+            if isinstance(var, tuple):
+                value = value.items() if isinstance(value, dict) else value
+
+            self.context.run_parallel(lambda i: body(iteration_env(self.context, env, var, i)), value)
+
+        return parallel_for_in_stmt
+
+    def compile_while_stmt(self, token):
+        expr = self.compile(token.expr)
+        body = self.compile_block(token.body)
+
+        def while_stmt(env, path, first):
+            while expr(env, None, False):
+                try:
+                    body(env)
+                except FlowControlInstruction as f:
+                    if f.type == FlowControlInstructionType.BREAK:
+                        return
+
+                    raise f
+
+        return while_stmt
+
+    def compile_return_stmt(self, token):
+        expr = self.compile(token.expr)
+
+        def return_stmt(env, path, first):
+            raise FlowControlInstruction(FlowControlInstructionType.RETURN, expr(env, None, False))
+
+        return return_stmt
+
+    def compile_break_stmt(self, token):
+        def break_stmt(env, path, first):
+            raise FlowControlInstruction(FlowControlInstructionType.BREAK)
+
+        return break_stmt
+
+    def compile_undef_stmt(self, token):
+        name = token.name
+
+        def undef_stmt(env, path, first):
+            del env[name]
+
+        return undef_stmt
+
+    def compile_assert_stmt(self, token):
+        expr = self.compile(token.expr)
+        msg = self.compile(token.msg)
+
+        def assert_stmt(env, path, first):
+            if not expr(env, None, first):
+                raise CommandException('Assertion failed: {0}'.format(msg(env, None, False)))
+
+        return assert_stmt
+
+    def compile_sync_command_expansion(self, token):
+        expr = self.compile(token.expr)
+
+        def sync_command_expansion(env, path, first):
+            value = expr(env, None, first)
+            if not hasattr(value, 'wait'):
+                raise SyntaxError("Invalid syntax: {0}".format(token))
+
+            try:
+                return value.wait()
+            except BaseException as err:
+                env['_success'] = Environment.Variable(False)
+                env['_error'] = Environment.Variable(str(err))
+
+        return sync_command_expansion
+
+    def compile_expansion(self, token):
+        expr = self.compile(token.expr)
+
+        def expansion(env, path, first):
+            value = expr(env, None, first)
+
+            # Table data needs to be flattened upon assignment
+            if isinstance(value, Table):
+                rows = list(value.data)
+                value.data = rows
+
+            return value
+
+        return expansion
+
+    def compile_command_call(self, token):
+        ml = self.ml
+
+        def command_call(env, path, first):
+            return ml.eval_command_call(token, env, [] if path is None else path, first)
+
+        return command_call
+
+    def compile_function_call(self, token):
+        args = [self.compile(a) for a in token.args]
+        reset = self.ml.reset_on_first_run
+        name = token.name
+        file, line, column = token.file, token.line, token.column
+
+        def function_call(env, path, first):
+            values = []
+            for a in args:
+                reset()
+                values.append(flatten_table(a(env, None, True)))
+
+            func = env.find(name)
+            if func:
+                if isinstance(func, Environment.Variable):
+                    func = func.value
+
+                self.context.call_stack.append(CallStackEntry(func.name, values, file, line, column))
+                result = func(env, *values)
+                self.context.call_stack.pop()
+                return result
+
+            raise SyntaxError("Function {0} not found".format(name))
+
+        return function_call
+
+    def compile_subscript(self, token):
+        expr = self.compile(token.expr)
+        index = self.compile(token.index)
+
+        def subscript(env, path, first):
+            value = flatten_table(expr(env, None, False))
+            return value[index(env, None, False)]
+
+        return subscript
+
+    def compile_function_definition(self, token):
+        body = self.compile_block(token.body)
+
+        def function_definition(env, path, first):
+            env[token.name] = Function(self.context, token.name, token.args, token.body, env, body)
+
+        return function_definition
+
+    def compile_binary_parameter(self, token):
+        right = self.compile(token.right)
+        left, op = token.left, token.op
+
+        def binary_parameter(env, path, first):
+            return left, op, right(env, None, False)
+
+        return binary_parameter
+
+    def compile_pipe_expr(self, token):
+        ml = self.ml
+
+        def pipe_expr(env, path, first):
+            return ml.eval_pipe(token, env, [] if path is None else path, first)
+
+        return pipe_expr
+
+    def compile_shell_escape(self, token):
+        ml = self.ml
+
+        def shell_escape(env, path, first):
+            return ml.builtin_commands['shell']().run(
+                self.context,
+                [ml.eval(t) for t in convert_to_literals(token.args)],
+                {}, {}
+            )
+
+        return shell_escape
+
+    def compile_quote(self, token):
+        def quote(env, path, first):
+            return token
+
+        return quote
+
+    def compile_redirection(self, token):
+        body = self.compile(token.body)
+        filename = token.path
+
+        def redirection(env, path, first):
+            with open(filename, 'a+') as f:
+                format_output(body(env, path, first), file=f)
+
+        return redirection
+
+
 class MainLoop(object):
     pipe_commands = {
         'search': SearchPipeCommand,
@@ -977,7 +2160,9 @@ class MainLoop(object):
         'more': MorePipeCommand,
         'less': MorePipeCommand,
         'older_than': OlderThanPipeCommand,
-        'newer_than': NewerThanPipeCommand
+        'newer_than': NewerThanPipeCommand,
+        'set': BulkSetPipeCommand,
+        'delete': BulkDeletePipeCommand
     }
     base_builtin_commands = {
         '?': IndexCommand,
@@ -1008,21 +2193,21 @@ class MainLoop(object):
         'w': WCommand,
         'time': TimeCommand,
         'remote': RemoteCommand,
-        'builtin': BuiltinCommand
+        'builtin': BuiltinCommand,
+        'rpcstats': RpcStatsCommand
     }
-    builtin_commands = base_builtin_commands.copy()
-    builtin_commands.update(pipe_commands)
+    builtin_commands = global_commands(base_builtin_commands, pipe_commands)
 
     def __init__(self, context):
         self.context = context
         self.root_path = [self.context.root_ns]
         self.path = self.root_path[:]
         self.prev_path = self.path[:]
-        self.start_from_root = False
         self.namespaces = []
         self.aliases = {}
         self.connection = None
         self.saved_state = None
+        self.compiler = Compiler(self)
 
     def __get_prompt(self):
         variables = collections.defaultdict(lambda: '', {
@@ -1068,6 +2253,21 @@ class MainLoop(object):
         self.prev_path = self.path[:]
         self.path.append(ns)
         self.cwd.on_enter()
+        self.prefetch_completions(ns)
+
+    def release_subscribers(self):
+        # Scoped subscribers (eg. snapshots of one volume) are only kept
+        # while a namespace using them is part of the current path
+        self.context.entity_subscribers.release_scoped(
+            (ns.entity_subscriber_name, ns.entity_subscriber_scope)
+            for ns in self.path
+            if getattr(ns, 'entity_subscriber_scope', None)
+        )
+
+    def prefetch_completions(self, ns):
+        mappings = getattr(ns, 'property_mappings', None) or []
+        for c in rpc_completions(p.complete for p in mappings if p.complete):
+            c.prefetch(self.context)
 
     def cd_up(self):
         if not self.cwd.on_leave():
@@ -1134,36 +2334,40 @@ class MainLoop(object):
             if ns:
                 return ns
 
-        cwd_namespaces = cwd.namespaces()
-        cwd_commands = list(cwd.commands().items())
+        cwd_namespaces, cwd_commands = cwd.get_index()
 
         if isinstance(token, six.string_types) and token.startswith('@'):
             token = token[1:]
         else:
-            for ns in cwd_namespaces:
-                if token == ns.get_name():
-                    return ns
+            ns = cwd_namespaces.get(token)
+            if ns is not None:
+                return ns
 
-        for name, cmd in cwd_commands:
-            if token == name:
-                cmd.env = env
-                cmd.variables = variables
-                return cmd
+        cmd = cwd_commands.get(token)
+        if cmd is not None:
+            # Index holds shared instances, hand out a copy to carry per-call state
+            cmd = copy.copy(cmd)
+            cmd.env = env
+            cmd.variables = variables
+            return cmd
 
-        if token in list(self.builtin_commands.keys()):
+        if token in self.builtin_commands:
             cmd = self.builtin_commands[token]()
             cmd.env = env
             cmd.variables = variables
             return cmd
 
-        if token in list(self.aliases.keys()):
+        if token in self.aliases:
             return Alias(self.context, self.aliases[token])
 
-        for ns, name, fn in self.context.user_commands:
-            if fnmatch.fnmatch(self.path_string, ns) and name == token:
-                fn.env = env
-                fn.variables = variables
-                return fn
+        user_commands = self.context.user_commands.get(token)
+        if user_commands:
+            path_string = self.path_string
+            for ns, matcher, fn in user_commands:
+                if matcher(path_string):
+                    fn.env = env
+                    fn.variables = variables
+                    return fn
 
         return None
 
@@ -1171,18 +2375,7 @@ class MainLoop(object):
         if env is None:
             env = self.context.global_env
 
-        for stmt in block:
-            try:
-                self.eval(stmt, env=env, first=True)
-            except SystemExit:
-                raise
-            except FlowControlInstruction:
-                raise
-            except BaseException as e:
-                if self.context.variables.get('abort_on_errors'):
-                    raise e
-
-                continue
+        self.compiler.compile_block(block)(env)
 
     def get_cwd(self, path):
         if not path:
@@ -1199,16 +2392,12 @@ class MainLoop(object):
 
     def reset_on_first_run(self):
         self.context.pipe_cwd = None
+        self.context.pipe_filtered = False
 
     def eval(self, token, **kwargs):
         path = kwargs.pop('path', [])
-        serialize_filter = kwargs.pop('serialize_filter', None)
-        input_data = kwargs.pop('input_data', None)
-        dry_run = kwargs.pop('dry_run', None)
         first = kwargs.pop('first', False)
         env = kwargs.pop('env', self.context.global_env)
-        variables = kwargs.pop('variables', self.context.variables)
-        cwd = self.get_cwd(path)
 
         if not token:
             return []
@@ -1216,383 +2405,209 @@ class MainLoop(object):
         if first:
             self.reset_on_first_run()
 
-        if self.start_from_root:
-            path = self.root_path[:]
-            self.start_from_root = False
-
-        try:
-            if isinstance(token, list):
-                return [self.eval(i, env=env, path=path, first=first) for i in token]
-
-            if isinstance(token, Parentheses):
-                return self.eval(token.expr, env=env, path=path)
-
-            if isinstance(token, UnaryExpr):
-                expr = self.eval(token.expr, env=env)
-                if token.op == '-':
-                    return -expr
-
-                return self.context.builtin_operators[token.op](expr)
-
-            if isinstance(token, BinaryExpr):
-                left = self.eval(token.left, env=env)
-                right = self.eval(token.right, env=env)
-                return self.context.builtin_operators[token.op](left, right)
-
-            if isinstance(token, Literal):
-                if token.type in six.string_types:
-                    return token.value.replace('\\\"', '"')
-
-                if token.type is list:
-                    return [self.eval(i, env=env) for i in token.value]
-
-                if token.type is dict:
-                    return {self.eval(k, env=env): self.eval(v, env=env) for k, v in token.value.items()}
-
-                return token.value
-
-            if isinstance(token, AnonymousFunction):
-                return Function(self.context, '<anonymous>', token.args, token.body, env)
-
-            if isinstance(token, Symbol):
-                item = self.find_in_scope(token.name, cwd=cwd, env=env, variables=variables)
-                if item is not None:
-                    return item
-
-                item = self.find_in_scope(token.name.split('/')[0], cwd=cwd, env=env, variables=variables) \
-                    if isinstance(token.name, str) \
-                    else None
-
-                if item is not None:
-                    raise SyntaxError("Use of slashes as separators not allowed. Please use spaces instead or "
-                                        "use the 'cd' command to navigate")
+        if isinstance(token, (list, tuple)):
+            return [self.eval(i, env=env, path=path, first=first) for i in token]
+
+        if isinstance(token, CommandCall):
+            return self.eval_command_call(
+                token, env, path, first,
+                dry_run=kwargs.pop('dry_run', None),
+                serialize_filter=kwargs.pop('serialize_filter', None),
+                input_data=kwargs.pop('input_data', None),
+                variables=kwargs.pop('variables', None),
+                pipe_stage=kwargs.pop('pipe_stage', False)
+            )
 
-                try:
-                    item = env.find(token.name)
-                    return item.value if isinstance(item, Environment.Variable) else item
-                except KeyError:
+        if isinstance(token, PipeExpr):
+            return self.eval_pipe(
+                token, env, path, first,
+                serialize_filter=kwargs.pop('serialize_filter', None),
+                input_data=kwargs.pop('input_data', None),
+                pipe_stage=kwargs.pop('pipe_stage', False)
+            )
 
-                    # After all scope checks are done check if this is a
-                    # config environment var of the cli
-                    try:
-                        return self.context.variables.variables[token.name].value
-                    except KeyError:
-                        pass
+        return self.compiler.compile(token)(env, path, first)
 
-                    raise SyntaxError(_('{0} not found'.format(token.name)))
+    def eval_symbol(self, name, env, cwd, variables=None):
+        if variables is None:
+            variables = self.context.variables
 
-            if isinstance(token, AssignmentStatement):
-                expr = flatten_table(self.eval(token.expr, env=env, first=first))
+        item = self.find_in_scope(name, cwd=cwd, env=env, variables=variables)
+        if item is not None:
+            return item
 
-                if token.name in self.context.variables.variables:
-                    raise SyntaxError(_(
-                        "{0} is a configuration variable. Use `setopt` command to set it".format(token.name)
-                    ))
+        item = self.find_in_scope(name.split('/')[0], cwd=cwd, env=env, variables=variables) \
+            if isinstance(name, str) and '/' in name \
+            else None
 
-                if isinstance(token.name, Subscript):
-                    array = self.eval(token.name.expr, env=env)
-                    index = self.eval(token.name.index, env=env)
-                    array[index] = expr
-                    return
+        if item is not None:
+            raise SyntaxError("Use of slashes as separators not allowed. Please use spaces instead or "
+                              "use the 'cd' command to navigate")
 
-                try:
-                    var = env.find(token.name)
-                    if var.const:
-                        raise SyntaxError('{0} is defined as a constant'.format(token.name))
+        try:
+            item = env.find(name)
+            return item.value if isinstance(item, Environment.Variable) else item
+        except KeyError:
 
-                    var.value = expr
-                except KeyError:
-                    env[token.name] = Environment.Variable(expr)
+            # After all scope checks are done check if this is a
+            # config environment var of the cli
+            try:
+                return self.context.variables.variables[name].value
+            except KeyError:
+                pass
 
-                return
+            raise SyntaxError(_('{0} not found'.format(name)))
 
-            if isinstance(token, ConstStatement):
-                expr = self.eval(token.expr, env=env, first=first)
-                env[token.name.name] = Environment.Variable(expr, True)
-                return
+    def eval_command_call(self, token, env, path, first=False, dry_run=None, serialize_filter=None,
+                          input_data=None, variables=None, from_root=False, start=0, pipe_stage=False):
+        if variables is None:
+            variables = self.context.variables
 
-            if isinstance(token, IfStatement):
-                expr = self.eval(token.expr, env=env)
-                body = token.body if expr else token.else_body
-                self.eval_block(body, env, False)
-                return
+        cwd = self.get_cwd(path)
 
-            if isinstance(token, ForStatement):
-                self.eval(token.stmt1, env=env)
+        if first:
+            self.reset_on_first_run()
 
-                while self.eval(token.expr, env=env):
-                    self.eval_block(token.body, env, True)
-                    self.eval(token.stmt2, env=env)
+        if from_root:
+            path = self.root_path[:]
 
-                return
+        success = True
+        error = None
 
-            if isinstance(token, ForInStatement):
-                local_env = Environment(self.context, outer=env)
-                expr = self.eval(token.expr, env=env)
-                if isinstance(token.var, tuple):
-                    if isinstance(expr, dict):
-                        expr_iter = expr.items()
+        try:
+            if len(token.args) == start:
+                if path[0] == self.context.root_ns:
+                    self.path = self.root_path[:]
+                    path.pop(0)
+                for i in path:
+                    if i == '..':
+                        if len(self.path) > 1:
+                            self.cd_up()
                     else:
-                        expr_iter = expr.copy()
-                    for k, v in expr_iter:
-                        local_env[token.var[0]] = k
-                        local_env[token.var[1]] = v
-                        try:
-                            self.eval_block(token.body, local_env, True)
-                        except FlowControlInstruction as f:
-                            if f.type == FlowControlInstructionType.BREAK:
-                                return
-
-                            raise f
-                else:
-                    for i in expr:
-                        local_env[token.var] = i
-                        try:
-                            self.eval_block(token.body, local_env, True)
-                        except FlowControlInstruction as f:
-                            if f.type == FlowControlInstructionType.BREAK:
-                                return
-
-                            raise f
-
-                return
-
-            if isinstance(token, WhileStatement):
-                while True:
-                    expr = self.eval(token.expr, env=env)
-                    if not expr:
-                        return
-
-                    try:
-                        self.eval_block(token.body, env, True)
-                    except FlowControlInstruction as f:
-                        if f.type == FlowControlInstructionType.BREAK:
-                            return
-
-                        raise f
-
-            if isinstance(token, ReturnStatement):
-                raise FlowControlInstruction(
-                    FlowControlInstructionType.RETURN,
-                    self.eval(token.expr, env=env)
-                )
-
-            if isinstance(token, BreakStatement):
-                raise FlowControlInstruction(FlowControlInstructionType.BREAK)
-
-            if isinstance(token, UndefStatement):
-                del env[token.name]
-                return
-
-            if isinstance(token, AssertStatement):
-                expr = self.eval(token.expr, env=env, first=first)
-                if not expr:
-                    raise CommandException('Assertion failed: {0}'.format(self.eval(token.msg, env=env)))
+                        self.cd(i)
 
                 return
 
-            if isinstance(token, SyncCommandExpansion):
-                expr = self.eval(token.expr, env=env, first=first)
-                if hasattr(expr, 'wait'):
-                    try:
-                        return expr.wait()
-                    except BaseException as err:
-                        env['_success'] = Environment.Variable(False)
-                        env['_error'] = Environment.Variable(str(err))
-                    else:
-                        env['_success'] = True
-                        env['_error'] = None
-
-                    return
-
-            if isinstance(token, (ExpressionExpansion, CommandExpansion)):
-                expr = self.eval(token.expr, env=env, first=first)
-
-                # Table data needs to be flattened upon assignment
-                if isinstance(expr, Table):
-                    rows = list(expr.data)
-                    expr.data = rows
-
-                return expr
-
-            if isinstance(token, CommandCall):
-                token = copy.deepcopy(token)
-                success = True
-                error = None
-
-                try:
-                    if len(token.args) == 0:
-                        if path[0] == self.context.root_ns:
-                            self.path = self.root_path[:]
-                            path.pop(0)
-                        for i in path:
-                            if i == '..':
-                                if len(self.path) > 1:
-                                    self.cd_up()
-                            else:
-                                self.cd(i)
-
-                        return
-
-                    top = token.args.pop(0)
-                    if top == '..':
-                        if len(token.args) > 0 and isinstance(token.args[0], Symbol) and '/' in token.args[0].name:
-                            raise SyntaxError("Use of slashes as separators not allowed. Please use spaces instead or "
-                                              "use the 'cd' command to navigate")
-                        if len(path) == 0:
-                            if len(self.path) > 1:
-                                self.path[-2].on_enter()
-                        elif path[-1] != '..':
-                            path[-1].on_enter()
-                        else:
-                            if len(self.path) > 1:
-                                self.path[-2].on_enter()
-
-                        path.append('..')
-                        return self.eval(token, env=env, path=path, dry_run=dry_run)
-                    elif isinstance(top, Symbol) and top.name == '/':
-                        if first:
-                            self.start_from_root = True
-                            return self.eval(token, env=env, path=path, dry_run=dry_run)
-
-                    if isinstance(top, ExpressionExpansion):
-                        top = Symbol(self.eval(top, env=env, path=path))
-
-                    if isinstance(top, Literal):
-                        top = Symbol(top.value)
-
-                    item = self.eval(top, env=env, path=path, dry_run=dry_run)
-
-                    if isinstance(item, Namespace):
-                        item.on_enter()
-                        return self.eval(token, env=env, path=path+[item], dry_run=dry_run)
-
-                    if isinstance(item, Alias):
-                        return self.eval(item.ast, env=env, path=path)[0]
-
-                    if isinstance(item, Command):
-                        completions = item.complete(self.context)
-                        token_args = convert_to_literals(token.args)
-                        if len(token_args) > 0 and token_args[0] == '..':
-                            args = [token_args[0]]
-                            kwargs = None
-                            opargs = None
-                        else:
-                            args, kwargs, opargs = expand_wildcards(
-                                self.context,
-                                *sort_args([self.eval(i, env=env) for i in token_args]),
-                                completions=completions
-                            )
-
-                        item.exec_path = path if len(path) >= 1 else self.path
-                        item.cwd = self.cwd
-                        item.current_env = env
-                        item.variables = variables
-                        if dry_run:
-                            return item, cwd, args, kwargs, opargs
-
-                        if isinstance(item, PipeCommand):
-                            if first:
-                                raise CommandException(_('Invalid usage.\n{0}'.format(inspect.getdoc(item))))
-                            if serialize_filter:
-                                ret = item.serialize_filter(self.context, args, kwargs, opargs)
-                                if ret is not None:
-                                    if 'filter' in ret:
-                                        serialize_filter['filter'] += ret['filter']
-
-                                    if 'params' in ret:
-                                        serialize_filter['params'].update(ret['params'])
-
-                            return item.run(self.context, args, kwargs, opargs, input=input_data)
-                        else:
-                            return item.run(self.context, args, kwargs, opargs)
-
-                except BaseException as err:
-                    success = False
-                    error = str(err)
-                    raise err
-                finally:
-                    env['_success'] = Environment.Variable(success)
-                    env['_error'] = Environment.Variable(error)
-
-                env['_success'] = Environment.Variable(False)
-                raise SyntaxError("Command or namespace {0} not found".format(top.name))
-
-            if isinstance(token, FunctionCall):
-                args = list(map(lambda a: flatten_table(self.eval(a, env=env, first=True)), token.args))
-                func = env.find(token.name)
-                if func:
-                    if isinstance(func, Environment.Variable):
-                        func = func.value
-
-                    self.context.call_stack.append(
-                        CallStackEntry(func.name, args, token.file, token.line, token.column)
+            top = token.args[start]
+            start += 1
+            if top == '..':
+                if len(token.args) > start and isinstance(token.args[start], Symbol) and '/' in token.args[start].name:
+                    raise SyntaxError("Use of slashes as separators not allowed. Please use spaces instead or "
+                                      "use the 'cd' command to navigate")
+                if len(path) == 0:
+                    if len(self.path) > 1:
+                        self.path[-2].on_enter()
+                elif path[-1] != '..':
+                    path[-1].on_enter()
+                else:
+                    if len(self.path) > 1:
+                        self.path[-2].on_enter()
+
+                path.append('..')
+                return self.eval_command_call(token, env, path, dry_run=dry_run, start=start)
+            elif isinstance(top, Symbol) and top.name == '/':
+                if first:
+                    return self.eval_command_call(token, env, path, dry_run=dry_run, from_root=True, start=start)
+
+            if isinstance(top, ExpressionExpansion):
+                top = Symbol(self.eval(top, env=env, path=path))
+
+            if isinstance(top, Literal):
+                top = Symbol(top.value)
+
+            if isinstance(top, Symbol) and start == 1 and pipe_stage and top.name in self.pipe_commands:
+                # Pipe stages must not resolve to a same named command of the current namespace
+                item = self.pipe_commands[top.name]()
+                item.env = env
+                item.variables = variables
+            elif isinstance(top, Symbol):
+                item = self.eval_symbol(top.name, env, self.get_cwd(path))
+            else:
+                item = self.eval(top, env=env, path=path, dry_run=dry_run)
+
+            if isinstance(item, Namespace):
+                item.on_enter()
+                return self.eval_command_call(token, env, path + [item], dry_run=dry_run, start=start)
+
+            if isinstance(item, Alias):
+                return self.eval(item.ast, env=env, path=path)[0]
+
+            if isinstance(item, Command):
+                completions = item.complete(self.context)
+                token_args = convert_to_literals(token.args[start:])
+                if len(token_args) > 0 and token_args[0] == '..':
+                    args = [token_args[0]]
+                    kwargs = None
+                    opargs = None
+                else:
+                    args, kwargs, opargs = expand_wildcards(
+                        self.context,
+                        *sort_args([self.eval(i, env=env) for i in token_args]),
+                        completions=completions
                     )
 
-                    result = func(env, *args)
-                    self.context.call_stack.pop()
-                    return result
-
-                raise SyntaxError("Function {0} not found".format(token.name))
-
-            if isinstance(token, Subscript):
-                expr = flatten_table(self.eval(token.expr, env=env))
-                index = self.eval(token.index, env=env)
-                return expr[index]
-
-            if isinstance(token, FunctionDefinition):
-                env[token.name] = Function(self.context, token.name, token.args, token.body, env)
-                return
-
-            if isinstance(token, BinaryParameter):
-                return token.left, token.op, self.eval(token.right, env=env)
-
-            if isinstance(token, PipeExpr):
-                if serialize_filter:
-                    self.eval(token.left, env=env, path=path, serialize_filter=serialize_filter)
-                    self.eval(token.right, env=env, path=path, serialize_filter=serialize_filter)
-                    return
-
-                cmd, cwd, args, kwargs, opargs = self.eval(token.left, env=env, path=path, dry_run=True, first=first)
-
-                if self.context.pipe_cwd is None:
-                    cwd.on_enter()
-                    self.context.pipe_cwd = cwd
-
-                if isinstance(cmd, FilteringCommand):
-                    # Do serialize_filter pass
-                    filt = {"filter": [], "params": {}}
-                    self.eval(token.right, env=env, path=path, serialize_filter=filt)
-                    result = cmd.run(self.context, args, kwargs, opargs, filtering=filt)
-                elif isinstance(cmd, PipeCommand):
-                    result = cmd.run(self.context, args, kwargs, opargs, input=input_data)
+                item.exec_path = path if len(path) >= 1 else self.path
+                item.cwd = self.cwd
+                item.current_env = env
+                item.variables = variables
+                if dry_run:
+                    return item, cwd, args, kwargs, opargs
+
+                if isinstance(item, PipeCommand):
+                    if first:
+                        raise CommandException(_('Invalid usage.\n{0}'.format(inspect.getdoc(item))))
+                    if serialize_filter:
+                        ret = item.serialize_filter(self.context, args, kwargs, opargs)
+                        if ret is not None:
+                            if 'filter' in ret:
+                                serialize_filter['filter'] += ret['filter']
+
+                            if 'params' in ret:
+                                serialize_filter['params'].update(ret['params'])
+
+                    return item.run(self.context, args, kwargs, opargs, input=input_data)
                 else:
-                    result = cmd.run(self.context, args, kwargs, opargs)
+                    return item.run(self.context, args, kwargs, opargs)
 
-                return self.eval(token.right, env=env, path=path, input_data=result)
+        except BaseException as err:
+            success = False
+            error = str(err)
+            raise err
+        finally:
+            env['_success'] = Environment.Variable(success)
+            env['_error'] = Environment.Variable(error)
 
-            if isinstance(token, ShellEscape):
-                return self.builtin_commands['shell']().run(
-                    self.context,
-                    [self.eval(t) for t in convert_to_literals(token.args)],
-                    {}, {}
-                )
+        env['_success'] = Environment.Variable(False)
+        raise SyntaxError("Command or namespace {0} not found".format(top.name))
 
-            if isinstance(token, Quote):
-                return token
+    def eval_pipe(self, token, env, path, first=False, serialize_filter=None, input_data=None, pipe_stage=False):
+        if first:
+            self.reset_on_first_run()
 
-            if isinstance(token, Redirection):
-                with open(token.path, 'a+') as f:
-                    format_output(self.eval(token.body, env=env, path=path, first=first), file=f)
-                    return None
+        if serialize_filter:
+            self.eval(token.left, env=env, path=path, serialize_filter=serialize_filter, pipe_stage=pipe_stage)
+            self.eval(token.right, env=env, path=path, serialize_filter=serialize_filter, pipe_stage=True)
+            return
 
-        except SystemExit as err:
-            raise err
+        cmd, cwd, args, kwargs, opargs = self.eval(
+            token.left, env=env, path=path, dry_run=True, first=first, pipe_stage=pipe_stage
+        )
 
-        except BaseException as err:
-            raise err
+        if self.context.pipe_cwd is None:
+            cwd.on_enter()
+            self.context.pipe_cwd = cwd
+
+        if isinstance(cmd, FilteringCommand):
+            # Do serialize_filter pass
+            filt = {"filter": [], "params": {}}
+            self.eval(token.right, env=env, path=path, serialize_filter=filt, pipe_stage=True)
+            result = cmd.run(self.context, args, kwargs, opargs, filtering=filt)
+        elif isinstance(cmd, PipeCommand):
+            result = cmd.run(self.context, args, kwargs, opargs, input=input_data)
+        else:
+            result = cmd.run(self.context, args, kwargs, opargs)
 
-        raise SyntaxError("Invalid syntax: {0}".format(token))
+        return self.eval(token.right, env=env, path=path, input_data=result, pipe_stage=True)
 
     def process(self, line):
         def add_line_to_history(line):
@@ -1610,6 +2625,7 @@ class MainLoop(object):
             prev = self.prev_path[:]
             self.prev_path = self.path[:]
             self.path = prev
+            self.release_subscribers()
             return
 
         try:
@@ -1685,6 +2701,8 @@ class MainLoop(object):
                 output_msg(error_trace)
 
             return 1
+        finally:
+            self.release_subscribers()
 
         return 0
 
@@ -1712,11 +2730,14 @@ class MainLoop(object):
                 continue
 
             if issubclass(type(ptr), Namespace):
-                for ns in ptr.namespaces():
-                    if ns.get_name() == name:
-                        path.append(ns)
-                        ptr = path[-1]
-                        break
+                # Root index resolves names without importing every deferred plugin
+                ns = ptr.get_index()[0].get(name)
+                if ns is None and not isinstance(ptr, RootNamespace):
+                    ns = first_or_default(lambda n: n.get_name() == name, ptr.namespaces())
+
+                if ns is not None:
+                    path.append(ns)
+                    ptr = path[-1]
 
                 cmds = ptr.commands()
                 if name in cmds:
@@ -1766,7 +2787,7 @@ class MainLoop(object):
                             token = token.right
                             builtin_command_set = list(self.pipe_commands.keys())
 
-                        args = token.args
+                        args = list(token.args)
 
                 if isinstance(token, CommandCall) or not args:
                     obj = self.get_relative_object(self.cwd, args)
@@ -1793,7 +2814,7 @@ class MainLoop(object):
                     c_opargs = []
 
                     with contextlib.suppress(BaseException):
-                        token_args = convert_to_literals(copy.deepcopy(token).args)
+                        token_args = convert_to_literals(args)
 
                         if len(token_args) > 0 and token_args[0] == '..':
                             args = [token_args[0]]
@@ -1855,7 +2876,52 @@ class MainLoop(object):
         sys.stdout.flush()
 
 
-def main(argv=None):
+def fanout(context, args):
+    if not args.e and not args.f:
+        context.argparse_parser.error(_('--hosts and --hosts-file require -e or -f'))
+
+    hosts = read_hosts(args.hosts, args.hosts_file)
+    if args.f:
+        with (sys.stdin if args.f == '-' else open(args.f)) as f:
+            commands = f.read()
+    else:
+        commands = args.e
+
+    username = None
+    if not all(urlparse(i if '://' in i else 'ws://' + i).username for i in hosts):
+        username = six.moves.input('Please provide a username: ')
+
+    if args.p is None:
+        args.p = getpass.getpass('Please provide a password: ')
+
+    # Settings of the local context are used to print the merged results
+    context.variables.load(args.c)
+
+    def session(host):
+        ctx = Context()
+        ctx.parsed_uri = urlparse(host if '://' in host else 'ws://' + host)
+        ctx.uri = ctx.parsed_uri.hostname if ctx.parsed_uri.scheme == 'ws' else host
+        ctx.hostname = ctx.parsed_uri.hostname or 'localhost'
+        ctx.read_middleware_config_file(args.m)
+        ctx.variables.load(args.c)
+        ctx.start(args.p)
+        ctx.ml = MainLoop(ctx)
+        ctx.user = ctx.parsed_uri.username or username
+        ctx.login(ctx.user, args.p)
+
+        for i in args.D or []:
+            name, value = i.split('=')
+            ctx.global_env[name] = value
+
+        ctx.wait_entity_subscribers()
+        for i in parse(commands, '<{0}>'.format(host)):
+            ctx.call_stack = []
+            yield ctx.ml.eval(i, first=True, printable_none=True)
+
+    return run_fanout(hosts, session, args.j, args.ndjson)
+
+
+def main(argv=None, session_client=True):
     if not argv:
         argv = sys.argv[1:]
 
@@ -1899,12 +2965,30 @@ def main(argv=None):
     parser.add_argument('-f', metavar='INPUT')
     parser.add_argument('-p', metavar='PASSWORD')
     parser.add_argument('-D', metavar='DEFINE', action='append')
+    parser.add_argument('--session', metavar='SOCKET', nargs='?', const=default_socket_path(),
+                        help='Run -e commands through a session server, if one is listening')
+    parser.add_argument('--session-server', metavar='SOCKET', nargs='?', const=default_socket_path(),
+                        help='Keep the session open and serve --session clients')
+    parser.add_argument('--hosts', metavar='HOSTS', help='Comma separated list of hosts to run -e or -f on')
+    parser.add_argument('--hosts-file', metavar='FILE', help='File with one host per line to run -e or -f on')
+    parser.add_argument('-j', metavar='JOBS', type=int, default=DEFAULT_JOBS,
+                        help='Number of hosts to run on at once')
+    parser.add_argument('--ndjson', action='store_true', help='Print one JSON result per host as it completes')
     args = parser.parse_args(argv)
 
+    if session_client and args.session and args.e:
+        defines = dict(i.split('=') for i in args.D or [])
+        status = run_client(args.session, args.e, defines)
+        if status is not None:
+            sys.exit(status)
+
     context = Context()
     context.argparse_parser = parser
     context.docgen_run = args.makedocs
 
+    if args.hosts or args.hosts_file:
+        sys.exit(fanout(context, args))
+
     if not context.docgen_run and os.environ.get('FREENAS_SYSTEM') != 'YES' and args.uri == 'unix:':
         args.uri = six.moves.input('Please provide FreeNAS IP: ')
 
@@ -1978,6 +3062,23 @@ def main(argv=None):
             name, value = i.split('=')
             context.global_env[name] = value
 
+    if args.session_server:
+        context.wait_entity_subscribers()
+
+        def run_session(commands, defines):
+            # Every request starts from the same state, however the previous one ended
+            env = dict(context.global_env)
+            ml.path = ml.root_path[:]
+            context.global_env.update(defines)
+            try:
+                return ml.process(commands)
+            finally:
+                context.global_env.clear()
+                context.global_env.update(env)
+
+        SessionServer(args.session_server, run_session).serve_forever()
+        return
+
     if args.e:
         context.wait_entity_subscribers()
         sys.exit(ml.process(args.e))
@@ -0,0 +1,258 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+"""
+Call counters and latency histograms for RPC calls, tasks and entity
+subscriber syncs.
+
+Recording is off by default. While it is off, callers check the
+'enabled' attribute and go straight to the connection, so nothing is
+measured and nothing is allocated.
+"""
+
+import json
+import time
+import bisect
+import threading
+
+
+# Upper bounds (in seconds) of latency histogram buckets; last bucket is unbounded
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+KINDS = ('rpc', 'task', 'subscriber')
+
+
+def payload_size(obj):
+    try:
+        return len(json.dumps(obj, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class Counter(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.sent = 0
+        self.received = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, elapsed, sent=0, received=0, error=False):
+        self.count += 1
+        self.errors += int(error)
+        self.sent += sent
+        self.received += received
+        self.total += elapsed
+        self.min = elapsed if self.min is None else min(self.min, elapsed)
+        self.max = elapsed if self.max is None else max(self.max, elapsed)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    def percentile(self, p):
+        """
+        Estimates the p-th percentile as upper bound of the bucket it falls into.
+        """
+        if not self.count:
+            return None
+
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS + (self.max,), self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'bytes_sent': self.sent,
+            'bytes_received': self.received,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'histogram': [
+                {'le': bound, 'count': n}
+                for bound, n in zip(LATENCY_BUCKETS + (None,), self.buckets)
+            ]
+        }
+
+
+class RpcStats(object):
+    """
+    Per method (or task, or subscriber) counters, grouped by kind.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters = {k: {} for k in KINDS}
+        self.tasks = {}
+        self.finished_early = {}
+        self.submitting = 0
+
+    def enable(self, enabled):
+        self.enabled = bool(enabled)
+
+    def record(self, kind, name, elapsed, sent=0, received=0, error=False):
+        with self.lock:
+            counter = self.counters[kind].get(name)
+            if not counter:
+                counter = self.counters[kind][name] = Counter()
+
+            counter.record(elapsed, sent, received, error)
+
+    def call(self, kind, name, args, fn):
+        """
+        Calls fn() and records it under 'name'. Sizes recorded are those of
+        JSON serialized call arguments and of the result.
+        """
+        start = time.monotonic()
+        try:
+            result = fn()
+        except BaseException:
+            self.record(kind, name, time.monotonic() - start, payload_size(args), error=True)
+            raise
+
+        self.record(kind, name, time.monotonic() - start, payload_size(args), payload_size(result))
+        return result
+
+    def wrap_callback(self, name, args, callback):
+        start = time.monotonic()
+
+        def done(*result):
+            self.record('rpc', name, time.monotonic() - start, payload_size(args), payload_size(result[:1]))
+            if callback:
+                return callback(*result)
+
+        return done
+
+    def submit_task(self, name, args, fn):
+        """
+        Submits a task by calling fn(), which returns its id. Tasks ending
+        before task.submit returns are kept aside by task_finished() and
+        recorded here once their id is known.
+        """
+        start = time.monotonic()
+        with self.lock:
+            self.submitting += 1
+
+        try:
+            tid = self.call('rpc', 'task.submit', (name, args), fn)
+        except BaseException:
+            with self.lock:
+                self.end_submit()
+            raise
+
+        with self.lock:
+            ended = self.finished_early.pop(tid, None)
+            if ended is None:
+                self.tasks[tid] = (name, start, payload_size(args))
+
+            self.end_submit()
+
+        if ended:
+            state, end = ended
+            self.record('task', name, end - start, payload_size(args), error=state != 'FINISHED')
+
+        return tid
+
+    def end_submit(self):
+        # Finishes of unknown tasks are only worth keeping while a submit
+        # they may belong to is in progress
+        self.submitting -= 1
+        if not self.submitting:
+            self.finished_early.clear()
+
+    def task_finished(self, tid, state):
+        end = time.monotonic()
+        with self.lock:
+            task = self.tasks.pop(tid, None)
+            if not task and self.submitting:
+                # Possibly one of ours, with task.submit not returned yet
+                self.finished_early[tid] = (state, end)
+
+        if task:
+            name, start, sent = task
+            self.record('task', name, end - start, sent, error=state != 'FINISHED')
+
+    def watch_subscriber(self, subscriber, name):
+        """
+        Records time it takes subscriber to sync and number of entities it got.
+        """
+        start = time.monotonic()
+
+        def wait():
+            subscriber.wait_ready()
+            self.record('subscriber', name, time.monotonic() - start, received=len(subscriber.items))
+
+        threading.Thread(target=wait, daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.counters = {k: {} for k in KINDS}
+            self.tasks = {}
+            self.finished_early = {}
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'since': self.started_at,
+                'buckets': list(LATENCY_BUCKETS),
+                **{
+                    kind: {name: c.to_dict() for name, c in sorted(counters.items())}
+                    for kind, counters in self.counters.items()
+                }
+            }
+
+    def rows(self):
+        """
+        Flat list of summaries of all counters, for display.
+        """
+        with self.lock:
+            return [
+                dict(c.to_dict(), kind=kind, name=name)
+                for kind in KINDS
+                for name, c in sorted(self.counters[kind].items())
+            ]
+
+    def dump(self, file=None):
+        data = json.dumps(self.to_dict(), indent=4)
+        if file is None:
+            return data
+
+        with open(file, 'w') as f:
+            f.write(data)
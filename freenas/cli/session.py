@@ -0,0 +1,269 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+"""
+Warm session server and thin client for one-shot command execution.
+
+The server keeps a logged in CLI context with synced entity subscribers
+and listens on a UNIX socket. A client passes its stdin, stdout and stderr
+descriptors over the socket, together with the commands to run. The server
+evaluates them with those descriptors installed as its own standard
+streams, so output goes straight to the client terminal or pipe, and
+finally replies with the exit status.
+
+Only the standard library is used here, so that the client side does not
+pay for anything the full CLI needs: main() serves '--session -e'
+invocations and only imports the rest of the CLI if no server answers.
+
+The socket lives in a directory private to the user, and both ends check
+that the peer runs as the same user before passing any descriptors.
+"""
+
+import os
+import sys
+import stat
+import json
+import array
+import struct
+import socket
+import logging
+import gettext
+import argparse
+import tempfile
+
+
+t = gettext.translation('freenas-cli', fallback=True)
+_ = t.gettext
+
+STDIO_FDS = (0, 1, 2)
+MAX_REQUEST_SIZE = 1024 * 1024
+logger = logging.getLogger('cli.session')
+
+
+def default_socket_path():
+    return os.path.join(
+        os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(),
+        'freenas-cli.{0}'.format(os.getuid()),
+        'session.sock'
+    )
+
+
+def check_private_dir(path):
+    """
+    Raises PermissionError unless 'path' is a directory (not a symlink)
+    owned by the current user and not accessible by anybody else.
+    """
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(_('{0} is not a private directory of the current user').format(path))
+
+
+def peer_uid(sock):
+    """
+    Returns user id of the process on the other end of a UNIX socket, or
+    None if the platform cannot tell.
+    """
+    if hasattr(socket, 'SO_PEERCRED'):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        return struct.unpack('3i', creds)[1]
+
+    if hasattr(socket, 'LOCAL_PEERCRED'):
+        # struct xucred starts with u_int cr_version and uid_t cr_uid
+        creds = sock.getsockopt(0, socket.LOCAL_PEERCRED, 256)
+        return struct.unpack_from('2I', creds)[1]
+
+    return None
+
+
+def check_peer(sock):
+    uid = peer_uid(sock)
+    if uid is not None and uid != os.getuid():
+        raise PermissionError(_('Session peer runs as user id {0}').format(uid))
+
+
+def send_fds(sock, data, fds):
+    sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+
+
+def recv_fds(sock, size, maxfds):
+    fds = array.array('i')
+    msg, ancdata, flags, addr = sock.recvmsg(size, socket.CMSG_LEN(maxfds * fds.itemsize))
+    for level, type, data in ancdata:
+        if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+
+    return msg, list(fds)
+
+
+def read_line(sock, limit=MAX_REQUEST_SIZE):
+    buf = b''
+    while not buf.endswith(b'\n'):
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+
+        buf += chunk
+        if len(buf) > limit:
+            raise ValueError(_('Request too large'))
+
+    return buf
+
+
+def run_client(path, commands, defines=None):
+    """
+    Runs commands through a session server listening on 'path'.
+
+    Returns the exit status, or None if no server could be reached, in
+    which case the caller is supposed to run the commands by itself.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        check_private_dir(os.path.dirname(os.path.abspath(path)))
+        sock.connect(path)
+        check_peer(sock)
+    except PermissionError as err:
+        sock.close()
+        sys.stderr.write(_('Not using session server: {0}\n').format(err))
+        return None
+    except (OSError, IOError):
+        sock.close()
+        return None
+
+    with sock:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        request = json.dumps({'commands': commands, 'defines': defines or {}}) + '\n'
+        send_fds(sock, b'F', STDIO_FDS)
+        sock.sendall(request.encode('utf-8'))
+
+        response = read_line(sock)
+        if not response:
+            sys.stderr.write(_('Session server closed the connection\n'))
+            return 1
+
+        return json.loads(response.decode('utf-8')).get('status', 1)
+
+
+class SessionServer(object):
+    """
+    Serves requests of run_client() one at a time.
+
+    'handler' is called with the commands string and a dictionary of
+    variable definitions while the client descriptors are installed as
+    standard streams, and returns the exit status.
+    """
+    def __init__(self, path, handler):
+        self.path = path
+        self.handler = handler
+        self.sock = None
+
+    def serve_forever(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_private_dir(directory)
+        if os.path.lexists(self.path):
+            os.unlink(self.path)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            self.sock.bind(self.path)
+        finally:
+            os.umask(old_umask)
+
+        self.sock.listen(16)
+        logger.info('Session server listening on %s', self.path)
+
+        try:
+            while True:
+                conn, addr = self.sock.accept()
+                with conn:
+                    try:
+                        self.serve(conn)
+                    except Exception:
+                        logger.exception('Failed to serve session request')
+        finally:
+            self.sock.close()
+            os.unlink(self.path)
+
+    def serve(self, conn):
+        check_peer(conn)
+        msg, fds = recv_fds(conn, 1, len(STDIO_FDS))
+        try:
+            if len(fds) != len(STDIO_FDS):
+                raise ValueError(_('Client did not pass its standard streams'))
+
+            request = json.loads(read_line(conn).decode('utf-8'))
+            status = self.run(request, fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+        conn.sendall((json.dumps({'status': status}) + '\n').encode('utf-8'))
+
+    def run(self, request, fds):
+        saved = [os.dup(i) for i in STDIO_FDS]
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, target in zip(fds, STDIO_FDS):
+            os.dup2(fd, target)
+
+        try:
+            status = self.handler(request.get('commands', ''), request.get('defines', {}))
+        except SystemExit as err:
+            status = err.code if isinstance(err.code, int) else 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, target in zip(saved, STDIO_FDS):
+                os.dup2(fd, target)
+                os.close(fd)
+
+        return status or 0
+
+
+def main(argv=None):
+    """
+    Entry point of the CLI. Runs '--session -e' invocations through a
+    session server and hands anything else to freenas.cli.repl.main().
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    parser.add_argument('-e')
+    parser.add_argument('-D', action='append')
+    parser.add_argument('--session', nargs='?', const=default_socket_path())
+    args = parser.parse_known_args(argv)[0]
+
+    if args.session and args.e:
+        status = run_client(args.session, args.e, dict(i.split('=') for i in args.D or []))
+        if status is not None:
+            sys.exit(status)
+
+    from freenas.cli import repl
+    repl.main(argv, session_client=False)
@@ -0,0 +1,275 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+"""
+Entity subscriber limited to entities matching a filter.
+
+A regular entity subscriber mirrors a whole collection. For collections
+which can grow very large (snapshots, task history), ScopedEntitySubscriber
+keeps only entities matching its scope: it syncs by querying with the scope
+as filter, keeps entities which still match after change events, and
+fetches anything else on demand, without storing it. Change events are
+applied by a worker thread, so fetching changed entities never blocks
+the connection's event thread.
+"""
+
+import queue
+import logging
+import threading
+import collections
+from freenas.utils import query as q
+from freenas.cli.filtering import compile_filter
+
+
+logger = logging.getLogger('cli.subscriber')
+
+
+class ScopedEntitySubscriber(object):
+    """
+    Mostly interchangeable with freenas.dispatcher.entity.EntitySubscriber.
+
+    Entities leaving the scope because of an update are reported through
+    on_update (and to listeners) one last time and then dropped. Entities
+    first seen already outside of the scope (eg. tasks which finished
+    before their first change event got handled) are reported through
+    on_add once, without being stored.
+    """
+    def __init__(self, client, name, scope):
+        self.client = client
+        self.name = name
+        self.scope = list(scope)
+        self.matches = compile_filter(self.scope)
+        self.items = collections.OrderedDict()
+        self.on_add = set()
+        self.on_update = set()
+        self.on_delete = set()
+        self.listeners = {}
+        self.event = 'entity-subscriber.{0}.changed'.format(name)
+        self.event_handler = None
+        self.changes = queue.Queue()
+        self.ready = threading.Event()
+        self.lock = threading.RLock()
+        self.cv = threading.Condition(self.lock)
+
+    def start(self):
+        worker = threading.Thread(target=self.process_changes)
+        worker.daemon = True
+        worker.start()
+        self.event_handler = self.client.register_event_handler(self.event, self.on_changed)
+        thread = threading.Thread(target=self.sync)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        if self.event_handler:
+            self.client.unregister_event_handler(self.event, self.event_handler)
+            self.event_handler = None
+            self.changes.put(None)
+
+    def sync(self):
+        try:
+            entities = self.client.call_sync('{0}.query'.format(self.name), self.scope)
+            with self.lock:
+                for i in entities:
+                    self.items.setdefault(i['id'], i)
+        except Exception as err:
+            logger.warning('Cannot sync %s: %s', self.name, err)
+        finally:
+            self.ready.set()
+
+    def wait_ready(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    def fetch(self, *filter):
+        return self.client.call_sync('{0}.query'.format(self.name), list(filter))
+
+    def on_changed(self, args):
+        self.changes.put(args)
+
+    def process_changes(self):
+        while True:
+            args = self.changes.get()
+            if args is None:
+                return
+
+            try:
+                self.apply_changes(args)
+            except Exception as err:
+                logger.warning('Cannot apply changes to %s: %s', self.name, err)
+
+    def apply_changes(self, args):
+        operation = args['operation']
+        ids = args.get('ids') or []
+
+        if operation == 'delete':
+            for i in ids:
+                self.remove(i)
+            return
+
+        if operation == 'rename':
+            with self.lock:
+                for old_id, new_id in dict(ids).items():
+                    entity = self.items.pop(old_id, None)
+                    if entity is not None:
+                        entity['id'] = new_id
+                        self.items[new_id] = entity
+            return
+
+        entities = args.get('entities')
+        if entities is None:
+            # Not filtered by scope, so that entities which have already
+            # left it still get their last notification
+            entities = self.fetch(('id', 'in', ids))
+
+        for i in entities:
+            self.update(i)
+
+    def update(self, entity):
+        with self.lock:
+            old = self.items.get(entity['id'])
+            if self.matches(entity):
+                self.items[entity['id']] = entity
+            elif old is not None:
+                del self.items[entity['id']]
+
+            self.notify(entity['id'], 'create' if old is None else 'update', old, entity)
+
+        if old is None:
+            for cb in list(self.on_add):
+                cb(entity)
+        else:
+            for cb in list(self.on_update):
+                cb(old, entity)
+
+    def remove(self, id):
+        with self.lock:
+            entity = self.items.pop(id, None)
+            if entity is None:
+                return
+
+            self.notify(id, 'delete', entity, None)
+
+        for cb in list(self.on_delete):
+            cb(entity)
+
+    def holds(self, id):
+        return id in self.items
+
+    def add_listener(self, id, events=None):
+        """
+        Returns a queue receiving (operation, old, new) tuples for changes
+        of entity 'id'. Passing the same queue for several ids merges them.
+        """
+        if events is None:
+            events = queue.Queue()
+
+        with self.lock:
+            self.listeners.setdefault(id, []).append(events)
+
+        return events
+
+    def remove_listener(self, id, events):
+        with self.lock:
+            self.listeners[id].remove(events)
+            if not self.listeners[id]:
+                del self.listeners[id]
+
+    def notify(self, id, operation, old, new):
+        for i in self.listeners.get(id, []):
+            i.put((operation, old, new))
+
+        self.cv.notify_all()
+
+    def query(self, *filter, **params):
+        callback = params.pop('callback', None)
+        with self.lock:
+            entities = list(self.items.values())
+
+        result = q.query(entities, *filter, **params)
+        if callback:
+            if params.get('single'):
+                return callback(result) if result is not None else None
+
+            return list(map(callback, result))
+
+        return result
+
+    def get(self, id, timeout=None, remote=False):
+        """
+        Returns entity with given id - from memory if it is in scope,
+        otherwise fetched from the server (and not stored), whatever
+        'remote' says. With a timeout, an entity the server does not know
+        yet is waited for.
+        """
+        with self.lock:
+            entity = self.items.get(id)
+
+        if entity is not None:
+            return entity
+
+        result = self.fetch(('id', '=', id))
+        if result or not timeout:
+            return result[0] if result else None
+
+        with self.lock:
+            self.cv.wait_for(lambda: id in self.items, timeout)
+            entity = self.items.get(id)
+
+        if entity is not None:
+            return entity
+
+        result = self.fetch(('id', '=', id))
+        return result[0] if result else None
+
+    def listen(self, id):
+        """
+        Yields (operation, old, new) tuples for every change of entity 'id'.
+        """
+        events = self.add_listener(id)
+        try:
+            while True:
+                yield events.get()
+        finally:
+            self.remove_listener(id, events)
+
+    def wait_for(self, id, condition, timeout=None):
+        events = self.add_listener(id)
+        try:
+            entity = self.get(id)
+            while entity is None or not condition(entity):
+                try:
+                    operation, old, entity = events.get(timeout=timeout)
+                except queue.Empty:
+                    return None
+
+            return entity
+        finally:
+            self.remove_listener(id, events)
+
+    def enforce_update(self, *filter):
+        for i in self.fetch(*filter):
+            self.update(i)
@@ -154,10 +154,11 @@ def post_save(this, status, task):
     if status in ('FINISHED', 'FAILED', 'ABORTED', 'CANCELLED'):
         from freenas.cli.namespace import EntitySubscriberBasedLoadMixin
         if task['result'] is not None and isinstance(this.parent, EntitySubscriberBasedLoadMixin):
-            entity = this.context.entity_subscribers[this.parent.entity_subscriber_name].get(task['result'], remote=True)
+            entity = this.parent.entity_subscriber.get(task['result'], remote=True)
             this.entity[this.parent.primary_key_name] = entity[this.parent.primary_key_name]
 
         this.modified = False
+        this.invalidate_index()
 
 
 def to_list(item):
@@ -245,12 +246,12 @@ def parse_timedelta(s):
 
 
 def objname2id(context, subscriber, name):
-    entity = context.entity_subscribers[subscriber].query(('name', '=', name), single=True)
+    entity = context.entity_subscribers.lookup(subscriber, 'name', name)
     return entity['id'] if entity else None
 
 
 def objid2name(context, subscriber, id):
-    entity = context.entity_subscribers[subscriber].query(('id', '=', id), single=True)
+    entity = context.entity_subscribers.lookup(subscriber, 'id', id)
     return entity['name'] if entity else None
 
 
@@ -262,7 +263,7 @@ def get_localtime_offset():
 
 def get_related(context, name, obj, field):
     id = get(obj, field)
-    thing = context.entity_subscribers[name].query(('id', '=', id), single=True)
+    thing = context.entity_subscribers.lookup(name, 'id', id)
     if not thing:
         return None
 
@@ -270,7 +271,7 @@ def get_related(context, name, obj, field):
 
 
 def set_related(context, name, obj, field, value):
-    thing = context.entity_subscribers[name].query(('name', '=', value), single=True)
+    thing = context.entity_subscribers.lookup(name, 'name', value)
     if not thing:
         from freenas.cli.namespace import CommandException
         raise CommandException('{0} not found'.format(value))
@@ -89,7 +89,7 @@ setup(
     dependency_links=dependency_links,
     entry_points={
         'console_scripts': [
-            'freenas-cli = freenas.cli.repl:main',
+            'freenas-cli = freenas.cli.session:main',
         ],
     },
     setup_requires=['freenas.utils', 'six', 'ply'],
@@ -0,0 +1,32 @@
+import io
+import sys
+import pytest
+
+output = pytest.importorskip('freenas.cli.output')
+
+
+def make_table(calls):
+    def batch_accessor(rows):
+        calls.append(len(rows))
+        return [r['id'] * 10 for r in rows]
+
+    return output.Table([{'id': 1}, {'id': 2}], [
+        output.Table.Column('ID', 'id'),
+        output.Table.Column('Ten', None, name='ten', batch_accessor=batch_accessor)
+    ])
+
+
+def test_table_iter_and_getstate_resolve_batches():
+    calls = []
+    table = make_table(calls)
+    assert list(table) == [{'id': 1, 'ten': 10}, {'id': 2, 'ten': 20}]
+    assert table.__getstate__()['data'] == [[1, 10], [2, 20]]
+    assert calls == [2, 2]
+
+
+def test_json_output_table_uses_current_stdout(monkeypatch):
+    json = pytest.importorskip('freenas.cli.output.json')
+    stream = io.StringIO()
+    monkeypatch.setattr(sys, 'stdout', stream)
+    json.JsonOutputFormatter.output_table(make_table([]))
+    assert '"Ten": "20"' in stream.getvalue()
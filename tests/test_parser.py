@@ -0,0 +1,47 @@
+import pytest
+from freenas.cli.parser import parse, dump_ast, parse_cache, CommandCall
+
+
+SCRIPT = """
+function f(items) {
+    result = []
+    for (i in items) {
+        result = result + [i * 2]
+    }
+    return result
+}
+x = f([1, 2, 3])
+"""
+
+
+def test_node_fields_are_tuples():
+    call = parse('/account user show', '<test>')[0]
+    assert isinstance(call, CommandCall)
+    assert isinstance(call.args, tuple)
+    assert [i.name for i in call.args] == ['/', 'account', 'user', 'show']
+
+    with pytest.raises(AttributeError):
+        call.args = ()
+
+
+def test_parallel_is_contextual():
+    assert parse('parallel = 5', '<test>')[0].name == 'parallel'
+    assert type(parse('parallel for (i in [1]) { echo ${i} }', '<test>')[0]).__name__ == 'ParallelForInStatement'
+
+
+def test_evaluating_cached_ast_keeps_it_intact():
+    repl = pytest.importorskip('freenas.cli.repl')
+    parse_cache.clear()
+    ast = parse(SCRIPT, '<test>')
+    before = dump_ast(ast)
+
+    context = repl.Context()
+    ml = repl.MainLoop(context)
+    context.ml = ml
+    context.variables.set('abort_on_errors', True)
+    ml.eval_block(ast)
+    ml.eval_block(parse(SCRIPT, '<test>'))
+
+    assert context.global_env['x'].value == [2, 4, 6]
+    assert parse_cache.stats()['hits'] == 1
+    assert dump_ast(parse(SCRIPT, '<test>')) == before
@@ -0,0 +1,14 @@
+import pytest
+
+pytest.importorskip('freenas.dispatcher')
+repl = pytest.importorskip('freenas.cli.repl')
+
+
+def test_pipe_only_commands_are_not_builtins():
+    for name in repl.PIPE_ONLY_COMMANDS:
+        assert name in repl.MainLoop.pipe_commands
+        assert name not in repl.MainLoop.builtin_commands
+
+
+def test_filtering_commands_are_builtins():
+    assert repl.MainLoop.builtin_commands['search'] is repl.MainLoop.pipe_commands['search']
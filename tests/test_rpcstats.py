@@ -0,0 +1,39 @@
+from freenas.cli.rpcstats import RpcStats
+
+
+def test_task_finished_before_submit_returns():
+    stats = RpcStats()
+
+    def submit():
+        # FINISHED update handled before task.submit returned
+        stats.task_finished(7, 'FINISHED')
+        return 7
+
+    assert stats.submit_task('volume.create', ('tank',), submit) == 7
+    assert stats.counters['task']['volume.create'].count == 1
+    assert stats.tasks == {}
+    assert stats.finished_early == {}
+
+
+def test_task_finished_after_submit():
+    stats = RpcStats()
+    stats.submit_task('volume.create', ('tank',), lambda: 8)
+    assert 8 in stats.tasks
+
+    stats.task_finished(8, 'FAILED')
+    assert stats.counters['task']['volume.create'].errors == 1
+    assert stats.tasks == {}
+
+
+def test_unknown_tasks_are_not_kept():
+    stats = RpcStats()
+    stats.task_finished(9, 'FINISHED')
+    assert stats.finished_early == {}
+    assert not stats.counters['task']
+
+
+def test_reset_clears_tasks():
+    stats = RpcStats()
+    stats.submit_task('volume.create', (), lambda: 10)
+    stats.reset()
+    assert stats.tasks == {}
@@ -0,0 +1,30 @@
+import os
+import socket
+import pytest
+from freenas.cli.session import check_private_dir, check_peer, peer_uid
+
+
+def test_private_dir(tmp_path):
+    path = tmp_path / 'session'
+    path.mkdir(mode=0o700)
+    check_private_dir(str(path))
+
+    path.chmod(0o755)
+    with pytest.raises(PermissionError):
+        check_private_dir(str(path))
+
+
+def test_private_dir_symlink(tmp_path):
+    target = tmp_path / 'target'
+    target.mkdir(mode=0o700)
+    link = tmp_path / 'link'
+    link.symlink_to(target)
+    with pytest.raises(PermissionError):
+        check_private_dir(str(link))
+
+
+def test_peer_is_current_user():
+    a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    with a, b:
+        assert peer_uid(a) in (None, os.getuid())
+        check_peer(a)
@@ -0,0 +1,80 @@
+import time
+import pytest
+
+pytest.importorskip('freenas.utils')
+from freenas.cli.subscriber import ScopedEntitySubscriber
+
+
+SCOPE = [('state', 'nin', ['FINISHED', 'FAILED', 'ABORTED'])]
+
+
+class FakeClient(object):
+    def __init__(self, entities):
+        self.entities = entities
+        self.handler = None
+
+    def register_event_handler(self, name, handler):
+        self.handler = handler
+        return handler
+
+    def unregister_event_handler(self, name, handler):
+        self.handler = None
+
+    def call_sync(self, method, filter):
+        ids = [v if op == 'in' else [v] for f, op, v in filter if f == 'id']
+        if not ids:
+            return [i for i in self.entities.values() if i['state'] not in SCOPE[0][2]]
+
+        return [self.entities[i] for i in ids[0] if i in self.entities]
+
+
+def started(client):
+    subscriber = ScopedEntitySubscriber(client, 'task', SCOPE)
+    subscriber.start()
+    subscriber.wait_ready()
+    return subscriber
+
+
+def test_task_first_seen_finished_is_reported():
+    client = FakeClient({1: {'id': 1, 'state': 'FINISHED'}})
+    subscriber = started(client)
+    added = []
+    subscriber.on_add.add(added.append)
+    events = subscriber.add_listener(1)
+
+    subscriber.on_changed({'operation': 'create', 'ids': [1]})
+    operation, old, new = events.get(timeout=5)
+
+    assert operation == 'create'
+    assert new['state'] == 'FINISHED'
+    assert added == [new]
+    assert not subscriber.holds(1)
+    subscriber.stop()
+
+
+def test_task_leaving_scope_is_reported_and_dropped():
+    client = FakeClient({2: {'id': 2, 'state': 'EXECUTING'}})
+    subscriber = started(client)
+    assert subscriber.holds(2)
+
+    updated = []
+    subscriber.on_update.add(lambda old, new: updated.append(new))
+    events = subscriber.add_listener(2)
+    client.entities[2] = {'id': 2, 'state': 'FINISHED'}
+    subscriber.on_changed({'operation': 'update', 'ids': [2]})
+    operation, old, new = events.get(timeout=5)
+
+    assert operation == 'update'
+    assert updated == [new]
+    assert not subscriber.holds(2)
+    subscriber.stop()
+
+
+def test_get_returns_finished_task_without_waiting():
+    client = FakeClient({3: {'id': 3, 'state': 'FINISHED'}})
+    subscriber = started(client)
+    start = time.monotonic()
+
+    assert subscriber.get(3, timeout=30)['state'] == 'FINISHED'
+    assert time.monotonic() - start < 5
+    subscriber.stop()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+#+
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+"""
+Compares the compiled script evaluator against the tree-walking
+interpreter of an older revision on a few loop-heavy scripts.
+
+The baseline tree is exported from git into a temporary directory and
+every revision is measured in its own interpreter. Does not need a
+running middleware - only the script language builtins are exercised.
+"""
+
+import os
+import sys
+import io
+import json
+import tarfile
+import argparse
+import tempfile
+import subprocess
+import time
+
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+SCRIPTS = {
+    'for': """
+        total = 0
+        for (i = 0; i < 20000; i = i + 1) {
+            total = total + i * 2
+        }
+    """,
+    'while': """
+        i = 0
+        while (i < 20000) {
+            i = i + 1
+            if (i % 2 == 0) {
+                i = i + 1
+            }
+        }
+    """,
+    'calls': """
+        function fib(n) {
+            if (n < 2) {
+                return n
+            }
+            return fib(n - 1) + fib(n - 2)
+        }
+        fib(16)
+    """,
+    'collections': """
+        rows = []
+        for (i = 0; i < 5000; i = i + 1) {
+            rows = rows + [{"id": i, "name": str(i)}]
+        }
+        for (row in rows) {
+            x = row["name"]
+        }
+    """,
+}
+
+
+def child(repeat, names):
+    from freenas.cli.parser import parse
+    from freenas.cli.repl import Context, MainLoop
+
+    context = Context()
+    ml = MainLoop(context)
+    context.ml = ml
+    context.variables.set('abort_on_errors', True)
+
+    results = {}
+    for name in names:
+        ast = parse(SCRIPTS[name], '<{0}>'.format(name))
+        best = None
+        for _ in range(repeat):
+            context.global_env.clear()
+            start = time.perf_counter()
+            ml.eval_block(ast)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        results[name] = best
+
+    print(json.dumps(results))
+
+
+def find_baseline():
+    # Last revision evaluating scripts with MainLoop.interpret() is the
+    # parent of the commit which replaced it with the compiler
+    out = subprocess.check_output(
+        ['git', 'log', '--reverse', '--format=%H', '-S', 'class Compiler', '--', 'freenas/cli/repl.py'],
+        cwd=TOPDIR
+    )
+    commits = out.decode('utf-8').split()
+    return commits[0] + '^' if commits else None
+
+
+def export(revision, path):
+    archive = subprocess.check_output(['git', 'archive', revision, 'freenas'], cwd=TOPDIR)
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(path)
+
+
+def sample(path, repeat, names):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [path, os.environ.get('PYTHONPATH')])))
+    out = subprocess.check_output(
+        [sys.executable, __file__, '--child', '-r', str(repeat)] + names,
+        env=env
+    )
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', metavar='REPEAT', type=int, default=5)
+    parser.add_argument('-b', metavar='REVISION', help='baseline git revision (default: last one using MainLoop.interpret())')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('scripts', nargs='*', default=sorted(SCRIPTS))
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.r, args.scripts)
+        return
+
+    baseline = args.b or find_baseline()
+    if not baseline:
+        parser.error('cannot find the interpreter revision, pass it with -b')
+
+    with tempfile.TemporaryDirectory() as path:
+        export(baseline, path)
+        interpreted = sample(path, args.r, args.scripts)
+
+    compiled = sample(TOPDIR, args.r, args.scripts)
+
+    print('{0:<16}{1:>14}{2:>14}{3:>10}'.format('script', 'interpreted', 'compiled', 'speedup'))
+    for name in args.scripts:
+        print('{0:<16}{1:>13.4f}s{2:>13.4f}s{3:>9.2f}x'.format(
+            name, interpreted[name], compiled[name], interpreted[name] / compiled[name]
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#+
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+"""
+Measures CLI startup up to the point where the first namespace is
+resolved, with and without a warm plugin manifest.
+
+Every sample runs in a fresh interpreter, so that plugin modules are
+really imported each time. Does not need a running middleware.
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import time
+
+
+def child(manifest, namespace):
+    start = time.perf_counter()
+    from freenas.cli import repl
+    imported = time.perf_counter()
+
+    repl.PLUGIN_MANIFEST_FILE = manifest
+    context = repl.Context()
+    context.read_middleware_config_file(None)
+    context.discover_plugins()
+    discovered = time.perf_counter()
+
+    context.root_ns.get_index()[0].get(namespace)
+    resolved = time.perf_counter()
+
+    print(json.dumps({
+        'import': imported - start,
+        'discover': discovered - imported,
+        'resolve': resolved - discovered,
+        'total': resolved - start,
+        'plugins': len(context.plugins)
+    }))
+
+
+def sample(manifest, namespace):
+    out = subprocess.check_output([sys.executable, __file__, '--child', manifest, namespace])
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', metavar='REPEAT', type=int, default=5)
+    parser.add_argument('--child', nargs=2, metavar=('MANIFEST', 'NAMESPACE'), help=argparse.SUPPRESS)
+    parser.add_argument('namespace', nargs='?', default='system')
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    manifest = os.path.join(tempfile.mkdtemp(), 'plugins.json')
+    results = {'cold': [], 'warm': []}
+    for _ in range(args.r):
+        if os.path.exists(manifest):
+            os.unlink(manifest)
+
+        results['cold'].append(sample(manifest, args.namespace))
+        results['warm'].append(sample(manifest, args.namespace))
+
+    print('{0:<8}{1:>10}{2:>10}{3:>10}{4:>10}{5:>9}'.format(
+        'manifest', 'import', 'discover', 'resolve', 'total', 'plugins'
+    ))
+    for name, samples in sorted(results.items()):
+        best = min(samples, key=lambda s: s['total'])
+        print('{0:<8}{1:>9.3f}s{2:>9.3f}s{3:>9.3f}s{4:>9.3f}s{5:>9}'.format(
+            name, best['import'], best['discover'], best['resolve'], best['total'], best['plugins']
+        ))
+
+
+if __name__ == '__main__':
+    main()